@@ -0,0 +1,208 @@
+"""
+Local stand-ins for Gemini, Imagen and long-audio Text-to-Speech.
+
+They answer the pipeline's requests the way the real services do, in shape if
+not in content, after a configurable latency: Gemini echoes every <TEXT> of a
+prompt back as the translation its response schema asks for and reports token
+usage, Imagen returns a fixed PNG and the TTS client writes a synthetic WAV of
+the length the text would take to read into the bucket once its operation
+finishes. Nothing is sent over the network.
+"""
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import wave
+from types import SimpleNamespace
+from typing import Callable, Optional
+
+import numpy as np
+
+from utils.rate_limit import estimate_tokens
+
+# A <TEXT> field of a prompt, the instructions only mention the tag inline
+_TEXT_FIELD = re.compile(r'<TEXT(?: id="([^"]*)")?>[ \t]*\n(.*?)\n\s*</TEXT>', re.S)
+
+SAMPLE_RATE = 24000
+
+
+def _generation_config(config) -> dict:
+    if config is None:
+        return {}
+    if hasattr(config, 'to_dict'):
+        return config.to_dict()
+    return dict(config)
+
+
+def _is_object(schema: dict) -> bool:
+    return str(schema.get('type_', schema.get('type', ''))).lower() == 'object'
+
+
+class FakeGenerativeModel:
+    """
+    Answers ``generate_content`` like Gemini after ``latency`` plus the time to produce the output.
+
+    Args:
+        latency: Seconds before the first token
+        tokens_per_second: Output token rate
+        output_ratio: Length of a translation relative to its source text
+        sleep: Function used to wait out the latency
+    """
+
+    def __init__(self, latency: float = 0.5, tokens_per_second: float = 200.0, output_ratio: float = 1.0,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.output_ratio = output_ratio
+        self.sleep = sleep
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _translate(self, text: str, code: str) -> str:
+        size = max(1, int(len(text) * self.output_ratio))
+        body = (text * (size // max(1, len(text)) + 1))[:size]
+        return f'[{code}] {body}'
+
+    def _answer(self, prompt: str, schema: Optional[dict]):
+        texts = [(chunk_id, text.strip()) for chunk_id, text in _TEXT_FIELD.findall(prompt)]
+        if not schema:
+            # summary prompts ask for plain JSON without a schema
+            words = (texts[0][1] if texts else prompt).split()
+            return {'summary': ' '.join(words[:60])}
+        answer = schema['properties']['answer']['properties']
+        if any(_is_object(field) for field in answer.values()):
+            by_id = {chunk_id: text for chunk_id, text in texts}
+            return {'answer': {chunk_id: {code: self._translate(by_id.get(chunk_id, ''), code)
+                                          for code in field['properties']}
+                               for chunk_id, field in answer.items()}}
+        text = texts[0][1] if texts else ''
+        return {'answer': {code: self._translate(text, code) for code in answer}}
+
+    def generate_content(self, contents, generation_config=None, **kwargs):
+        with self._lock:
+            self.calls += 1
+        config = _generation_config(generation_config)
+        text = json.dumps(self._answer(contents, config.get('response_schema')), ensure_ascii=False)
+        output_tokens = estimate_tokens(text)
+        finish_reason = 'STOP'
+        max_output_tokens = config.get('max_output_tokens')
+        if max_output_tokens and output_tokens > max_output_tokens:
+            # cut off mid-answer like the real model, the JSON no longer parses
+            output_tokens = max_output_tokens
+            text = text[:max_output_tokens * 4]
+            finish_reason = 'MAX_TOKENS'
+        self.sleep(self.latency + output_tokens / self.tokens_per_second)
+        input_tokens = estimate_tokens(contents)
+        return SimpleNamespace(
+            text=text,
+            candidates=[SimpleNamespace(finish_reason=SimpleNamespace(name=finish_reason))],
+            usage_metadata=SimpleNamespace(prompt_token_count=input_tokens, candidates_token_count=output_tokens,
+                                           total_token_count=input_tokens + output_tokens))
+
+
+class FakeImageModel:
+    """
+    Answers ``generate_images`` with the PNG at ``image_path`` after ``latency`` seconds.
+
+    Args:
+        image_path: PNG returned for every prompt
+        latency: Seconds per request
+    """
+
+    def __init__(self, image_path: str, latency: float = 1.0, sleep: Callable[[float], None] = time.sleep):
+        with open(image_path, 'rb') as f:
+            self.png = f.read()
+        self.latency = latency
+        self.sleep = sleep
+        self.calls = 0
+
+    def generate_images(self, prompt, number_of_images=1, **kwargs):
+        self.calls += 1
+        self.sleep(self.latency)
+        image = SimpleNamespace(_mime_type='image/png', _image_bytes=self.png)
+        return SimpleNamespace(images=[image] * number_of_images)
+
+
+def write_wav(path: str, seconds: float, rate: int = SAMPLE_RATE, frequency: float = 220.0):
+    """Mono 16-bit WAV of a quiet tone that pauses every other second, so it has speech-like gaps."""
+    second = np.arange(rate) / rate
+    tone = (0.2 * np.sin(2 * np.pi * frequency * second) * 32767).astype('<i2').tobytes()
+    silence = bytes(2 * rate)
+    frames = int(seconds * rate)
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        written = 0
+        while written < frames:
+            block = (tone if (written // rate) % 2 == 0 else silence)[:2 * (frames - written)]
+            f.writeframes(block)
+            written += len(block) // 2
+
+
+class FakeOperation:
+    """Long-running operation future that completes when the synthetic audio has been written."""
+
+    def __init__(self, name: str):
+        # the underlying operation proto, only its name is read
+        self.operation = SimpleNamespace(name=name)
+        self._done = threading.Event()
+        self._error = None
+
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def exception(self):
+        return self._error
+
+    def finish(self, error: Optional[BaseException] = None):
+        self._error = error
+        self._done.set()
+
+
+class FakeLongAudioClient:
+    """
+    Answers ``synthesize_long_audio`` by writing a WAV into ``bucket`` in the background.
+
+    The audio lasts as long as the text takes to read at ``chars_per_second`` and is ready after ``latency``
+    plus its length divided by ``speedup``.
+
+    Args:
+        bucket: Bucket the ``output_gcs_uri`` objects are written to
+        latency: Seconds before any operation finishes
+        speedup: Seconds of audio synthesized per second
+        chars_per_second: Reading speed that sets the length of the audio
+    """
+
+    def __init__(self, bucket, latency: float = 2.0, speedup: float = 50.0, chars_per_second: float = 15.0):
+        self.bucket = bucket
+        self.latency = latency
+        self.speedup = speedup
+        self.chars_per_second = chars_per_second
+        self.calls = 0
+
+    def synthesize_long_audio(self, request):
+        self.calls += 1
+        # gs://<bucket>/<key>/audio.wav
+        name = request.output_gcs_uri.split('://', 1)[-1].split('/', 1)[1]
+        seconds = max(1.0, len(request.input.text) / self.chars_per_second)
+        operation = FakeOperation(f'operations/fake-{self.calls}')
+        timer = threading.Timer(self.latency + seconds / self.speedup, self._write, (operation, name, seconds))
+        timer.daemon = True
+        timer.start()
+        return operation
+
+    def _write(self, operation: FakeOperation, name: str, seconds: float):
+        fd, path = tempfile.mkstemp(suffix='.wav')
+        os.close(fd)
+        try:
+            write_wav(path, seconds)
+            self.bucket.blob(name).upload_from_filename(path, content_type='audio/wav')
+        except Exception as e:
+            operation.finish(e)
+        else:
+            operation.finish()
+        finally:
+            os.remove(path)
@@ -0,0 +1,272 @@
+"""
+Offline end-to-end benchmark of the curation pipeline and the part renderer.
+
+Runs ``ContentCurator.curate`` over the first files of a corpus, by default
+``data/mahabharat``, with the fakes from ``benchmark.fakes`` standing in for
+Gemini, Imagen and long-audio TTS and a local bucket standing in for GCS, then
+re-renders every part with ``Publisher.process_video``. Throughput, per-stage
+latency from ``utils.metrics`` and peak RSS are written as JSON so a run can be
+compared against the results of another commit:
+
+    python -m benchmark.run --files 2 --output after.json --baseline before.json
+"""
+import argparse
+import json
+import logging
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+
+from benchmark.fakes import FakeGenerativeModel, FakeImageModel, FakeLongAudioClient, write_wav
+from utils.metrics import metrics
+from utils.rate_limit import RateLimiter
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+DEFAULT_SOURCE = os.path.join(REPO_ROOT, 'data', 'mahabharat')
+CONTENT_ID = 'benchmark'
+RESULTS_VERSION = 1
+
+# Throughput and memory figures compared between runs, higher is better for the first two
+COMPARED = (('curate', 'chunks_per_min'), ('render', 'renders_per_min'), ('peak_rss_mb', 'self'),
+            ('peak_rss_mb', 'children'))
+
+
+@contextmanager
+def _environ(values: Dict[str, str]):
+    saved = {key: os.environ.get(key) for key in values}
+    os.environ.update(values)
+    try:
+        yield
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+def _isolated_env(workdir: str, storage: str) -> Dict[str, str]:
+    # every piece of state the pipeline keeps goes into the work directory
+    return {
+        'TMP_DIR': os.path.join(workdir, 'tmp'),
+        'STORAGE_BACKEND': storage,
+        'STORAGE_ROOT': os.path.join(workdir, 'buckets'),
+        'GCS_BUCKET': 'gs://itihasa-benchmark',
+        'GCP_PARENT_PROJECT_LOCATION': 'projects/benchmark/locations/local',
+        'TRANSLATION_CACHE_PATH': os.path.join(workdir, 'translations.db'),
+        'JOB_LEDGER_PATH': os.path.join(workdir, 'jobs.db'),
+        'CORPUS_INDEX_PATH': os.path.join(workdir, 'index.json'),
+        'ARTIFACT_CATALOG_PATH': os.path.join(workdir, 'artifacts.db'),
+        'COVER_CACHE_DIR': os.path.join(workdir, 'covers'),
+        'METRICS_DIR': os.path.join(workdir, 'metrics'),
+    }
+
+
+def _copy_source(source: str, files: int, target: str) -> List[str]:
+    os.makedirs(target, exist_ok=True)
+    names = sorted(name for name in os.listdir(source) if os.path.isfile(os.path.join(source, name)))[:files]
+    for name in names:
+        shutil.copy(os.path.join(source, name), os.path.join(target, name))
+    return names
+
+
+def _unlimited(name: str) -> RateLimiter:
+    return RateLimiter(name, requests_per_minute=1e9, tokens_per_minute=1e12)
+
+
+def _phase(seconds: float, count: int, unit: str) -> dict:
+    summary = metrics.summary()
+    values = summary['metrics']
+    return {
+        'seconds': round(seconds, 3),
+        unit: count,
+        f'{unit}_per_min': round(count * 60 / seconds, 3) if seconds > 0 else None,
+        'stages': summary['stages'],
+        'rate_limit_waits': summary['rate_limit_waits'],
+        'model_tokens': values.get('model_tokens_total', {}),
+        'transfer_bytes': values.get('transfer_bytes_total', {}),
+        'retries': values.get('retries_total', {}),
+        'queue_depth_max': values.get('queue_depth_max', {}),
+    }
+
+
+def _peak_rss_mb() -> Dict[str, float]:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return {'self': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1),
+            'children': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale, 1)}
+
+
+def _commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, check=True).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(source: str = DEFAULT_SOURCE, files: int = 1, languages: Iterable[str] = ('English',),
+                  pack_tokens: int = 0, model_latency: float = 0.5, tokens_per_second: float = 200.0,
+                  tts_latency: float = 2.0, tts_speedup: float = 50.0, tts_poll: float = 0.5,
+                  image_latency: float = 1.0, storage: str = 'local', rate_limits: bool = False,
+                  render: bool = True, workdir: Optional[str] = None) -> dict:
+    """
+    Run the pipeline against the fakes and return the results.
+
+    Args:
+        source: Corpus folder, its first ``files`` files in sorted order are curated
+        files: Number of source files to curate
+        languages: Target languages, names from LANG_CODE_MAP
+        pack_tokens: Translation packing budget passed to the content config, 0 disables packing
+        model_latency: Seconds before a fake Gemini or summary answer starts
+        tokens_per_second: Output token rate of the fake Gemini
+        tts_latency: Seconds before a fake synthesis finishes, on top of its audio length divided by ``tts_speedup``
+        tts_speedup: Seconds of audio the fake TTS synthesizes per second
+        tts_poll: First poll delay of the synthesis tracker
+        image_latency: Seconds per fake Imagen request
+        storage: Bucket backend, ``local`` or ``memory``
+        rate_limits: Keep the configured API rate limits instead of lifting them
+        render: Also re-render every part with Publisher.process_video
+        workdir: Directory for the bucket and pipeline state, a temporary directory removed afterwards by default
+    """
+    languages = list(languages)
+    settings = {'source': source, 'files': files, 'languages': languages, 'pack_tokens': pack_tokens,
+                'model_latency': model_latency, 'tokens_per_second': tokens_per_second, 'tts_latency': tts_latency,
+                'tts_speedup': tts_speedup, 'tts_poll': tts_poll, 'image_latency': image_latency,
+                'storage': storage, 'rate_limits': rate_limits}
+    temporary = workdir is None
+    workdir = workdir or tempfile.mkdtemp(prefix='itihasa-benchmark-')
+    try:
+        with _environ(_isolated_env(workdir, storage)):
+            return dict(version=RESULTS_VERSION, commit=_commit(), started=time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                        settings=settings, source_files=_copy_source(source, files, os.path.join(workdir, 'source')),
+                        **_run(workdir, languages, settings, render), peak_rss_mb=_peak_rss_mb())
+    finally:
+        if temporary:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _run(workdir: str, languages: List[str], settings: dict, render: bool) -> dict:
+    from config import LANG_CODE_MAP, ContentConfig
+    from worker.orchestrator import ContentCurator
+    from worker.tts_tracker import SynthesisTracker
+
+    config = ContentConfig(name='Benchmark', id=CONTENT_ID, source_path=os.path.join(workdir, 'source'),
+                           source_type='video', source_lang='Sanskrit', background_music=[], translations=languages,
+                           publishing_platforms=['youtube'], generate_ai_description=False,
+                           generate_milestones=False, split_into_parts=True, from_chunk=0,
+                           pack_tokens=settings['pack_tokens'])
+    curator = ContentCurator(config)
+    publisher = curator.publisher
+    model = FakeGenerativeModel(latency=settings['model_latency'], tokens_per_second=settings['tokens_per_second'])
+    curator.gen_model = publisher.gen_model = model
+    publisher.img_model = FakeImageModel(os.path.join(REPO_ROOT, 'default_cover.png'),
+                                         latency=settings['image_latency'])
+    curator.tts_client = FakeLongAudioClient(curator.bucket, latency=settings['tts_latency'],
+                                             speedup=settings['tts_speedup'])
+    curator.tts_tracker = SynthesisTracker(curator.bucket, logger=curator.logger,
+                                           initial_delay=settings['tts_poll'], max_delay=10 * settings['tts_poll'])
+    publisher.default_cover = os.path.join(REPO_ROOT, 'default_cover.png')
+    publisher.bgm = os.path.join(workdir, 'bgm.wav')
+    write_wav(publisher.bgm, 30)
+    if not settings['rate_limits']:
+        curator.vertex_limiter = publisher.vertex_limiter = _unlimited('vertex')
+        curator.tts_limiter = _unlimited('tts')
+        publisher.imagen_limiter = _unlimited('imagen')
+
+    # chunks are counted as the pipeline pulls them from the corpus
+    chunks = []
+    iter_chunks = curator._iter_chunks
+    curator._iter_chunks = lambda: (chunks.append(item[0]) or item for item in iter_chunks())
+
+    metrics.reset()
+    started = time.monotonic()
+    curator.curate()
+    results = {'curate': dict(_phase(time.monotonic() - started, len(chunks), 'chunks'), model_calls=model.calls)}
+    if not render:
+        return results
+
+    keys = []
+    for language in languages:
+        code = LANG_CODE_MAP[language]
+        publisher.catalog.sync(f'{code}/{CONTENT_ID}/')
+        keys += publisher.catalog.keys(code, CONTENT_ID, 'audio.wav')
+    for key in keys:
+        # the curate phase already rendered every part, its video is removed so it is rendered again
+        video = publisher.staging_video_path % key
+        if publisher.bucket.blob(video).exists():
+            publisher.bucket.blob(video).delete()
+        publisher.catalog.forget(video)
+    metrics.reset()
+    started = time.monotonic()
+    failed = 0
+    for key in keys:
+        try:
+            publisher.process_video(key)
+        except Exception as e:
+            failed += 1
+            curator.logger.error(f"Benchmark render of {key} failed: {e}")
+    results['render'] = dict(_phase(time.monotonic() - started, len(keys) - failed, 'renders'), failed=failed)
+    return results
+
+
+def compare(baseline: dict, results: dict) -> List[str]:
+    """One line per compared figure with its change from ``baseline``."""
+    lines = []
+    for section, field in COMPARED:
+        before = (baseline.get(section) or {}).get(field)
+        after = (results.get(section) or {}).get(field)
+        if before is None or after is None:
+            continue
+        change = f' ({(after - before) / before * 100:+.1f}%)' if before else ''
+        lines.append(f'{section}.{field}: {before} -> {after}{change}')
+    return lines
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline offline against fake cloud services.')
+    parser.add_argument('--source', default=DEFAULT_SOURCE, help='Corpus folder')
+    parser.add_argument('--files', type=int, default=1, help='Number of source files to curate')
+    parser.add_argument('--languages', default='English', help='Comma separated target languages')
+    parser.add_argument('--pack-tokens', type=int, default=0, help='Translation packing budget, 0 disables it')
+    parser.add_argument('--model-latency', type=float, default=0.5, help='Seconds before a model answer starts')
+    parser.add_argument('--tokens-per-second', type=float, default=200.0, help='Model output token rate')
+    parser.add_argument('--tts-latency', type=float, default=2.0, help='Seconds before a synthesis finishes')
+    parser.add_argument('--tts-speedup', type=float, default=50.0, help='Audio seconds synthesized per second')
+    parser.add_argument('--tts-poll', type=float, default=0.5, help='First poll delay of the synthesis tracker')
+    parser.add_argument('--image-latency', type=float, default=1.0, help='Seconds per image request')
+    parser.add_argument('--storage', choices=('local', 'memory'), default='local', help='Bucket backend')
+    parser.add_argument('--rate-limits', action='store_true', help='Keep the configured API rate limits')
+    parser.add_argument('--no-render', action='store_true', help='Skip re-rendering the parts')
+    parser.add_argument('--workdir', help='Keep the bucket and pipeline state in this directory')
+    parser.add_argument('--output', help='Write the results to this file as well as stdout')
+    parser.add_argument('--baseline', help='Results of an earlier run to compare against')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    results = run_benchmark(source=args.source, files=args.files, languages=args.languages.split(','),
+                            pack_tokens=args.pack_tokens, model_latency=args.model_latency,
+                            tokens_per_second=args.tokens_per_second, tts_latency=args.tts_latency,
+                            tts_speedup=args.tts_speedup, tts_poll=args.tts_poll, image_latency=args.image_latency,
+                            storage=args.storage, rate_limits=args.rate_limits, render=not args.no_render,
+                            workdir=args.workdir)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    print(text)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for line in compare(baseline, results):
+            print(line, file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
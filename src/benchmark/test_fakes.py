@@ -0,0 +1,72 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+import wave
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmark.fakes import FakeGenerativeModel, FakeLongAudioClient
+from config import get_packed_translation_prompt, get_packed_translation_schema, get_part_summary_for_img_prompt, \
+    get_translation_prompt, get_translation_schema
+from utils.blobstore import MemoryBucket
+from utils.model_response import completed, parse_answer
+from utils import clients
+
+
+class TestFakes(unittest.TestCase):
+
+    def setUp(self):
+        self.slept = []
+        self.model = FakeGenerativeModel(latency=0.5, tokens_per_second=100, sleep=self.slept.append)
+
+    def _generate(self, prompt, schema=None, max_output_tokens=4000):
+        return self.model.generate_content(prompt, generation_config=clients.generation_config(
+            max_output_tokens=max_output_tokens, response_mime_type="application/json", response_schema=schema))
+
+    def test_translation_answers_every_language(self):
+        codes = {'English': 'en-US', 'Hindi': 'hi-IN'}
+        response = self._generate(get_translation_prompt('', 'नारायणं नमस्कृत्य', 'Sanskrit', codes),
+                                  get_translation_schema(codes.values()))
+        answer = completed(parse_answer(response.text), codes.values())
+        self.assertEqual(answer, {'en-US': '[en-US] नारायणं नमस्कृत्य', 'hi-IN': '[hi-IN] नारायणं नमस्कृत्य'})
+        output = response.usage_metadata.candidates_token_count
+        self.assertEqual(self.slept, [0.5 + output / 100])
+
+    def test_packed_translation_answers_every_chunk(self):
+        chunks = [(1, 'first verse'), (2, 'second verse')]
+        response = self._generate(get_packed_translation_prompt(chunks, 'Sanskrit', {'English': 'en-US'}),
+                                  get_packed_translation_schema([1, 2], ['en-US']))
+        self.assertEqual(parse_answer(response.text), {'1': {'en-US': '[en-US] first verse'},
+                                                        '2': {'en-US': '[en-US] second verse'}})
+
+    def test_answers_over_the_output_budget_are_cut_off(self):
+        response = self._generate(get_translation_prompt('', 'verse ' * 200, 'Sanskrit', {'English': 'en-US'}),
+                                  get_translation_schema(['en-US']), max_output_tokens=50)
+        self.assertEqual(response.candidates[0].finish_reason.name, 'MAX_TOKENS')
+        self.assertEqual(response.usage_metadata.candidates_token_count, 50)
+
+    def test_summary_without_schema(self):
+        response = self.model.generate_content(get_part_summary_for_img_prompt('the kurus gather'))
+        self.assertIn('"summary": "the kurus gather"', response.text)
+
+    def test_synthesis_writes_audio_of_the_text_length(self):
+        bucket = MemoryBucket('test')
+        client = FakeLongAudioClient(bucket, latency=0, speedup=1000, chars_per_second=10)
+        operation = client.synthesize_long_audio(SimpleNamespace(input=SimpleNamespace(text='x' * 30),
+                                                                 output_gcs_uri='gs://test/k/audio.wav'))
+        deadline = time.monotonic() + 5
+        while not operation.done() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertIsNone(operation.exception())
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'audio.wav')
+            bucket.blob('k/audio.wav').download_to_filename(path)
+            with wave.open(path) as f:
+                self.assertAlmostEqual(f.getnframes() / f.getframerate(), 3.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmark.run import compare, run_benchmark
+from publisher.render import find_ffmpeg
+
+
+class TestBenchmark(unittest.TestCase):
+
+    @unittest.skipIf(find_ffmpeg() is None, 'ffmpeg is not available')
+    def test_small_corpus_end_to_end(self):
+        with tempfile.TemporaryDirectory() as source:
+            with open(os.path.join(source, 'verses.txt'), 'w', encoding='utf-8') as f:
+                f.write('  नारायणं नमस्कृत्य नरं चैव नरॊत्तमम\n       देवीं सरस्वतीं चैव ततॊ जयम उदीरयेत\n')
+            results = run_benchmark(source=source, model_latency=0, tokens_per_second=1e6, tts_latency=0,
+                                    tts_speedup=1000, tts_poll=0.01, image_latency=0, storage='memory')
+        self.assertEqual(results['source_files'], ['verses.txt'])
+        self.assertEqual(results['curate']['chunks'], 1)
+        self.assertEqual(results['curate']['model_calls'], 2)
+        self.assertEqual(results['render']['renders'], 1)
+        self.assertIn('stage=render_video', results['render']['stages'])
+        self.assertGreater(results['peak_rss_mb']['self'], 0)
+
+    def test_compare_reports_changes(self):
+        baseline = {'curate': {'chunks_per_min': 10.0}, 'render': {'renders_per_min': 2.0}}
+        results = {'curate': {'chunks_per_min': 12.0}, 'render': {'renders_per_min': 2.0}}
+        self.assertEqual(compare(baseline, results), ['curate.chunks_per_min: 10.0 -> 12.0 (+20.0%)',
+                                                      'render.renders_per_min: 2.0 -> 2.0 (+0.0%)'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,6 @@
 import os
 import uuid
+from typing import Optional
 
 import yaml
 
@@ -29,6 +30,20 @@ def set_system_env_defaults():
             os.environ[key] = value
 
 
+# Output tokens a translation request may produce
+DEFAULT_MAX_OUTPUT_TOKENS = 4000
+
+# Expected output tokens per input token for every target language, used to size chunks so that
+# the translations into all languages fit in max_output_tokens
+DEFAULT_OUTPUT_TOKEN_RATIO = 1.5
+
+# Bump whenever the translation prompt or request format changes so cached answers for the old prompt are not
+# reused; 2 is the schema-constrained JSON and packed multi-chunk prompt with a max_output_tokens budget
+TRANSLATION_PROMPT_VERSION = 2
+# Bump when the cover summary or image prompt changes, cached covers are keyed by it
+IMAGE_PROMPT_VERSION = 1
+
+
 def get_base_translation_prompt():
     return f"""
         Your a lingual expert and adept at efficient and accurate translations. Given a piece of text or a verse specified in the <TEXT> field in a given language indicated by <INPUT_LANGUAGE>, translate the text into the set of languages specified as the keys of <LANGUAGE_CODE_MAP> dictionary which contains the language name and its specific code using the following guardrails: 
@@ -63,6 +78,64 @@ def get_translation_prompt(part_info, text, lang, target_langs_map):
         """
 
 
+def get_packed_translation_prompt(chunks, lang, target_langs_map):
+    # chunks is a list of (chunk_id, text) translated together in one request
+    texts = "".join(f"""
+        <TEXT id="{chunk_id}">
+        {text}
+        </TEXT>
+        """ for chunk_id, text in chunks)
+    return get_base_translation_prompt() \
+           + "\n" \
+           + f"""
+        The input contains several <TEXT> fields, each identified by its id attribute. Translate every <TEXT> field on its 
+        own and return {{"answer": {{"<id>": {{"<language_code>": "<translated_answer>"}}}}}} with one entry per id. 
+        {texts}
+        <INPUT_LANGUAGE>
+        {lang}
+        </INPUT_LANGUAGE>
+        
+        <LANGUAGE_CODE_MAP>
+        {target_langs_map}
+        </LANGUAGE_CODE_MAP
+        """
+
+
+def get_translation_schema(language_codes):
+    # response schema for get_translation_prompt, one translation per language code
+    return {
+        "type": "object",
+        "properties": {"answer": get_translations_schema(language_codes)},
+        "required": ["answer"],
+    }
+
+
+def get_translations_schema(language_codes):
+    language_codes = list(language_codes)
+    return {
+        "type": "object",
+        "properties": {code: {"type": "string"} for code in language_codes},
+        "required": language_codes,
+    }
+
+
+def get_packed_translation_schema(chunk_ids, language_codes):
+    # response schema for get_packed_translation_prompt, one object of translations per chunk id
+    chunk_ids = [str(chunk_id) for chunk_id in chunk_ids]
+    translations = get_translations_schema(language_codes)
+    return {
+        "type": "object",
+        "properties": {
+            "answer": {
+                "type": "object",
+                "properties": {chunk_id: translations for chunk_id in chunk_ids},
+                "required": chunk_ids,
+            }
+        },
+        "required": ["answer"],
+    }
+
+
 def get_part_summary_for_img_prompt(text):
     return f"""
         Given the TEXT below in <TEXT> field in a given language, generate a succinct summary of the text that can be 
@@ -119,6 +192,14 @@ def get_image_prompt(text, description):
                 """
 
 
+# Default number of items each curation stage works on at once, see worker.pipeline
+PIPELINE_STAGES = {
+    "translate": 1,
+    "synthesize": 2,
+    "render": 1,
+    "upload": 2,
+}
+
 PLATFORMS = {
     "audio": ["youtube", "soundcloud", "spotify", "apple_podcasts", "google_podcasts"],
     "video": ["youtube", "vimeo"]
@@ -128,7 +209,9 @@ PLATFORMS = {
 class ContentConfig:
     def __init__(self, name, id, source_path, source_type, source_lang, background_music, translations,
                  publishing_platforms,
-                 generate_ai_description, generate_milestones, split_into_parts, from_chunk):
+                 generate_ai_description, generate_milestones, split_into_parts, from_chunk,
+                 stage_concurrency=None, queue_size=8, pack_tokens=0,
+                 max_output_tokens=DEFAULT_MAX_OUTPUT_TOKENS, max_input_tokens=None):
         self.name = name
         self.id = id
         self.source_path = source_path
@@ -141,8 +224,18 @@ class ContentConfig:
         self.generate_milestones = generate_milestones
         self.split_into_parts = split_into_parts
         self.from_chunk = from_chunk
+        self.stage_concurrency = dict(PIPELINE_STAGES, **(stage_concurrency or {}))
+        self.queue_size = queue_size
+        # input token budget for packing several chunks into one translation request, 0 disables packing
+        self.pack_tokens = pack_tokens
+        self.max_output_tokens = max_output_tokens
+        # input token budget of a chunk, None to size chunks so every language's translation fits the output
+        # budget, see chunk_tokens
+        self.max_input_tokens = max_input_tokens
         self.validate_translations()
         self.validate_publishing_platforms()
+        self.validate_pipeline()
+        self.validate_translation()
         set_system_env_defaults()
 
     def validate_publishing_platforms(self):
@@ -155,9 +248,44 @@ class ContentConfig:
             if translation not in LANG_CODE_MAP:
                 raise ValueError(f"Invalid translation language: {translation}")
 
+    def validate_pipeline(self):
+        for stage, concurrency in self.stage_concurrency.items():
+            if stage not in PIPELINE_STAGES:
+                raise ValueError(f"Invalid pipeline stage: {stage}")
+            if not isinstance(concurrency, int) or concurrency < 1:
+                raise ValueError(f"Invalid concurrency for pipeline stage {stage}: {concurrency}")
+        if not isinstance(self.queue_size, int) or self.queue_size < 1:
+            raise ValueError(f"Invalid pipeline queue size: {self.queue_size}")
+
+    def validate_translation(self):
+        if not isinstance(self.pack_tokens, int) or self.pack_tokens < 0:
+            raise ValueError(f"Invalid translation pack_tokens: {self.pack_tokens}")
+        for name in ('max_output_tokens', 'max_input_tokens'):
+            value = getattr(self, name)
+            if name == 'max_input_tokens' and value is None:
+                continue
+            if not isinstance(value, int) or value < 1:
+                raise ValueError(f"Invalid translation {name}: {value}")
+
+    def chunk_tokens(self, output_ratio: Optional[float] = None) -> int:
+        """
+        Input token budget of a chunk: max_input_tokens if set, otherwise sized so the translations into every
+        target language fit in max_output_tokens.
+
+        Args:
+            output_ratio: Output tokens expected per input token for all target languages together, by default
+                DEFAULT_OUTPUT_TOKEN_RATIO for each of them
+        """
+        if self.max_input_tokens:
+            return self.max_input_tokens
+        output_ratio = output_ratio or DEFAULT_OUTPUT_TOKEN_RATIO * max(1, len(self.translations))
+        return max(1, int(self.max_output_tokens / output_ratio))
+
     @classmethod
     def from_dict(cls, data):
         bg_music = data.get('background_music').get('path') if data.get('background_music') else None
+        pipeline = data.get('pipeline') or {}
+        translation = data.get('translation') or {}
         return cls(
             name=data['name'],
             id=data.get('id', uuid.uuid4()),
@@ -170,7 +298,12 @@ class ContentConfig:
             generate_ai_description=data['generate_ai_description'],
             generate_milestones=data['generate_milestones'],
             split_into_parts=data['split_into_parts'],
-            from_chunk=data.get('from_chunk', 0)
+            from_chunk=data.get('from_chunk', 0),
+            stage_concurrency=pipeline.get('concurrency'),
+            queue_size=pipeline.get('queue_size', 8),
+            pack_tokens=translation.get('pack_tokens', 0),
+            max_output_tokens=translation.get('max_output_tokens', DEFAULT_MAX_OUTPUT_TOKENS),
+            max_input_tokens=translation.get('max_input_tokens')
         )
 
 
@@ -12,7 +12,9 @@ with patch('vertexai.init'), \
      patch('google.cloud.texttospeech.TextToSpeechLongAudioSynthesizeClient'), \
      patch('google.cloud.storage.Client'):
     # Now import from the current directory
-    from config import get_base_translation_prompt, get_translation_prompt, ContentConfig, LANG_CODE_MAP
+    from config import get_base_translation_prompt, get_translation_prompt, ContentConfig, LANG_CODE_MAP, \
+        get_packed_translation_prompt, get_packed_translation_schema, \
+        get_translation_schema
 
 
 class TestTranslationPrompts(unittest.TestCase):
@@ -61,6 +63,17 @@ class TestTranslationPrompts(unittest.TestCase):
         # The actual function doesn't include the closing '>' in the LANGUAGE_CODE_MAP tag
         self.assertIn(f"</LANGUAGE_CODE_MAP", prompt)
 
+    def test_get_packed_translation_prompt(self):
+        prompt = get_packed_translation_prompt([(3, "first"), (4, "second")], "Sanskrit", {'Tamil': 'ta-IN'})
+        self.assertIn('<TEXT id="3">', prompt)
+        self.assertIn('<TEXT id="4">', prompt)
+        self.assertIn("second", prompt)
+        schema = get_packed_translation_schema([3, 4], ['ta-IN'])
+        self.assertEqual(schema['properties']['answer']['required'], ['3', '4'])
+        self.assertEqual(schema['properties']['answer']['properties']['3']['required'], ['ta-IN'])
+        schema = get_translation_schema(['ta-IN', 'hi-IN'])
+        self.assertEqual(schema['properties']['answer']['required'], ['ta-IN', 'hi-IN'])
+
 
 class TestContentConfig(unittest.TestCase):
 
@@ -89,6 +102,13 @@ class TestContentConfig(unittest.TestCase):
         self.assertTrue(config.generate_milestones)
         self.assertTrue(config.split_into_parts)
 
+    def test_chunk_tokens(self):
+        config = ContentConfig.from_dict(self.valid_data)
+        self.assertEqual(config.chunk_tokens(), int(config.max_output_tokens / 3.0))
+        self.assertEqual(config.chunk_tokens(output_ratio=4.0), int(config.max_output_tokens / 4.0))
+        config.max_input_tokens = 500
+        self.assertEqual(config.chunk_tokens(output_ratio=4.0), 500)
+
     def test_invalid_translation(self):
         self.valid_data['translations'] = ['InvalidLanguage']
         with self.assertRaises(ValueError) as context:
@@ -101,6 +121,19 @@ class TestContentConfig(unittest.TestCase):
             ContentConfig.from_dict(self.valid_data)
         self.assertIn('Invalid publishing platform', str(context.exception))
 
+    def test_pipeline_concurrency(self):
+        self.valid_data['pipeline'] = {'queue_size': 4, 'concurrency': {'render': 3}}
+        config = ContentConfig.from_dict(self.valid_data)
+        self.assertEqual(config.queue_size, 4)
+        self.assertEqual(config.stage_concurrency['render'], 3)
+        self.assertEqual(config.stage_concurrency['translate'], 1)
+
+    def test_invalid_pipeline_stage(self):
+        self.valid_data['pipeline'] = {'concurrency': {'transcode': 2}}
+        with self.assertRaises(ValueError) as context:
+            ContentConfig.from_dict(self.valid_data)
+        self.assertIn('Invalid pipeline stage', str(context.exception))
+
 
 if __name__ == '__main__':
     unittest.main()
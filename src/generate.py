@@ -2,7 +2,6 @@ import argparse
 import os
 import sys
 from config import parse_config
-from worker.orchestrator import ContentCurator
 
 
 def main():
@@ -12,6 +11,8 @@ def main():
 
     args = parser.parse_args()
     config = parse_config(args.config_path)
+    # imported once the arguments are valid, so --help and config errors do not wait for the cloud libraries
+    from worker.orchestrator import ContentCurator
     orchestrator = ContentCurator(config)
 
     if args.background:
@@ -1,20 +1,19 @@
 import json
+import os
 
-import vertexai
-from vertexai.generative_models import GenerativeModel
-from google.cloud import texttospeech
+from utils import clients
+from utils.translation_cache import TranslationCache
 
 PROJECT_ID = 'prisma-cortex-playground'
 MODEL_ID = "gemini-2.0-flash-001"
 REGION = 'us-central1'
+# Bump whenever the prompt in process changes so cached answers for the old prompt are not reused
+PROMPT_VERSION = 'main-1'
 
-vertexai.init(project=PROJECT_ID, location=REGION)
-gen_model = GenerativeModel(MODEL_ID)
-tts_client = texttospeech.TextToSpeechLongAudioSynthesizeClient()
-audio_config = texttospeech.AudioConfig(
-    audio_encoding=texttospeech.AudioEncoding.LINEAR16,
-    speaking_rate=0.5
-)
+
+def translation_cache() -> TranslationCache:
+    # opened on first use and shared like the clients, importing this module touches neither disk nor env
+    return clients.get_client(('translation_cache',), TranslationCache)
 
 
 def process(text=None, lang=None):
@@ -54,7 +53,14 @@ def process(text=None, lang=None):
         {lang_code_map}
         </LANGUAGE_CODE_MAP
     """
-    response = gen_model.generate_content(contents=_to_english_line_by_line)
+    cache_key = TranslationCache.make_key(text, lang, lang_code_map, MODEL_ID, PROMPT_VERSION)
+    cached = translation_cache().get(cache_key)
+    if cached is not None:
+        return cached, None
+    # the model comes from the process-wide registry on first use, vertexai.init reads these
+    os.environ.setdefault("GCP_PARENT_PROJECT", PROJECT_ID)
+    os.environ.setdefault("GCP_LOCATION", REGION)
+    response = clients.generative_model(MODEL_ID).generate_content(contents=_to_english_line_by_line)
     error = None
     try:
         tx = response.text.replace('```json', '')
@@ -64,6 +70,7 @@ def process(text=None, lang=None):
             error = f'⚡Could not translate...'
             return [], error
         else:
+            translation_cache().put(cache_key, response_dict.get('answer'))
             return response_dict.get('answer'), error
     except Exception as e:
         print(e)
@@ -141,6 +148,13 @@ if __name__ == '__main__':
      बरह्मा सुरगुरुः सथाणुर मनुः कः परमेष्ठ्य अथ
     """, lang="SANSKRIT")
     if txl and type(txl) == dict:
+        from google.cloud import texttospeech
+
+        tts_client = clients.tts_client()
+        audio_config = texttospeech.AudioConfig(
+            audio_encoding=texttospeech.AudioEncoding.LINEAR16,
+            speaking_rate=0.5
+        )
         for code, translation in txl.items():
             name = code + '-Standard-A'
             voice = texttospeech.VoiceSelectionParams(language_code=code, name=name)
@@ -1,41 +1,63 @@
-import io
+import hashlib
 import json
 import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
 
-import vertexai
-from google.cloud import storage
-from moviepy.video.VideoClip import ImageClip
-from vertexai.generative_models import GenerativeModel, GenerationConfig
 import logging
-import moviepy.audio.fx.all as afx
 
 # Import our secure temp utilities
 from utils.temp_utils import get_temp_dir
+from utils import clients
+from utils.adaptive import get_controller
+from utils.blobstore import get_bucket
+from utils.catalog import ArtifactCatalog
+from utils.hedging import get_hedge_policy
+from utils.metrics import metrics
+from utils.rate_limit import estimate_tokens, get_rate_limiter
+from utils.transfer import TransferManager
+from publisher.covers import CoverCache
+from publisher.render import get_renderer
 
-from moviepy.audio.AudioClip import CompositeAudioClip
-from moviepy.audio.io.AudioFileClip import AudioFileClip
-from vertexai.vision_models import ImageGenerationModel
-from PIL import Image as PILImage
-
-from config import get_part_summary_for_img_prompt, get_image_prompt
+from config import IMAGE_PROMPT_VERSION, get_part_summary_for_img_prompt, get_image_prompt
 
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(job_id)s - %(message)s')
-vertexai.init(project=os.getenv("GCP_PARENT_PROJECT"), location=os.getenv("GCP_LOCATION"))
+
+IMAGE_MODEL_ID = "imagen-3.0-generate-002"
+# Artifacts other services write into a part's folder, the catalog only learns of them from the bucket
+EXTERNAL_ARTIFACTS = ('audio.wav',)
 
 
 class Publisher:
 
-    def __init__(self, bucket=None, description=None):
+    def __init__(self, bucket=None, description=None, write_staging_audio=None, stream_uploads=None):
 
         self.bgm = '../relax.mp3'
         self.default_cover = '../default_cover.png'
-        self.storage_client = storage.Client()
-        self.gen_model = GenerativeModel(os.getenv("VERTEX_MODEL_ID", "gemini-2.0-flash-001"))
-        self.img_model = ImageGenerationModel.from_pretrained("imagen-3.0-generate-002")
-        self.img_options = GenerationConfig(temperature=0.75, max_output_tokens=2048)
-
-        self.bucket = self.storage_client.bucket(os.getenv("GCS_BUCKET").split("://")[1] if bucket is None else bucket)
+        self.gen_model_id = os.getenv("VERTEX_MODEL_ID", "gemini-2.0-flash-001")
+        # clients, the bucket and the modules behind them are created on first use, see the properties below
+        self.bucket_name = bucket
+        self.vertex_limiter = get_rate_limiter('vertex')
+        self.hedger = get_hedge_policy('vertex')
+        self.vertex = get_controller('vertex')
+        self.imagen = get_controller('imagen')
+        self.imagen_limiter = get_rate_limiter('imagen')
+        # set STREAM_UPLOADS=1 to upload the video while ffmpeg renders it instead of from a local file
+        self.stream_uploads = os.getenv("STREAM_UPLOADS", "0") == "1" if stream_uploads is None else stream_uploads
         self.logger = logging.getLogger(__name__)
+        self.renderer = get_renderer()
+        # the mixed MP3 is no longer needed to render, set WRITE_STAGING_AUDIO=1 to keep publishing it
+        self.write_staging_audio = os.getenv("WRITE_STAGING_AUDIO", "0") == "1" \
+            if write_staging_audio is None else write_staging_audio
+        self._staging_exports = {}
+        self._export_pool = None
+        # summaries and images by content hash, so covers are not generated twice
+        self.covers = CoverCache()
+        self._cover_prefetches = {}
+        self._cover_pool = None
+        # content prefixes this publisher has synced its catalog with
+        self._synced = set()
         
         # Use secure temp directory
         self.tmp_dir = os.getenv("TMP_DIR", get_temp_dir())
@@ -45,109 +67,321 @@ class Publisher:
         
         self.description = description
         
+        # Local files of a part, named after its title inside the part's workspace (see workspace)
+        self.content_path = '%s-content.wav'
+        self.img_path = '%s-image.png'
+        self.merged_audio_path = '%s-merged.mp3'
+        self.mixed_audio_path = '%s-mixed.m4a'
+        self.tmp_video_path = '%s-video.mp4'
         # Define paths using os.path.join for cross-platform compatibility
-        self.content_path = os.path.join(self.tmp_dir, '%s-content.wav')
-        self.img_path = os.path.join(self.tmp_dir, '%s-image.png')
-        self.merged_audio_path = os.path.join(self.tmp_dir, '%s-merged.mp3')
         self.staging_audio_path = os.path.join('%s', 'staging_audio.mp3')
-        self.tmp_video_path = os.path.join(self.tmp_dir, '%s-video.mp4')
         self.staging_video_path = os.path.join('%s', 'staging_video.mp4')
 
-    def add_bgm(self, key, bgm_path=None, bgm_volume=0.25, clear_tmp=True):
-        u_blob = self.bucket.blob(self.staging_audio_path % key)
-        content_path = self.content_path % key.rsplit("/")[-1]
-        merged_audio_path = self.merged_audio_path % key.rsplit("/")[-1]
+    @cached_property
+    def gen_model(self):
+        return clients.generative_model(self.gen_model_id)
+
+    @cached_property
+    def img_model(self):
+        return clients.image_model(IMAGE_MODEL_ID)
+
+    @cached_property
+    def bucket(self):
+        # $STORAGE_BACKEND picks GCS (cached and rate limited), a local directory or memory, see utils.blobstore
+        return get_bucket(self.bucket_name)
+
+    @cached_property
+    def transfer(self):
+        # sizes the catalog holds spare each download a metadata request
+        return TransferManager(self.bucket, catalog=self.catalog)
+
+    @cached_property
+    def catalog(self):
+        # answers existence checks for synced prefixes without a request per object
+        return ArtifactCatalog(self.bucket)
+
+    @cached_property
+    def mixer(self):
+        from publisher.mixer import AudioMixer
+        return AudioMixer(logger=self.logger)
+
+    def workspace(self, key):
+        # private directory of a part key, parts with the same title in different languages never share files so
+        # several renders can run on one host
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]
+        path = os.path.join(self.tmp_dir, 'jobs', f'{key.split("/")[0]}-{digest}')
+        os.makedirs(path, exist_ok=True, mode=0o700)
+        return path
+
+    def release_workspace(self, key):
+        shutil.rmtree(self.workspace(key), ignore_errors=True)
+
+    def _local(self, pattern, key):
+        return os.path.join(self.workspace(key), pattern % key.rsplit("/")[-1])
+
+    @metrics.timed('add_bgm')
+    def add_bgm(self, key, bgm_path=None, bgm_volume=0.25, clear_tmp=True, duck=None):
+        content_path = self._local(self.content_path, key)
+        merged_audio_path = self._local(self.merged_audio_path, key)
         gcs_path_for_merged_audio = self.staging_audio_path % key
-        if u_blob.exists():
-            self.logger.info(f"File already exists in GCS: {u_blob.name}")
-            u_blob.download_to_filename(merged_audio_path)
+        if self._exists(gcs_path_for_merged_audio):
+            self.logger.info(f"File already exists in GCS: {gcs_path_for_merged_audio}")
+            self.transfer.download(gcs_path_for_merged_audio, merged_audio_path)
             return merged_audio_path
         if bgm_path:
             self.bgm = bgm_path
 
-        d_blob = self.bucket.blob(f'{key}/audio.wav')
-        d_blob.download_to_filename(content_path)
-
-        audio1 = AudioFileClip(content_path)
-        audio2 = AudioFileClip(self.bgm)
-        audio2 = afx.volumex(audio2, bgm_volume)
-        audio2 = afx.audio_loop(audio2, duration=audio1.duration)
-        final_audio = CompositeAudioClip([audio1, audio2])
-        final_audio = final_audio.set_duration(audio1.duration)
-        final_audio.write_audiofile(merged_audio_path, codec="libmp3lame", fps=44100)
-        audio1.close()
-        audio2.close()
-        final_audio.close()
+        self.transfer.download(f'{key}/audio.wav', content_path)
+
+        # the music is decoded once per process and mixed in blocks, see publisher.mixer
+        self.mixer.mix(content_path, self.bgm, merged_audio_path, bgm_volume=bgm_volume, duck=duck)
         # upload file to gcs
-        u_blob = self.bucket.blob(gcs_path_for_merged_audio)
-        u_blob.upload_from_filename(merged_audio_path)
+        self.transfer.upload(merged_audio_path, gcs_path_for_merged_audio, content_type='audio/mpeg')
+        self.catalog.record(gcs_path_for_merged_audio, os.path.getsize(merged_audio_path))
         # delete local file
         os.remove(content_path)
         if clear_tmp:
             os.remove(merged_audio_path)
+            self.release_workspace(key)
         return gcs_path_for_merged_audio if clear_tmp else merged_audio_path
 
+    def sync_catalog(self, key):
+        # lists the content prefix of a part key once per publisher, after which the catalog answers for the
+        # artifacts this host writes
+        prefix = '/'.join(key.split('/')[:2]) + '/'
+        if prefix not in self._synced:
+            self.catalog.sync(prefix)
+            self._synced.add(prefix)
+
+    @metrics.timed('process_video')
     def process_video(self, key, bgm_path=None):
+        self.sync_catalog(key)
+        try:
+            tmp_file = self.render_video(key, bgm_path=bgm_path)
+        except BaseException:
+            self.release_workspace(key)
+            raise
+        if tmp_file:
+            self.upload_video(key, tmp_file)
+        else:
+            self.release_workspace(key)
 
+    @metrics.timed('render_video')
+    def render_video(self, key, bgm_path=None):
         # get subtitles file from gcs at key
         # summarize information in a prompt to llm to generate relevant image for part.
         # add image as a clip to the video and  add audio to the video
-        v_blob = self.bucket.blob(f'{key}/staging_video.mp4')
-        if v_blob.exists():
-            self.logger.info(f"File already exists in GCS: {v_blob.name}")
-            return
-        merged_audio = self.add_bgm(key, bgm_path=bgm_path, clear_tmp=False)
-        if not merged_audio:
-            self.logger.error("Failed to add BGM")
-            return
-        # load audio file from disk
-        ad = AudioFileClip(merged_audio)
-        tmp_img_path = self.img_path % key.rsplit("/")[-1]
-        u_blob = self.bucket.blob(f'{key}/staging_image.png')
-        if u_blob.exists():
-            self.logger.info(f"File already exists in GCS: {u_blob.name}")
-            u_blob.download_to_filename(tmp_img_path)
-        else:
-            # generate image based on summary of subtitles using llm
-            img, summary = self.generate_image(key)
-            if not img:
-                self.logger.error("Failed to generate image using AI - defaulting to default image")
-                tmp_img_path = self.default_cover
+        # returns the path of the rendered video on local disk, or None if there is nothing to upload because the
+        # video is already in the bucket or was streamed into it
+        video_name = self.staging_video_path % key
+        if self._exists(video_name):
+            self.logger.info(f"File already exists in GCS: {video_name}")
+            return None
+        if bgm_path:
+            self.bgm = bgm_path
+        staging_audio = self.staging_audio_path % key
+        tmp_img_path = self._local(self.img_path, key)
+        # local inputs, removed whether or not the render works; the rendered video is removed once uploaded
+        inputs = [tmp_img_path]
+        tmp_file = None
+        try:
+            if self._exists(staging_audio):
+                # mixed by an earlier run, its audio is copied into the video as is
+                audio_path = self._local(self.merged_audio_path, key)
+                inputs.append(audio_path)
+                self.transfer.download(staging_audio, audio_path)
+                bgm = None
+                mix_bgm = False
             else:
-                if img._mime_type == 'image/png':
-                    PILImage.open(io.BytesIO(img._image_bytes)).save(tmp_img_path, format='PNG',
-                                                                     quality=95)
-                else:
-                    self.logger.error("Image is not PNG - defaulting to default image")
-                    tmp_img_path = self.default_cover
-            u_blob.upload_from_filename(tmp_img_path)
-            # upload summary as a file to GCS
-            summary_blob = self.bucket.blob(f'{key}/summary.txt')
-            summary_blob.upload_from_string(summary)
-        # create video clip from image
-        clip = ImageClip(img=tmp_img_path, duration=ad.duration)
-        # Set the audio of the video clip to the loaded audio clip
-        clip = clip.set_audio(ad)
-        tmp_file = self.tmp_video_path % key.rsplit("/")[-1]
-        clip.write_videofile(tmp_file, codec='mpeg4', fps=1, audio_codec='aac',
-                             threads=4)
-        ad.close()
-        clip.close()
+                voice_path = self._local(self.content_path, key)
+                inputs += [voice_path, self._local(self.mixed_audio_path, key)]
+                self.transfer.download(f'{key}/audio.wav', voice_path)
+                audio_path, bgm = self._premix(key, voice_path)
+                mix_bgm = True
+            # normally prefetched while the audio was synthesized, otherwise generated now
+            self.transfer.download(self._await_cover(key), tmp_img_path)
+            # loop the image for the length of the audio, the renderer only mixes in the music if premixing failed
+            if self.stream_uploads and hasattr(self.renderer, 'render_to_stream') \
+                    and not (mix_bgm and self.write_staging_audio):
+                try:
+                    with self.transfer.open_upload(video_name, content_type='video/mp4') as stream:
+                        self.renderer.render_to_stream(tmp_img_path, audio_path, stream, bgm_path=bgm)
+                    self.catalog.record(video_name)
+                    self.logger.info(f"Streamed render of {key} into {video_name}")
+                except RuntimeError as e:
+                    self.logger.warning(f"Streaming render of {key} failed, rendering to a local file: {e}")
+                    tmp_file = self._local(self.tmp_video_path, key)
+            else:
+                tmp_file = self._local(self.tmp_video_path, key)
+            if tmp_file:
+                self.renderer.render(tmp_img_path, audio_path, tmp_file, bgm_path=bgm)
+                if mix_bgm and self.write_staging_audio:
+                    self._export_staging_audio(key, tmp_file)
+        except BaseException:
+            # a partly rendered video is of no use
+            if tmp_file and os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            raise
+        finally:
+            for path in inputs:
+                if os.path.exists(path):
+                    os.remove(path)
+        return tmp_file
+
+    @metrics.timed('upload_video')
+    def upload_video(self, key, tmp_file):
         # upload video to gcs
-        v_blob.upload_from_filename(tmp_file)
-        # delete local file
+        self.transfer.upload(tmp_file, self.staging_video_path % key, content_type='video/mp4')
+        self.catalog.record(self.staging_video_path % key, os.path.getsize(tmp_file))
+        # the staging audio export reads the video too, wait for it before deleting the local file
+        export = self._staging_exports.pop(key, None)
+        if export is not None:
+            try:
+                export.result()
+            except Exception as e:
+                self.logger.error(f"Failed to publish staging audio for {key}: {e}")
         os.remove(tmp_file)
-        os.remove(merged_audio)
-        os.remove(tmp_img_path)
+        self.release_workspace(key)
+        return key
 
-    def generate_image(self, key):
+    def _premix(self, key, voice_path):
+        # the music is decoded once per process by the mixer, so a part only decodes its own voice; the mix is
+        # encoded to AAC once and copied into the MP4 as is. Returns the audio to render and the music the renderer
+        # still has to mix in, which is only the case when the mixer cannot run, e.g. without NumPy
+        mixed_path = self._local(self.mixed_audio_path, key)
+        try:
+            self.mixer.mix(voice_path, self.bgm, mixed_path)
+        except (ImportError, RuntimeError) as e:
+            self.logger.warning(f"Could not premix the music for {key}, mixing it in the render: {e}")
+            if os.path.exists(mixed_path):
+                os.remove(mixed_path)
+            return voice_path, self.bgm
+        os.remove(voice_path)
+        return mixed_path, None
+
+    def _export_staging_audio(self, key, video_path):
+        # extracts the mixed track of the rendered video to staging_audio.mp3 off the render path
+        if self._export_pool is None:
+            self._export_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='staging-audio')
+
+        def export():
+            audio_path = self._local(self.merged_audio_path, key)
+            self.renderer.export_audio(video_path, audio_path)
+            try:
+                self.transfer.upload(audio_path, self.staging_audio_path % key, content_type='audio/mpeg')
+                self.catalog.record(self.staging_audio_path % key, os.path.getsize(audio_path))
+            finally:
+                os.remove(audio_path)
+
+        self._staging_exports[key] = self._export_pool.submit(export)
+
+    def _exists(self, name):
+        # this host records every artifact it writes, so under a synced prefix the catalog answers for them without
+        # a request; artifacts TTS writes and prefixes that were never synced are checked with the bucket
+        known = self.catalog.exists(name)
+        if known or (known is False and name.rsplit('/', 1)[-1] not in EXTERNAL_ARTIFACTS):
+            return known
+        if not self.bucket.blob(name).exists():
+            return False
+        self.catalog.record(name)
+        return True
+
+    def prefetch_cover(self, key):
+        # starts the cover of a part as soon as its subtitles are written. A render in this process waits on it
+        # while it runs; once done the cover is in the bucket, where a render in any process finds it
+        if self._cover_pool is None:
+            self._cover_pool = ThreadPoolExecutor(max_workers=int(os.getenv("COVER_PREFETCH_WORKERS", 2)),
+                                                  thread_name_prefix='cover')
+        future = self._cover_pool.submit(self.prepare_cover, key)
+        self._cover_prefetches[key] = future
+        future.add_done_callback(lambda f: self._cover_prefetched(key, f))
+        return future
+
+    def _cover_prefetched(self, key, future):
+        # dropped when done, so parts whose render never comes (e.g. their synthesis failed) are not kept
+        if self._cover_prefetches.get(key) is future:
+            self._cover_prefetches.pop(key, None)
+        if future.exception() is not None:
+            self.logger.warning(f"Cover prefetch for {key} failed, it is generated at render: {future.exception()}")
+
+    def _await_cover(self, key):
+        future = self._cover_prefetches.get(key)
+        if future is not None:
+            try:
+                return future.result()
+            except Exception:
+                pass
+        return self.prepare_cover(key)
+
+    def prepare_cover(self, key):
+        # makes sure the part has a staging_image.png (and summary.txt) in the bucket and returns the image's name
+        image_name = f'{key}/staging_image.png'
+        if self._exists(image_name):
+            self.logger.info(f"File already exists in GCS: {image_name}")
+            return image_name
         # generate image based on summary of subtitles using llm
-        # use vertexai to generate image
-        blob = self.bucket.blob(key + '/subtitles.txt')
-        text = blob.download_as_bytes().decode('utf-8')
-        response = self.gen_model.generate_content(get_part_summary_for_img_prompt(text),
-                                                   generation_config=GenerationConfig(max_output_tokens=4000,
-                                                                                      temperature=0.8))
+        image_path, summary = self.generate_image(key)
+        if not image_path:
+            self.logger.error("Failed to generate image using AI - defaulting to default image")
+            image_path = self.default_cover
+        self.transfer.upload(image_path, image_name, content_type='image/png')
+        self.catalog.record(image_name, os.path.getsize(image_path))
+        if summary:
+            # upload summary as a file to GCS
+            self.transfer.write_text(f'{key}/summary.txt', summary)
+            self.catalog.record(f'{key}/summary.txt')
+        return image_name
+
+    @metrics.timed('generate_image')
+    def generate_image(self, key):
+        # generate image based on summary of subtitles using llm, returns the path of the cached PNG (None if no
+        # image could be generated) and the summary
+        text = self.transfer.read_text(key + '/subtitles.txt')
+        summary_key = self.covers.summary_key(text, self.gen_model_id, IMAGE_PROMPT_VERSION)
+        summary = self.covers.get_summary(summary_key)
+        if summary is None:
+            summary = self._summarize(text)
+            if not summary:
+                return None, None
+            self.covers.put_summary(summary_key, summary)
+
+        image_key = self.covers.image_key(summary, self.description, IMAGE_MODEL_ID, IMAGE_PROMPT_VERSION)
+        cached = self.covers.image_path(image_key)
+        if cached:
+            self.logger.info(f"Reusing cached cover for {key}")
+            return cached, summary
+
+        # generate image using the summary
+        def request():
+            self.imagen_limiter.acquire()
+            return self.img_model.generate_images(prompt=get_image_prompt(summary, self.description),
+                                                  number_of_images=1,
+                                                  aspect_ratio="16:9",
+                                                  negative_prompt="",
+                                                  add_watermark=True, )
+
+        images = self.imagen.call(request)
+        if not images.images:
+            return None, summary
+        img = images.images[0]
+        if img._mime_type != 'image/png':
+            self.logger.error("Image is not PNG - defaulting to default image")
+            return None, summary
+        return self.covers.put_image(image_key, img._image_bytes), summary
+
+    def _summarize(self, text):
+        prompt = get_part_summary_for_img_prompt(text)
+        tokens = estimate_tokens(prompt)
+
+        def request():
+            self.vertex_limiter.acquire(tokens=tokens)
+            response = self.hedger.call(lambda: self.gen_model.generate_content(
+                prompt, generation_config=clients.generation_config(max_output_tokens=4000, temperature=0.8)),
+                limiter=self.vertex_limiter, tokens=tokens)
+            self.vertex_limiter.settle(tokens, response)
+            return response
+
+        response = self.vertex.call(request)
         try:
             summary_txt = response.text.replace('```json', '')
             summary_txt = summary_txt.replace('```', '')
@@ -155,20 +389,12 @@ class Publisher:
             if not summary.get('summary'):
                 error = f'⚡Could not generate image...'
                 self.logger.error(error)
-                return None, None
+                return None
         except Exception as e:
             error = f'⚡Could not load json due to a run time exception for answer {response}: {e}'
             self.logger.error(error)
-            return None, None
-
-        text = summary['summary']
-        # generate image using the summary
-        images = self.img_model.generate_images(prompt=get_image_prompt(text, self.description),
-                                                number_of_images=1,
-                                                aspect_ratio="16:9",
-                                                negative_prompt="",
-                                                add_watermark=True, )
-        return images.images[0], text if (images.images and len(images.images)) > 0 else (None, text)
+            return None
+        return summary['summary']
 
     def publish(self, key, **kwargs):
         pass
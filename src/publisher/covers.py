@@ -0,0 +1,114 @@
+"""
+Local cache of cover image summaries and generated images.
+
+A part's cover takes two model calls: Gemini summarizes the subtitles into an
+image prompt and Imagen draws it. Summaries are cached by the subtitles they
+were made from and images by their normalized summary, so a re-render after a
+failure, or two parts that summarize the same way, never call the models again.
+Both keys include the prompt version and model, so changing either starts afresh.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import Optional
+
+from utils.temp_utils import get_temp_dir
+
+DEFAULT_MAX_MB = 1024
+
+
+def normalize_summary(summary: str) -> str:
+    """Summary with case and whitespace differences removed, so near-identical summaries share an image."""
+    return ' '.join(summary.casefold().split())
+
+
+class CoverCache:
+    """
+    Summaries and PNG covers stored as files, keyed by content hashes.
+
+    Args:
+        directory: Cache directory, defaults to $COVER_CACHE_DIR or a directory in the itihasa temp directory
+        max_bytes: Total image size kept before the oldest images are removed, defaults to $COVER_CACHE_MB megabytes
+    """
+
+    def __init__(self, directory: Optional[str] = None, max_bytes: Optional[int] = None):
+        self.directory = directory or os.getenv("COVER_CACHE_DIR", get_temp_dir('covers'))
+        self.max_bytes = max_bytes if max_bytes is not None \
+            else int(os.getenv("COVER_CACHE_MB", DEFAULT_MAX_MB)) * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(self.directory, 'summaries'), exist_ok=True)
+        os.makedirs(os.path.join(self.directory, 'images'), exist_ok=True)
+
+    @staticmethod
+    def _hash(*parts) -> str:
+        payload = json.dumps([str(part) for part in parts], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def summary_key(cls, text: str, model_id: str, prompt_version) -> str:
+        """Hash of everything that changes the summary of a part's subtitles."""
+        return cls._hash('summary', text, model_id, prompt_version)
+
+    @classmethod
+    def image_key(cls, summary: str, description: Optional[str], model_id: str, prompt_version) -> str:
+        """Hash of everything that changes the image drawn for a summary."""
+        return cls._hash('image', normalize_summary(summary), description or '', model_id, prompt_version)
+
+    def _path(self, kind: str, key: str) -> str:
+        return os.path.join(self.directory, kind, key + ('.txt' if kind == 'summaries' else '.png'))
+
+    def _write(self, path: str, data: bytes):
+        # written aside and moved into place so a concurrent reader never sees half a file
+        fd, partial = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.partial-')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(partial, path)
+
+    def get_summary(self, key: str) -> Optional[str]:
+        try:
+            with open(self._path('summaries', key), encoding='utf-8') as f:
+                summary = f.read()
+        except FileNotFoundError:
+            return None
+        return summary
+
+    def put_summary(self, key: str, summary: str):
+        self._write(self._path('summaries', key), summary.encode('utf-8'))
+
+    def image_path(self, key: str) -> Optional[str]:
+        path = self._path('images', key)
+        with self._lock:
+            if not os.path.exists(path):
+                self.misses += 1
+                return None
+            self.hits += 1
+        # the modification time orders images for eviction
+        os.utime(path)
+        return path
+
+    def put_image(self, key: str, png: bytes) -> str:
+        path = self._path('images', key)
+        self._write(path, png)
+        self._evict()
+        return path
+
+    def _evict(self):
+        images = os.path.join(self.directory, 'images')
+        with self._lock:
+            entries = []
+            for name in os.listdir(images):
+                if name.startswith('.'):
+                    continue
+                stat = os.stat(os.path.join(images, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+            total = sum(size for _, size, _ in entries)
+            # the newest image is always kept
+            for _, size, name in sorted(entries)[:-1]:
+                if total <= self.max_bytes:
+                    break
+                os.remove(os.path.join(images, name))
+                total -= size
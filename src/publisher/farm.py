@@ -0,0 +1,123 @@
+"""
+Process pool that renders and uploads part videos in parallel.
+
+Each worker process builds its own Publisher once and then takes part keys from
+a bounded work queue, running ``process_video`` for each in the part's private
+workspace. Rendering is ffmpeg and NumPy work, so processes rather than threads
+let several parts use the host's cores at once. The metrics a worker records for
+a part are sent back with its result and merged into the parent's registry, so
+they are exported with the run. Given a ``prefetch`` function, the covers of the
+keys queued next are generated in the parent while workers render, and a key is
+only handed to a worker once its cover is in the bucket.
+"""
+import logging
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from typing import Callable, Iterable, Iterator, Optional, Tuple
+
+from utils.metrics import metrics
+
+_publisher = None
+_forked_metrics_cleared = False
+
+
+def _init_worker(bucket, description):
+    global _publisher
+    from publisher import Publisher
+
+    _publisher = Publisher(bucket=bucket, description=description)
+
+
+def process_video(key: str, bgm_path: Optional[str] = None):
+    """Job run in a worker: render and upload one part with the worker's Publisher."""
+    _publisher.process_video(key, bgm_path=bgm_path)
+
+
+def _run(job: Callable, key: str, kwargs: dict):
+    # runs in a worker, returns (metrics drained since the last job, error) so neither is lost on failure
+    global _forked_metrics_cleared
+    if not _forked_metrics_cleared:
+        # a forked worker starts with a copy of the parent's registry, which the parent already has
+        metrics.reset()
+        _forked_metrics_cleared = True
+    try:
+        job(key, **kwargs)
+        error = None
+    except Exception as e:
+        error = e
+    return metrics.drain(), error
+
+
+class RenderFarm:
+    """
+    Renders part keys on a pool of worker processes.
+
+    Args:
+        workers: Worker processes, defaults to $RENDER_WORKERS or the number of cores
+        bucket: Bucket passed to each worker's Publisher, $GCS_BUCKET by default
+        description: Channel description passed to each worker's Publisher, used in cover prompts
+        job: Picklable function called with each key in a worker, process_video by default
+        start_method: multiprocessing start method, defaults to $RENDER_START_METHOD or ``spawn`` as model and
+            storage clients do not survive a fork
+        prefetch: Starts a key's cover in this process and returns its future, e.g. Publisher.prefetch_cover;
+            a worker's Publisher finds the finished cover in the bucket instead of generating it while it renders
+    """
+
+    def __init__(self, workers: Optional[int] = None, bucket: Optional[str] = None,
+                 description: Optional[str] = None, job: Optional[Callable] = None,
+                 start_method: Optional[str] = None, prefetch: Optional[Callable[[str], Future]] = None):
+        self.workers = workers or int(os.getenv("RENDER_WORKERS", 0)) or os.cpu_count() or 1
+        self.bucket = bucket
+        self.description = description
+        self.job = job or process_video
+        self.start_method = start_method or os.getenv("RENDER_START_METHOD", 'spawn')
+        self.prefetch = prefetch
+        self.logger = logging.getLogger(__name__)
+
+    def run(self, keys: Iterable[str], **kwargs) -> Iterator[Tuple[str, Optional[BaseException]]]:
+        """
+        Render every key, yielding ``(key, error)`` as each finishes, error being None on success.
+
+        At most two keys per worker are queued or waiting for their cover at a time, so keys can come from a
+        lazy source.
+        """
+        keys = iter(keys)
+        with ProcessPoolExecutor(max_workers=self.workers,
+                                 mp_context=multiprocessing.get_context(self.start_method),
+                                 initializer=_init_worker if self.job is process_video else None,
+                                 initargs=(self.bucket, self.description) if self.job is process_video else ()) \
+                as pool:
+            running = {}
+            covers = {}
+
+            def fill():
+                for key in keys:
+                    if self.prefetch is None:
+                        running[pool.submit(_run, self.job, key, kwargs)] = key
+                    else:
+                        covers[self.prefetch(key)] = key
+                    if len(running) + len(covers) >= 2 * self.workers:
+                        break
+
+            fill()
+            while running or covers:
+                done, _ = wait([*running, *covers], return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future in covers:
+                        # a failed prefetch is logged by the prefetcher, the worker then generates the cover itself
+                        key = covers.pop(future)
+                        running[pool.submit(_run, self.job, key, kwargs)] = key
+                        continue
+                    key = running.pop(future)
+                    # the worker itself may have died, then there is only the pool's error
+                    error = future.exception()
+                    if error is None:
+                        snapshot, error = future.result()
+                        metrics.merge(snapshot)
+                    if error is None:
+                        self.logger.info(f"Rendered {key}")
+                    else:
+                        self.logger.error(f"Failed to render {key}: {error}")
+                    yield key, error
+                fill()
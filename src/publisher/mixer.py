@@ -0,0 +1,154 @@
+"""
+Vectorized mixing of a narration track with looped background music.
+
+Background music is decoded and resampled once per process and kept as a PCM
+array. The narration is streamed through ffmpeg in fixed-size blocks; for each
+block the music is tiled to length with index arithmetic, scaled and optionally
+ducked under the voice with array operations, and the mix is piped straight
+into the encoder. Memory stays bounded by the block size plus the cached music.
+"""
+import logging
+import os
+import subprocess
+import threading
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from publisher.render import find_ffmpeg
+
+SAMPLE_RATE = 44100
+CHANNELS = 2
+
+# Output codec arguments by file extension
+ENCODERS = {
+    '.mp3': ['-c:a', 'libmp3lame', '-q:a', '2'],
+    '.m4a': ['-c:a', 'aac', '-b:a', '192k'],
+    '.wav': ['-c:a', 'pcm_s16le'],
+}
+
+_bgm_cache: Dict[Tuple[str, int, int, int], np.ndarray] = {}
+_bgm_lock = threading.Lock()
+
+
+def _ffmpeg():
+    binary = find_ffmpeg()
+    if not binary:
+        raise RuntimeError("ffmpeg is not available")
+    return binary
+
+
+def decode_audio(path: str, rate: int = SAMPLE_RATE, channels: int = CHANNELS) -> np.ndarray:
+    """Decode a whole file into a float32 array of shape (samples, channels)."""
+    result = subprocess.run([_ffmpeg(), '-hide_banner', '-loglevel', 'error', '-i', path,
+                             '-f', 'f32le', '-ac', str(channels), '-ar', str(rate), '-'],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"Could not decode {path}: {result.stderr.decode('utf-8', errors='replace')[-500:]}")
+    return np.frombuffer(result.stdout, dtype=np.float32).reshape(-1, channels)
+
+
+def load_bgm(path: str, rate: int = SAMPLE_RATE, channels: int = CHANNELS) -> np.ndarray:
+    """Decoded background music, cached for the life of the process and refreshed if the file changes."""
+    key = (os.path.abspath(path), os.stat(path).st_mtime_ns, rate, channels)
+    with _bgm_lock:
+        pcm = _bgm_cache.get(key)
+    if pcm is None:
+        pcm = decode_audio(path, rate, channels)
+        if not len(pcm):
+            raise ValueError(f"Background music has no audio: {path}")
+        with _bgm_lock:
+            # only the latest version of a file is kept
+            for stale in [k for k in _bgm_cache if k[0] == key[0]]:
+                del _bgm_cache[stale]
+            _bgm_cache[key] = pcm
+    return pcm
+
+
+def clear_bgm_cache():
+    with _bgm_lock:
+        _bgm_cache.clear()
+
+
+def duck_gains(voice: np.ndarray, rate: int, amount: float, threshold: float = 0.02,
+               window_seconds: float = 0.05) -> np.ndarray:
+    """
+    Per-sample gain for the music under ``voice``: ``amount`` where the voice is louder than ``threshold`` RMS,
+    1 elsewhere, smoothed over a few windows so the music does not pump.
+    """
+    window = max(1, int(rate * window_seconds))
+    windows = -(-len(voice) // window)
+    padded = np.zeros((windows * window, voice.shape[1]), dtype=np.float32)
+    padded[:len(voice)] = voice
+    rms = np.sqrt(np.mean(np.square(padded.reshape(windows, -1)), axis=1))
+    gains = np.where(rms > threshold, amount, 1.0).astype(np.float32)
+    if windows > 2:
+        gains = np.convolve(np.pad(gains, 2, mode='edge'), np.ones(5, dtype=np.float32) / 5, mode='valid')
+    return np.repeat(gains, window)[:len(voice)]
+
+
+class AudioMixer:
+    """
+    Mixes a voice file with looped background music into an encoded file.
+
+    Args:
+        rate: Sample rate of the mix
+        channels: Channels of the mix
+        block_seconds: Length of the blocks the voice is read, mixed and written in
+        logger: Logger for progress messages
+    """
+
+    def __init__(self, rate: int = SAMPLE_RATE, channels: int = CHANNELS, block_seconds: float = 10.0,
+                 logger: Optional[logging.Logger] = None):
+        self.rate = rate
+        self.channels = channels
+        self.block_samples = max(1, int(rate * block_seconds))
+        self.logger = logger or logging.getLogger(__name__)
+
+    def mix(self, voice_path: str, bgm_path: str, output_path: str, bgm_volume: float = 0.25,
+            duck: Optional[float] = None) -> str:
+        """
+        Write voice plus the music looped for the voice's length at ``bgm_volume`` to ``output_path``.
+
+        With ``duck`` set, the music is further scaled by that factor wherever the voice is speaking.
+        """
+        bgm = load_bgm(bgm_path, self.rate, self.channels)
+        encoder = ENCODERS.get(os.path.splitext(output_path)[1].lower(), ENCODERS['.mp3'])
+        pcm = ['-f', 'f32le', '-ac', str(self.channels), '-ar', str(self.rate)]
+        decoder = subprocess.Popen([_ffmpeg(), '-hide_banner', '-loglevel', 'error', '-i', voice_path, *pcm, '-'],
+                                   stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        writer = subprocess.Popen([_ffmpeg(), '-y', '-hide_banner', '-loglevel', 'error', *pcm, '-i', '-',
+                                   *encoder, output_path], stdin=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        block_bytes = self.block_samples * self.channels * 4
+        position = 0
+        try:
+            while True:
+                data = decoder.stdout.read(block_bytes)
+                if not data:
+                    break
+                voice = np.frombuffer(data[:len(data) - len(data) % (self.channels * 4)],
+                                      dtype=np.float32).reshape(-1, self.channels)
+                writer.stdin.write(self.mix_block(voice, bgm, position, bgm_volume, duck).tobytes())
+                position += len(voice)
+        except BrokenPipeError:
+            # the encoder exited early, its exit code is reported below
+            pass
+        finally:
+            decoder.stdout.close()
+            try:
+                writer.stdin.close()
+            except BrokenPipeError:
+                pass
+            decoded, encoded = decoder.wait(), writer.wait()
+        if decoded != 0 or encoded != 0:
+            raise RuntimeError(f"Mixing {voice_path} failed (decoder exit {decoded}, encoder exit {encoded})")
+        self.logger.info(f"Mixed {position / self.rate:.1f}s of {voice_path} with {bgm_path}")
+        return output_path
+
+    def mix_block(self, voice: np.ndarray, bgm: np.ndarray, position: int, bgm_volume: float,
+                  duck: Optional[float] = None) -> np.ndarray:
+        """Mix one block of voice starting ``position`` samples into the track with the looped music."""
+        music = bgm[np.arange(position, position + len(voice)) % len(bgm)] * np.float32(bgm_volume)
+        if duck is not None:
+            music *= duck_gains(voice, self.rate, duck)[:, None]
+        return np.clip(voice + music, -1.0, 1.0).astype(np.float32, copy=False)
@@ -0,0 +1,187 @@
+"""
+Render backends that turn a cover image and an audio track into a video.
+
+A part's video is one still image for the whole length of its audio. The
+``ffmpeg`` backend loops the image at one frame a second with an encoder tuned
+for still images and copies the audio stream into the MP4 when it is already
+in a format MP4 can carry, so nothing is decoded in Python. Given background
+music, the voice track is mixed with the looped music in the same ffmpeg pass
+and encoded to AAC once. The ``moviepy`` backend is the original ImageClip
+render and is used when ffmpeg is missing or fails.
+"""
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+from typing import List, Optional
+
+# Audio formats the MP4 container can carry without re-encoding
+MP4_AUDIO_EXTENSIONS = ('.mp3', '.aac', '.m4a')
+
+# Output target that makes ffmpeg write a fragmented MP4 to stdout
+STREAM_OUTPUT = 'pipe:1'
+
+
+def find_ffmpeg() -> Optional[str]:
+    """Path of an ffmpeg binary, from $FFMPEG_BINARY, the PATH or the one bundled with imageio-ffmpeg."""
+    binary = os.getenv("FFMPEG_BINARY") or shutil.which('ffmpeg')
+    if binary:
+        return binary
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except (ImportError, RuntimeError):
+        return None
+
+
+class MoviepyRenderer:
+    """Renders through a moviepy ImageClip, decoding the audio and encoding every frame in Python."""
+
+    name = 'moviepy'
+
+    def render(self, image_path: str, audio_path: str, output_path: str, bgm_path: Optional[str] = None,
+               bgm_volume: float = 0.25) -> str:
+        import moviepy.audio.fx.all as afx
+        from moviepy.audio.AudioClip import CompositeAudioClip
+        from moviepy.audio.io.AudioFileClip import AudioFileClip
+        from moviepy.video.VideoClip import ImageClip
+
+        voice = AudioFileClip(audio_path)
+        clips = [voice]
+        audio = voice
+        if bgm_path:
+            bgm = afx.audio_loop(afx.volumex(AudioFileClip(bgm_path), bgm_volume), duration=voice.duration)
+            clips.append(bgm)
+            audio = CompositeAudioClip([voice, bgm]).set_duration(voice.duration)
+        clip = ImageClip(img=image_path, duration=voice.duration).set_audio(audio)
+        try:
+            clip.write_videofile(output_path, codec='mpeg4', fps=1, audio_codec='aac', threads=4, logger=None)
+        finally:
+            for audio_clip in clips:
+                audio_clip.close()
+            clip.close()
+        return output_path
+
+    def export_audio(self, video_path: str, output_path: str) -> str:
+        """Write the audio track of a rendered video as MP3."""
+        from moviepy.audio.io.AudioFileClip import AudioFileClip
+
+        audio = AudioFileClip(video_path)
+        try:
+            audio.write_audiofile(output_path, codec='libmp3lame', fps=44100, logger=None)
+        finally:
+            audio.close()
+        return output_path
+
+
+class FfmpegRenderer:
+    """
+    Renders with a single ffmpeg process looping the still image.
+
+    Args:
+        binary: ffmpeg executable, found with find_ffmpeg by default
+        preset: x264 speed preset, ultrafast by default as a still image costs few bytes at any preset
+        fallback: Renderer used when ffmpeg is missing or exits with an error
+    """
+
+    name = 'ffmpeg'
+
+    def __init__(self, binary: Optional[str] = None, preset: str = 'ultrafast', fallback=None):
+        self.binary = binary or find_ffmpeg()
+        self.preset = preset
+        self.fallback = fallback
+        self.logger = logging.getLogger(__name__)
+
+    def command(self, image_path: str, audio_path: str, output_path: str, bgm_path: Optional[str] = None,
+                bgm_volume: float = 0.25) -> List[str]:
+        inputs = ['-loop', '1', '-framerate', '1', '-i', image_path, '-i', audio_path]
+        if bgm_path:
+            # the music is looped for as long as the voice lasts and mixed under it at bgm_volume
+            inputs += ['-stream_loop', '-1', '-i', bgm_path]
+            audio = ['-filter_complex', f'[2:a]volume={bgm_volume}[bgm];'
+                                        f'[1:a][bgm]amix=inputs=2:duration=first:normalize=0[mix]',
+                     '-map', '0:v:0', '-map', '[mix]', '-c:a', 'aac', '-b:a', '192k', '-ar', '44100']
+        elif os.path.splitext(audio_path)[1].lower() in MP4_AUDIO_EXTENSIONS:
+            audio = ['-map', '0:v:0', '-map', '1:a:0', '-c:a', 'copy']
+        else:
+            audio = ['-map', '0:v:0', '-map', '1:a:0', '-c:a', 'aac', '-b:a', '192k']
+        return [self.binary, '-y', '-hide_banner', '-loglevel', 'error',
+                *inputs,
+                # x264 needs even dimensions for yuv420p, which players and YouTube expect
+                '-vf', 'scale=trunc(iw/2)*2:trunc(ih/2)*2,format=yuv420p',
+                '-c:v', 'libx264', '-tune', 'stillimage', '-preset', self.preset, '-r', '1',
+                *audio,
+                # stop with the audio even when the image frames are encoded faster than the audio arrives
+                '-shortest', '-fflags', '+shortest', '-max_interleave_delta', '100M',
+                # a stream cannot be rewound to move the index to the front, it is written as fragments instead
+                *(['-f', 'mp4', '-movflags', 'frag_keyframe+empty_moov+default_base_moof']
+                  if output_path == STREAM_OUTPUT else ['-movflags', '+faststart']),
+                output_path]
+
+    def render(self, image_path: str, audio_path: str, output_path: str, bgm_path: Optional[str] = None,
+               bgm_volume: float = 0.25) -> str:
+        if not self.binary:
+            return self._fall_back("ffmpeg is not available", 'render',
+                                   image_path, audio_path, output_path, bgm_path, bgm_volume)
+        result = subprocess.run(self.command(image_path, audio_path, output_path, bgm_path, bgm_volume),
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if result.returncode == 0:
+            return output_path
+        return self._fall_back(f"ffmpeg render failed: {self._error(result)}", 'render',
+                               image_path, audio_path, output_path, bgm_path, bgm_volume)
+
+    def render_to_stream(self, image_path: str, audio_path: str, stream, bgm_path: Optional[str] = None,
+                         bgm_volume: float = 0.25):
+        """
+        Render a fragmented MP4 into a writable ``stream`` while it is being encoded.
+
+        There is no fallback: whatever was written to the stream cannot be taken back, so errors are raised.
+        """
+        if not self.binary:
+            raise RuntimeError("ffmpeg is not available")
+        with tempfile.TemporaryFile() as errors:
+            process = subprocess.Popen(self.command(image_path, audio_path, STREAM_OUTPUT, bgm_path, bgm_volume),
+                                       stdout=subprocess.PIPE, stderr=errors)
+            try:
+                shutil.copyfileobj(process.stdout, stream, 1024 * 1024)
+            finally:
+                process.stdout.close()
+                returncode = process.wait()
+            if returncode != 0:
+                errors.seek(0)
+                raise RuntimeError(f"ffmpeg render failed: {errors.read().decode('utf-8', errors='replace')[-2000:]}")
+
+    def export_audio(self, video_path: str, output_path: str) -> str:
+        """Write the audio track of a rendered video as MP3."""
+        if not self.binary:
+            return self._fall_back("ffmpeg is not available", 'export_audio', video_path, output_path)
+        result = subprocess.run([self.binary, '-y', '-hide_banner', '-loglevel', 'error', '-i', video_path,
+                                 '-vn', '-c:a', 'libmp3lame', '-q:a', '2', output_path],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if result.returncode == 0:
+            return output_path
+        return self._fall_back(f"ffmpeg audio export failed: {self._error(result)}", 'export_audio',
+                               video_path, output_path)
+
+    @staticmethod
+    def _error(result):
+        return result.stderr.decode('utf-8', errors='replace').strip()[-2000:]
+
+    def _fall_back(self, error, method, *args):
+        if self.fallback is None:
+            raise RuntimeError(error)
+        self.logger.warning(f"{error}, using {self.fallback.name}")
+        return getattr(self.fallback, method)(*args)
+
+
+def get_renderer(name: Optional[str] = None):
+    """
+    Renderer named by ``name`` or $RENDER_BACKEND: ``ffmpeg`` (the default, falls back to moviepy) or ``moviepy``.
+    """
+    name = name or os.getenv("RENDER_BACKEND", 'ffmpeg')
+    if name == 'moviepy':
+        return MoviepyRenderer()
+    if name == 'ffmpeg':
+        return FfmpegRenderer(preset=os.getenv("RENDER_PRESET", 'ultrafast'), fallback=MoviepyRenderer())
+    raise ValueError(f"Unknown render backend: {name}")
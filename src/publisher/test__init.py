@@ -0,0 +1,238 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# Mock Google Cloud imports before importing our modules
+with patch('vertexai.init'), \
+     patch('vertexai.generative_models.GenerativeModel'), \
+     patch('google.cloud.storage.Client'), \
+     patch('vertexai.vision_models.ImageGenerationModel'):
+    import publisher
+    from publisher import Publisher
+    from utils.catalog import ArtifactCatalog
+    from utils.transfer import TransferManager
+
+
+class TestPublisher(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        with patch.dict('os.environ', {'TMP_DIR': self.tmp.name,
+                                       'COVER_CACHE_DIR': os.path.join(self.tmp.name, 'covers')}):
+            self.publisher = Publisher(bucket='test-bucket')
+        self.publisher.bucket = MagicMock()
+        self.publisher.catalog = ArtifactCatalog(self.publisher.bucket, path=os.path.join(self.tmp.name, 'a.db'))
+        self.publisher.gen_model = MagicMock()
+        self.publisher.img_model = MagicMock()
+        self.publisher.transfer = TransferManager(self.publisher.bucket)
+        self.publisher.renderer = MagicMock()
+        self.publisher.mixer = MagicMock()
+        self.publisher.mixer.mix.side_effect = lambda voice, bgm, output, **kwargs: open(output, 'w').close()
+        self.existing = set()
+        self.subtitles = {}
+        self.blobs = []
+        self.publisher.bucket.blob.side_effect = self._blob
+
+    def tearDown(self):
+        self.publisher.catalog.close()
+        self.tmp.cleanup()
+
+    def _blob(self, name):
+        blob = MagicMock()
+        blob.name = name
+        blob.exists.return_value = name.rsplit('/', 1)[-1] in self.existing
+        blob.size = 0
+        blob.download_to_filename.side_effect = lambda path: open(path, 'w').close()
+        blob.download_as_bytes.return_value = self.subtitles.get(name.rsplit('/', 2)[-2], 'text').encode('utf-8')
+        self.blobs.append(blob)
+        return blob
+
+    def _models(self, summaries):
+        self.publisher.vertex_limiter = MagicMock()
+        self.publisher.imagen_limiter = MagicMock()
+        self.publisher.gen_model.generate_content.side_effect = \
+            [MagicMock(text=f'```json{{"summary": "{summary}"}}```') for summary in summaries]
+        image = MagicMock(_mime_type='image/png', _image_bytes=b'png')
+        self.publisher.img_model.generate_images.return_value = MagicMock(images=[image])
+
+    def test_render_uses_the_premixed_track(self):
+        self.existing = {'staging_image.png'}
+        tmp_file = self.publisher.render_video('ta-IN/test/part-1', bgm_path='bgm.mp3')
+        voice, bgm, mixed = self.publisher.mixer.mix.call_args[0]
+        self.assertTrue(voice.endswith('part-1-content.wav'))
+        self.assertEqual(bgm, 'bgm.mp3')
+        image, audio, output = self.publisher.renderer.render.call_args[0]
+        self.assertEqual(audio, mixed)
+        self.assertTrue(audio.endswith('part-1-mixed.m4a'))
+        self.assertEqual(output, tmp_file)
+        self.assertEqual(self.publisher.renderer.render.call_args[1], {'bgm_path': None})
+        names = [call[0][0] for call in self.publisher.bucket.blob.call_args_list]
+        self.assertIn('ta-IN/test/part-1/audio.wav', names)
+        self.publisher.renderer.export_audio.assert_not_called()
+        self.assertFalse(os.path.exists(voice))
+        self.assertFalse(os.path.exists(audio))
+
+    def test_render_mixes_the_music_itself_when_the_mixer_fails(self):
+        self.existing = {'staging_image.png'}
+        self.publisher.mixer.mix.side_effect = RuntimeError('ffmpeg is not available')
+        self.publisher.render_video('ta-IN/test/part-1', bgm_path='bgm.mp3')
+        _, audio, _ = self.publisher.renderer.render.call_args[0]
+        self.assertTrue(audio.endswith('part-1-content.wav'))
+        self.assertEqual(self.publisher.renderer.render.call_args[1], {'bgm_path': 'bgm.mp3'})
+
+    def test_synced_catalog_answers_existence_checks(self):
+        self.publisher.bucket.list_blobs.return_value = []
+        self.publisher.catalog.sync('ta-IN/test/')
+        self.publisher.catalog.record('ta-IN/test/part-1/staging_video.mp4')
+        self.assertIsNone(self.publisher.render_video('ta-IN/test/part-1'))
+        names = [call[0][0] for call in self.publisher.bucket.blob.call_args_list]
+        self.assertNotIn('ta-IN/test/part-1/staging_video.mp4', names)
+        self.publisher.renderer.render.assert_not_called()
+
+    def test_only_external_artifacts_missing_from_a_synced_catalog_are_checked(self):
+        self.publisher.bucket.list_blobs.return_value = []
+        self.publisher.catalog.sync('ta-IN/test/')
+        self.existing = {'staging_video.mp4', 'audio.wav'}
+        # this host records what it writes, TTS does not
+        self.assertFalse(self.publisher._exists('ta-IN/test/part-1/staging_video.mp4'))
+        self.assertTrue(self.publisher._exists('ta-IN/test/part-1/audio.wav'))
+        names = [call[0][0] for call in self.publisher.bucket.blob.call_args_list]
+        self.assertEqual(names, ['ta-IN/test/part-1/audio.wav'])
+        self.assertTrue(self.publisher.catalog.exists('ta-IN/test/part-1/audio.wav'))
+
+    def test_process_video_syncs_once_and_checks_nothing_per_object(self):
+        listed = [MagicMock(size=3, md5_hash='md5', generation=1, updated=None)
+                  for _ in ('part-1', 'part-2')]
+        for blob, part in zip(listed, ('part-1', 'part-2')):
+            blob.name = f'ta-IN/test/{part}/staging_image.png'
+        self.publisher.bucket.list_blobs.return_value = listed
+        self.publisher.renderer.render.side_effect = lambda image, audio, output, bgm_path: open(output, 'w').close()
+        self.publisher.process_video('ta-IN/test/part-1')
+        self.publisher.process_video('ta-IN/test/part-2')
+        self.publisher.bucket.list_blobs.assert_called_once()
+        self.assertEqual(self.publisher.renderer.render.call_count, 2)
+        self.assertEqual([blob.name for blob in self.blobs if blob.exists.called], [])
+
+    def test_covers_are_cached_by_subtitles_and_summary(self):
+        self.subtitles = {'part-1': 'one', 'part-2': 'two'}
+        self._models(['A battle  at dawn', 'a battle at dawn'])
+        first, summary = self.publisher.generate_image('ta-IN/test/part-1')
+        self.assertEqual(self.publisher.generate_image('ta-IN/test/part-1'), (first, summary))
+        # a different part whose summary only differs in case and spacing reuses the image
+        self.assertEqual(self.publisher.generate_image('ta-IN/test/part-2')[0], first)
+        self.assertEqual(self.publisher.gen_model.generate_content.call_count, 2)
+        self.publisher.img_model.generate_images.assert_called_once()
+        with open(first, 'rb') as f:
+            self.assertEqual(f.read(), b'png')
+
+    def test_render_waits_for_the_prefetched_cover(self):
+        self._models(['A battle at dawn'])
+        self.publisher.prefetch_cover('ta-IN/test/part-1').result()
+        self.publisher.render_video('ta-IN/test/part-1')
+        self.publisher.img_model.generate_images.assert_called_once()
+        names = [call[0][0] for call in self.publisher.bucket.blob.call_args_list]
+        self.assertIn('ta-IN/test/part-1/summary.txt', names)
+        self.assertEqual(self.publisher._cover_prefetches, {})
+        image, _, _ = self.publisher.renderer.render.call_args[0]
+        self.assertFalse(os.path.exists(image))
+
+    def test_prefetches_are_forgotten_when_they_finish(self):
+        with patch.object(self.publisher, 'prepare_cover', side_effect=[RuntimeError('imagen failed'), 'img']):
+            self.publisher.prefetch_cover('ta-IN/test/part-1')
+            self.publisher.prefetch_cover('ta-IN/test/part-2')
+            # the pool's threads run the done callbacks before they exit
+            self.publisher._cover_pool.shutdown(wait=True)
+        self.assertEqual(self.publisher._cover_prefetches, {})
+
+    def test_same_titles_in_different_languages_get_separate_workspaces(self):
+        self.existing = {'staging_image.png'}
+        tamil = self.publisher.render_video('ta-IN/test/part-1')
+        hindi = self.publisher.render_video('hi-IN/test/part-1')
+        self.assertEqual(os.path.basename(tamil), os.path.basename(hindi))
+        self.assertNotEqual(os.path.dirname(tamil), os.path.dirname(hindi))
+        open(tamil, 'w').close()
+        self.publisher.upload_video('ta-IN/test/part-1', tamil)
+        self.assertFalse(os.path.exists(os.path.dirname(tamil)))
+        self.assertTrue(os.path.exists(os.path.dirname(hindi)))
+
+    def test_render_reuses_staging_audio_without_bgm(self):
+        self.existing = {'staging_image.png', 'staging_audio.mp3'}
+        self.publisher.render_video('ta-IN/test/part-1')
+        _, audio, _ = self.publisher.renderer.render.call_args[0]
+        self.assertTrue(audio.endswith('part-1-merged.mp3'))
+        self.assertEqual(self.publisher.renderer.render.call_args[1], {'bgm_path': None})
+
+    def test_staging_audio_is_exported_before_the_video_is_removed(self):
+        self.existing = {'staging_image.png'}
+        self.publisher.write_staging_audio = True
+        self.publisher.renderer.export_audio.side_effect = lambda video, mp3: open(mp3, 'w').close()
+        tmp_file = self.publisher.render_video('ta-IN/test/part-1')
+        open(tmp_file, 'w').close()
+        self.publisher.upload_video('ta-IN/test/part-1', tmp_file)
+        self.publisher.renderer.export_audio.assert_called_once()
+        self.assertFalse(os.path.exists(tmp_file))
+        names = [call[0][0] for call in self.publisher.bucket.blob.call_args_list]
+        self.assertIn('ta-IN/test/part-1/staging_audio.mp3', names)
+
+    def test_add_bgm_mixes_with_the_mixer(self):
+        path = self.publisher.add_bgm('ta-IN/test/part-1', bgm_path='bgm.mp3', clear_tmp=False, duck=0.5)
+        voice, bgm, output = self.publisher.mixer.mix.call_args[0]
+        self.assertTrue(voice.endswith('part-1-content.wav'))
+        self.assertEqual((bgm, output), ('bgm.mp3', path))
+        self.assertEqual(self.publisher.mixer.mix.call_args[1], {'bgm_volume': 0.25, 'duck': 0.5})
+
+    def test_streamed_render_uploads_without_a_local_video(self):
+        self.existing = {'staging_image.png'}
+        self.publisher.stream_uploads = True
+        self.publisher.renderer.render_to_stream.side_effect = lambda image, audio, stream, bgm_path: \
+            stream.write(b'mp4')
+        self.assertIsNone(self.publisher.render_video('ta-IN/test/part-1'))
+        self.publisher.renderer.render.assert_not_called()
+        names = [call[0][0] for call in self.publisher.bucket.blob.call_args_list]
+        self.assertIn('ta-IN/test/part-1/staging_video.mp4', names)
+
+    def test_failed_render_leaves_no_local_files(self):
+        self.existing = {'staging_image.png'}
+        self.publisher.stream_uploads = True
+        self.publisher.renderer.render_to_stream.side_effect = BrokenPipeError('upload closed')
+        with self.assertRaises(BrokenPipeError):
+            self.publisher.render_video('ta-IN/test/part-1')
+        def render(image, audio, output, bgm_path):
+            open(output, 'w').close()
+            raise OSError('disk full')
+
+        self.publisher.renderer.render.side_effect = render
+        self.publisher.stream_uploads = False
+        with self.assertRaises(OSError):
+            self.publisher.render_video('ta-IN/test/part-1')
+        self.assertEqual(os.listdir(self.publisher.workspace('ta-IN/test/part-1')), [])
+        # a missing music file is not an error the render falls back from, a partial mix is left behind
+        self.publisher.mixer.mix.side_effect = lambda voice, bgm, output, **kwargs: \
+            (open(output, 'w').close(), open(bgm))
+        with self.assertRaises(FileNotFoundError):
+            self.publisher.render_video('ta-IN/test/part-1', bgm_path=os.path.join(self.tmp.name, 'missing.mp3'))
+        self.assertEqual(os.listdir(self.publisher.workspace('ta-IN/test/part-1')), [])
+
+    def test_failed_process_video_releases_the_workspace(self):
+        self.existing = {'staging_image.png'}
+        self.publisher.renderer.render.side_effect = OSError('disk full')
+        workspace = self.publisher.workspace('ta-IN/test/part-1')
+        with self.assertRaises(OSError):
+            self.publisher.process_video('ta-IN/test/part-1')
+        self.assertFalse(os.path.exists(workspace))
+
+    def test_failed_stream_falls_back_to_a_local_render(self):
+        self.existing = {'staging_image.png'}
+        self.publisher.stream_uploads = True
+        self.publisher.renderer.render_to_stream.side_effect = RuntimeError('ffmpeg render failed')
+        tmp_file = self.publisher.render_video('ta-IN/test/part-1')
+        self.assertTrue(tmp_file.endswith('part-1-video.mp4'))
+        self.publisher.renderer.render.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from concurrent.futures import Future
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from publisher.farm import RenderFarm
+from utils.metrics import metrics
+
+
+def _job(key, fail=()):
+    metrics.observe('stage_seconds', 1.0, stage='render_video')
+    if key in fail:
+        raise RuntimeError(f'{key} failed')
+    return os.getpid()
+
+
+def _render_with_cover(key, covers):
+    if not key.endswith('-1') and not os.path.exists(os.path.join(covers, key.rsplit('/', 1)[-1])):
+        raise RuntimeError(f'{key} rendered before its cover')
+
+
+class TestRenderFarm(unittest.TestCase):
+
+    def test_every_key_is_reported(self):
+        farm = RenderFarm(workers=2, job=_job, start_method='fork')
+        keys = [f'ta-IN/m/T-part-{i}' for i in range(7)]
+        results = dict(farm.run(iter(keys), fail=('ta-IN/m/T-part-3',)))
+        self.assertEqual(sorted(results), sorted(keys))
+        self.assertIsInstance(results.pop('ta-IN/m/T-part-3'), RuntimeError)
+        self.assertTrue(all(error is None for error in results.values()))
+
+    def test_worker_metrics_reach_the_parent(self):
+        metrics.reset()
+        metrics.inc('source_files_total')
+        farm = RenderFarm(workers=2, job=_job, start_method='fork')
+        list(farm.run([f'ta-IN/m/T-part-{i}' for i in range(3)], fail=('ta-IN/m/T-part-1',)))
+        stages = metrics.summary()['stages']
+        self.assertEqual(stages['stage=render_video']['count'], 3)
+        # counts the parent had before forking are not sent back again
+        self.assertEqual(metrics.value('source_files_total'), 1)
+
+    def test_keys_wait_for_their_prefetched_cover(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            def prefetch(key):
+                # the cover lands a little later, a failed one is left to the worker
+                future = Future()
+                cover = os.path.join(tmp, key.rsplit('/', 1)[-1])
+                failed = key.endswith('-1')
+                threading.Timer(0.2, lambda: future.set_exception(RuntimeError('imagen failed')) if failed
+                                else (open(cover, 'w').close(), future.set_result(cover))).start()
+                return future
+
+            farm = RenderFarm(workers=2, job=_render_with_cover, start_method='fork', prefetch=prefetch)
+            keys = [f'ta-IN/m/T-part-{i}' for i in range(5)]
+            results = dict(farm.run(iter(keys), covers=tmp))
+        self.assertEqual(results, {key: None for key in keys})
+
+    def test_workers_default_to_the_environment(self):
+        with patch.dict('os.environ', {'RENDER_WORKERS': '3'}):
+            self.assertEqual(RenderFarm().workers, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import os
+import sys
+import tempfile
+import unittest
+import wave
+from unittest.mock import patch
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# Mock Google Cloud imports before the publisher package is imported
+with patch('vertexai.init'), \
+     patch('vertexai.generative_models.GenerativeModel'), \
+     patch('google.cloud.storage.Client'), \
+     patch('vertexai.vision_models.ImageGenerationModel'):
+    from publisher import mixer
+    from publisher.mixer import AudioMixer, decode_audio, duck_gains, load_bgm
+    from publisher.render import find_ffmpeg
+
+
+def write_wav(path, samples, rate=8000):
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes((np.asarray(samples) * 32767).astype('<i2').tobytes())
+
+
+class TestAudioMixer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        mixer.clear_bgm_cache()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+        mixer.clear_bgm_cache()
+
+    def test_mix_block_loops_music_across_blocks(self):
+        audio_mixer = AudioMixer(rate=10, channels=1)
+        bgm = np.arange(1, 4, dtype=np.float32).reshape(-1, 1) / 10
+        voice = np.zeros((4, 1), dtype=np.float32)
+        first = audio_mixer.mix_block(voice, bgm, 0, 0.5)
+        second = audio_mixer.mix_block(voice, bgm, 4, 0.5)
+        np.testing.assert_allclose(np.concatenate([first, second])[:, 0],
+                                   [0.05, 0.1, 0.15, 0.05, 0.1, 0.15, 0.05, 0.1], rtol=1e-6)
+        loud = np.ones((2, 1), dtype=np.float32)
+        self.assertEqual(audio_mixer.mix_block(loud, bgm, 0, 1.0).max(), 1.0)
+
+    def test_duck_gains_lower_music_under_speech(self):
+        rate = 1000
+        voice = np.zeros((rate, 1), dtype=np.float32)
+        voice[500:] = 0.5
+        gains = duck_gains(voice, rate, 0.2)
+        self.assertEqual(len(gains), rate)
+        self.assertAlmostEqual(float(gains[100]), 1.0)
+        self.assertAlmostEqual(float(gains[-1]), 0.2)
+        # the change is smoothed over several windows
+        self.assertTrue(0.2 < gains[480] < 1.0)
+
+    def test_load_bgm_decodes_once(self):
+        path = os.path.join(self.tmp.name, 'bgm.wav')
+        write_wav(path, [0.1] * 8)
+        pcm = np.zeros((8, 2), dtype=np.float32)
+        with patch.object(mixer, 'decode_audio', return_value=pcm) as decode:
+            self.assertIs(load_bgm(path), pcm)
+            self.assertIs(load_bgm(path), pcm)
+        decode.assert_called_once()
+
+    @unittest.skipUnless(find_ffmpeg(), "ffmpeg is not available")
+    def test_mix_streams_voice_in_blocks(self):
+        voice_path = os.path.join(self.tmp.name, 'voice.wav')
+        bgm_path = os.path.join(self.tmp.name, 'bgm.wav')
+        write_wav(voice_path, [0.0] * 8000 * 3)
+        write_wav(bgm_path, [0.4] * 8000)
+        output = os.path.join(self.tmp.name, 'mixed.wav')
+        AudioMixer(rate=8000, channels=1, block_seconds=0.7).mix(voice_path, bgm_path, output, bgm_volume=0.5)
+        mixed = decode_audio(output, rate=8000, channels=1)[:, 0]
+        self.assertEqual(len(mixed), 8000 * 3)
+        self.assertAlmostEqual(float(mixed.mean()), 0.2, places=2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+import wave
+from unittest.mock import MagicMock, patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from PIL import Image
+
+# Mock Google Cloud imports before the publisher package is imported
+with patch('vertexai.init'), \
+     patch('vertexai.generative_models.GenerativeModel'), \
+     patch('google.cloud.storage.Client'), \
+     patch('vertexai.vision_models.ImageGenerationModel'):
+    from publisher.render import FfmpegRenderer, MoviepyRenderer, find_ffmpeg, get_renderer
+
+
+def write_wav(path, seconds=2, rate=8000, sample=b'\x00\x00'):
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(sample * rate * seconds)
+
+
+class TestRenderers(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.image = os.path.join(self.tmp.name, 'cover.png')
+        self.audio = os.path.join(self.tmp.name, 'audio.wav')
+        self.output = os.path.join(self.tmp.name, 'video.mp4')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_get_renderer(self):
+        self.assertIsInstance(get_renderer('moviepy'), MoviepyRenderer)
+        renderer = get_renderer('ffmpeg')
+        self.assertIsInstance(renderer, FfmpegRenderer)
+        self.assertIsInstance(renderer.fallback, MoviepyRenderer)
+        with patch.dict('os.environ', {'RENDER_BACKEND': 'moviepy'}):
+            self.assertIsInstance(get_renderer(), MoviepyRenderer)
+        with self.assertRaises(ValueError):
+            get_renderer('blender')
+
+    def test_command_copies_mp4_compatible_audio(self):
+        renderer = FfmpegRenderer(binary='ffmpeg')
+        command = renderer.command('cover.png', 'merged.mp3', 'video.mp4')
+        self.assertEqual(command[command.index('-c:a') + 1], 'copy')
+        self.assertIn('stillimage', command)
+        command = renderer.command('cover.png', 'audio.wav', 'video.mp4')
+        self.assertEqual(command[command.index('-c:a') + 1], 'aac')
+        command = renderer.command('cover.png', 'audio.wav', 'video.mp4', bgm_path='bgm.mp3', bgm_volume=0.5)
+        self.assertIn('volume=0.5', command[command.index('-filter_complex') + 1])
+        self.assertEqual(command[command.index('-c:a') + 1], 'aac')
+        self.assertEqual(command.count('-c:a'), 1)
+
+    def test_falls_back_when_ffmpeg_fails(self):
+        fallback = MagicMock()
+        renderer = FfmpegRenderer(binary='ffmpeg', fallback=fallback)
+        with patch('subprocess.run', return_value=subprocess.CompletedProcess([], 1, b'', b'bad input')):
+            renderer.render(self.image, self.audio, self.output)
+        fallback.render.assert_called_once_with(self.image, self.audio, self.output, None, 0.25)
+        with patch('subprocess.run', return_value=subprocess.CompletedProcess([], 1, b'', b'bad input')):
+            with self.assertRaises(RuntimeError):
+                FfmpegRenderer(binary='ffmpeg').render(self.image, self.audio, self.output)
+
+    @unittest.skipUnless(find_ffmpeg(), "ffmpeg is not available")
+    def test_ffmpeg_renders_still_image(self):
+        # odd dimensions are scaled to even ones for yuv420p
+        Image.new('RGB', (65, 33), 'orange').save(self.image)
+        write_wav(self.audio)
+        FfmpegRenderer().render(self.image, self.audio, self.output)
+        self.assertGreater(os.path.getsize(self.output), 0)
+        from moviepy.video.io.VideoFileClip import VideoFileClip
+        clip = VideoFileClip(self.output)
+        try:
+            self.assertAlmostEqual(clip.duration, 2, delta=1)
+            self.assertEqual(clip.size, [64, 32])
+        finally:
+            clip.close()
+
+    @unittest.skipUnless(find_ffmpeg(), "ffmpeg is not available")
+    def test_ffmpeg_mixes_looped_bgm_in_one_pass(self):
+        Image.new('RGB', (64, 32), 'orange').save(self.image)
+        write_wav(self.audio, seconds=3)
+        bgm = os.path.join(self.tmp.name, 'bgm.wav')
+        write_wav(bgm, seconds=1, sample=b'\x00\x10')
+        renderer = FfmpegRenderer()
+        renderer.render(self.image, self.audio, self.output, bgm_path=bgm, bgm_volume=0.5)
+        from moviepy.audio.io.AudioFileClip import AudioFileClip
+        audio = AudioFileClip(self.output)
+        try:
+            # the one second of music is looped under the whole voice track
+            self.assertAlmostEqual(audio.duration, 3, delta=1)
+            self.assertGreater(abs(audio.subclip(2, 2.5).to_soundarray(fps=8000)).max(), 0.01)
+        finally:
+            audio.close()
+        mp3 = os.path.join(self.tmp.name, 'staging_audio.mp3')
+        renderer.export_audio(self.output, mp3)
+        self.assertGreater(os.path.getsize(mp3), 0)
+
+    @unittest.skipUnless(find_ffmpeg(), "ffmpeg is not available")
+    def test_ffmpeg_renders_into_a_stream(self):
+        Image.new('RGB', (64, 32), 'orange').save(self.image)
+        write_wav(self.audio)
+        stream = io.BytesIO()
+        FfmpegRenderer().render_to_stream(self.image, self.audio, stream)
+        # a fragmented MP4 starts with its file type box and an empty movie header
+        self.assertEqual(stream.getvalue()[4:8], b'ftyp')
+        self.assertIn(b'moof', stream.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# Mock Google Cloud imports before importing our modules
+with patch('vertexai.init'), \
+     patch('vertexai.generative_models.GenerativeModel'), \
+     patch('google.cloud.storage.Client'), \
+     patch('vertexai.vision_models.ImageGenerationModel'):
+    from publisher.youtube import YouTubePublisher
+    from utils.catalog import ArtifactCatalog
+    from utils.transfer import TransferManager
+
+
+class TestYouTubePublisher(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        with patch.dict('os.environ', {'TMP_DIR': self.tmp.name}):
+            self.publisher = YouTubePublisher(bucket='test-bucket', description='default', local_lang='Tamil')
+        self.publisher.bucket = MagicMock()
+        self.publisher.bucket.blob.side_effect = self._blob
+        self.publisher.transfer = TransferManager(self.publisher.bucket)
+        self.publisher.catalog = ArtifactCatalog(self.publisher.bucket, path=os.path.join(self.tmp.name, 'a.db'))
+        self.publisher.get_summary = MagicMock(side_effect=lambda text: f'summary of {text}')
+        self.missing = set()
+
+    def tearDown(self):
+        self.publisher.catalog.close()
+        self.tmp.cleanup()
+
+    def _blob(self, name):
+        blob = MagicMock()
+        blob.name = name
+        blob.size = 0
+        blob.exists.return_value = name.rsplit('/', 2)[-2] not in self.missing and not name.endswith('summary.txt')
+        blob.download_as_bytes.return_value = b'subtitles'
+        blob.download_to_filename.side_effect = lambda path: open(path, 'w').close()
+        return blob
+
+    def test_publish_many_prepares_a_range_and_resumes(self):
+        keys = [f'ta-IN/m/T-part-{i}' for i in range(1, 6)]
+        self.missing = {'T-part-4'}
+        results = self.publisher.publish_many(keys, start=1, end=4, workers=3, tags=['#tamil'])
+        self.assertEqual(sorted(results), keys[1:4])
+        self.assertIsInstance(results.pop('ta-IN/m/T-part-4'), FileNotFoundError)
+        for key, path in results.items():
+            with open(path) as f:
+                details = json.load(f)
+            self.assertEqual(details['description'], 'summary of subtitles\n\nTags: #tamil')
+            self.assertTrue(os.path.exists(details['video_file']))
+        self.assertEqual(self.publisher.get_summary.call_count, 2)
+
+        self.missing = set()
+        again = self.publisher.publish_many(keys, start=1, end=4, tags=['#tamil'])
+        self.assertNotIsInstance(again['ta-IN/m/T-part-4'], Exception)
+        # only the part that failed the first time is prepared again
+        self.assertEqual(self.publisher.get_summary.call_count, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,12 @@
 import json
-
-from vertexai.generative_models import GenerationConfig
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterable, Optional
 
 from publisher import Publisher
 import os
 from config import get_part_summary_in_local_language
+from utils import clients
+from utils.rate_limit import estimate_tokens
 
 
 class YouTubePublisher(Publisher):
@@ -13,34 +15,68 @@ class YouTubePublisher(Publisher):
         super().__init__(bucket, description)
         self.local_lang = local_lang
 
+    def details_path(self, key):
+        return f'{self.tmp_dir}/{key.split("/")[-1]}-details.json'
+
+    def is_prepared(self, key):
+        # a details file is only written once its video is fully downloaded
+        try:
+            with open(self.details_path(key)) as f:
+                return os.path.exists(json.load(f)['video_file'])
+        except (OSError, ValueError, KeyError):
+            return False
+
+    def publish_many(self, keys: Iterable[str], start: int = 0, end: Optional[int] = None,
+                     workers: Optional[int] = None, resume: bool = True, **kwargs) -> Dict[str, object]:
+        """
+        Prepare ``keys[start:end]`` for publishing concurrently, returning each key's details file or error.
+
+        Args:
+            keys: Part keys in publishing order
+            start: Index of the first key to prepare
+            end: Index after the last key to prepare, all remaining keys by default
+            workers: Parts prepared at once, defaults to $PUBLISH_WORKERS (8); model and bucket calls still
+                draw from the shared vertex and gcs rate limits
+            resume: Skip parts whose details file and video are already on disk
+            **kwargs: Passed to publish, e.g. tags
+        """
+        selected = list(keys)[start:end]
+        pending = [key for key in selected if not (resume and self.is_prepared(key))]
+        results = {key: self.details_path(key) for key in selected if key not in pending}
+        if results:
+            self.logger.info(f"Resuming: {len(results)} of {len(selected)} parts already prepared")
+        workers = workers or int(os.getenv("PUBLISH_WORKERS", 8))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='publish') as pool:
+            futures = {pool.submit(self.publish, key, **kwargs): key for key in pending}
+            for done, future in enumerate(as_completed(futures), 1):
+                key = futures[future]
+                try:
+                    results[key] = future.result()
+                    self.logger.info(f"Prepared {key} ({done}/{len(pending)})")
+                except Exception as e:
+                    results[key] = e
+                    self.logger.error(f"Failed to prepare {key}: {e}")
+        return results
+
     def publish(self, key, **kwargs):
         # Check if the video file exists in GCS
-        video_blob = self.bucket.blob(f'{key}/staging_video.mp4')
-        subtitles_blob = self.bucket.blob(f'{key}/subtitles.txt')
-        summary_blob = self.bucket.blob(f'{key}/summary.txt')
-        if not video_blob.exists():
-            raise FileNotFoundError(f"Video file not found in GCS: {video_blob.name}")
+        video_name = f'{key}/staging_video.mp4'
+        subtitles_name = f'{key}/subtitles.txt'
+        summary_name = f'{key}/summary.txt'
+        if not self._exists(video_name):
+            raise FileNotFoundError(f"Video file not found in GCS: {video_name}")
 
         summary = None
         # title is last part of the key
         title = key.split("/")[-1]
         # get description from subtitles file calling llm if it exists otherwise use default_summary
         # use summary from summary blob if it exists otherwise use subtitles file
-        if summary_blob.exists():
-            summary_blob.download_to_filename(f'{self.tmp_dir}/{key.split("/")[-1]}-summary.txt')
-            with open(f'{self.tmp_dir}/{key.split("/")[-1]}-summary.txt', 'r') as f:
-                summary = f.read()
-                summary = self.get_summary(summary)
-            # remove summary file
-            os.remove(f'{self.tmp_dir}/{key.split("/")[-1]}-summary.txt')
-        elif subtitles_blob.exists():
-            subtitles_blob.download_to_filename(f'{self.tmp_dir}/{key.split("/")[-1]}-subtitles.txt')
-            with open(f'{self.tmp_dir}/{key.split("/")[-1]}-subtitles.txt', 'r') as f:
-                subtitles = f.read()
+        # text files are read in memory, only the video goes through the local disk
+        if self._exists(summary_name):
+            summary = self.get_summary(self.transfer.read_text(summary_name))
+        elif self._exists(subtitles_name):
             # Generate a summary using LLM
-            summary = self.get_summary(subtitles)
-            # remove subtitles file
-            os.remove(f'{self.tmp_dir}/{key.split("/")[-1]}-subtitles.txt')
+            summary = self.get_summary(self.transfer.read_text(subtitles_name))
         else:
             summary = self.description
 
@@ -49,37 +85,52 @@ class YouTubePublisher(Publisher):
         # add tags to description
         description = f"{summary}\n\nTags: {', '.join(tags)}"
 
-        # Download the video file to a temporary location
+        # Download the video file to a temporary location, under a partial name until it is complete
         local_video_path = f'{self.tmp_dir}/{key.split("/")[-1]}-video.mp4'
-        video_blob.download_to_filename(local_video_path)
+        self.transfer.download(video_name, local_video_path + '.partial')
+        os.replace(local_video_path + '.partial', local_video_path)
 
         # print the file path, the description to use etc.
-        print(f"Video file downloaded to: {local_video_path}")
-        print(f"Title: {title}")
-        print(f"Description: {description}")
-        print(f"Tags: {', '.join(tags)}")
-        print('****************************************************************')
+        # printed at once, parts are prepared concurrently by publish_many
+        print(f"Video file downloaded to: {local_video_path}\n"
+              f"Title: {title}\n"
+              f"Description: {description}\n"
+              f"Tags: {', '.join(tags)}\n"
+              '****************************************************************')
         # add all of the above details into a map in a tmp file and save it next to the video
         # file
 
-        with open(f'{self.tmp_dir}/{key.split("/")[-1]}-details.json', 'w') as f:
+        details_path = self.details_path(key)
+        with open(details_path + '.partial', 'w') as f:
             json.dump({
                 'title': title,
                 'description': description,
                 'tags': tags,
                 'video_file': local_video_path
             }, f, indent=4)
+        os.replace(details_path + '.partial', details_path)
 
         # # Clean up the temporary file
         # os.remove(local_video_path)
         # # remove {key.split("/")[-1]} from tmp_dir
         # os.rmdir(f'{self.tmp_dir}/{key.split("/")[-1]}')
+        return details_path
 
     def get_summary(self, text):
-        response = self.gen_model.generate_content(
-            get_part_summary_in_local_language(text, self.local_lang),
-            generation_config=GenerationConfig(max_output_tokens=4000,
-                                               temperature=0.8))
+        prompt = get_part_summary_in_local_language(text, self.local_lang)
+        tokens = estimate_tokens(prompt)
+
+        def request():
+            self.vertex_limiter.acquire(tokens=tokens)
+            response = self.hedger.call(lambda: self.gen_model.generate_content(
+                prompt,
+                generation_config=clients.generation_config(max_output_tokens=4000,
+                                                            temperature=0.8)),
+                limiter=self.vertex_limiter, tokens=tokens)
+            self.vertex_limiter.settle(tokens, response)
+            return response
+
+        response = self.vertex.call(request)
         try:
             summary_txt = response.text.replace('```json', '')
             summary_txt = summary_txt.replace('```', '')
@@ -0,0 +1,265 @@
+"""
+Adaptive concurrency, retries and circuit breaking for the cloud APIs the pipeline calls.
+
+Rate limits (see ``rate_limit.py``) hold each API to its nominal quota, but the
+quota a backend really grants varies. An ``AdaptiveController`` per API learns
+it from the answers: the number of calls allowed in flight grows by one per
+limit's worth of successful calls and halves when the API answers 429 or 503.
+Throttled calls are retried with full jitter until a deadline instead of being
+given up at once, and after repeated throttling a circuit breaker stops calling
+the API for a while so a backend that is down is not hammered.
+
+Limits can be overridden with ``ADAPTIVE_<API>_<LIMIT>`` environment variables,
+e.g. ``ADAPTIVE_VERTEX_MAXIMUM=16``.
+"""
+import logging
+import os
+import random
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from .metrics import metrics
+
+ADAPTIVE_LIMITS = {
+    # calls in flight to start from and the bounds the limit moves between
+    "vertex": {"initial": 8, "minimum": 1, "maximum": 64},
+    "tts": {"initial": 4, "minimum": 1, "maximum": 32},
+    "imagen": {"initial": 4, "minimum": 1, "maximum": 16},
+    "gcs": {"initial": 32, "minimum": 2, "maximum": 256},
+}
+# HTTP status codes of quota errors and overloaded backends
+THROTTLING_CODES = {429, 503}
+
+DEFAULT_DEADLINE_SECONDS = 300
+DEFAULT_CIRCUIT_FAILURES = 5
+DEFAULT_CIRCUIT_RESET_SECONDS = 30
+BASE_DELAY = 1.0
+MAX_DELAY = 60.0
+
+logger = logging.getLogger(__name__)
+
+
+def is_throttled(error: BaseException) -> bool:
+    """Whether an error is a quota or overload answer, google.api_core errors carry the HTTP status as ``code``."""
+    code = getattr(error, 'code', None)
+    return isinstance(code, int) and code in THROTTLING_CODES
+
+
+class CircuitOpen(RuntimeError):
+    """Raised when an API's circuit breaker stays open past a call's deadline."""
+
+    def __init__(self, name: str, retry_after: float):
+        # args are the constructor's so the error survives pickling back from a render process
+        super().__init__(name, retry_after)
+        self.name = name
+        self.retry_after = retry_after
+
+    def __str__(self):
+        return f"Circuit for {self.name} is open, retry in {self.retry_after:.1f}s"
+
+
+class AdaptiveLimit:
+    """
+    Limit on calls in flight, moved by additive increase and multiplicative decrease.
+
+    A burst of throttled answers halves the limit once: a throttled call only lowers it if the call started
+    after the last decrease.
+
+    Args:
+        initial: Calls allowed in flight at first
+        minimum: Lowest the limit is decreased to
+        maximum: Highest the limit is increased to
+        decrease: Factor the limit is multiplied by when a call is throttled
+    """
+
+    def __init__(self, initial: float, minimum: float = 1, maximum: float = 64, decrease: float = 0.5):
+        if not 1 <= minimum <= initial <= maximum:
+            raise ValueError(f"Invalid limits: {minimum} <= {initial} <= {maximum}")
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease = decrease
+        self.in_flight = 0
+        self._epoch = 0
+        self._cond = threading.Condition()
+
+    def acquire(self) -> int:
+        """Wait for a free slot and take it; returns a ticket to hand back to ``release``."""
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+            return self._epoch
+
+    def release(self, ticket: int, throttled: bool = False):
+        """Free a slot, growing the limit after a success and shrinking it after a throttled call."""
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                if ticket >= self._epoch:
+                    self.limit = max(self.minimum, self.limit * self.decrease)
+                    self._epoch += 1
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+    def release_neutral(self):
+        """Free a slot without moving the limit, after a call that failed for reasons of its own."""
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+
+class CircuitBreaker:
+    """
+    Stops calls after ``failures`` throttled answers in a row, then lets one probe through every ``reset_after``.
+
+    Args:
+        failures: Consecutive throttled calls that open the circuit
+        reset_after: Seconds the circuit stays open before a probe call is let through
+        clock: Monotonic time source
+    """
+
+    def __init__(self, failures: int = DEFAULT_CIRCUIT_FAILURES, reset_after: float = DEFAULT_CIRCUIT_RESET_SECONDS,
+                 clock: Callable[[], float] = time.monotonic):
+        self.failures = failures
+        self.reset_after = reset_after
+        self.clock = clock
+        self.state = 'closed'
+        self._count = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Whether a call may go out now; in the half-open state only the probe may."""
+        with self._lock:
+            if self.state == 'open' and self.clock() - self._opened_at >= self.reset_after:
+                self.state = 'half_open'
+                return True
+            return self.state == 'closed'
+
+    def retry_after(self) -> float:
+        with self._lock:
+            if self.state == 'half_open':
+                # wait for the probe's answer
+                return min(1.0, self.reset_after)
+            if self.state != 'open':
+                return 0.0
+            return max(0.0, self._opened_at + self.reset_after - self.clock())
+
+    def success(self):
+        with self._lock:
+            self.state = 'closed'
+            self._count = 0
+
+    def failure(self) -> bool:
+        """Count a throttled call; returns True if it opened the circuit."""
+        with self._lock:
+            self._count += 1
+            if self.state == 'half_open' or (self.state == 'closed' and self._count >= self.failures):
+                self.state = 'open'
+                self._opened_at = self.clock()
+                return True
+            return False
+
+
+class AdaptiveController:
+    """
+    Runs calls to one API within an adaptive in-flight limit, retrying throttled calls until a deadline.
+
+    Args:
+        name: API name used in logs and metrics
+        initial: Calls allowed in flight at first
+        minimum: Lowest in-flight limit
+        maximum: Highest in-flight limit
+        deadline: Seconds a call may keep retrying, defaults to $RETRY_DEADLINE_SECONDS
+        breaker: CircuitBreaker, defaults to one configured from $CIRCUIT_FAILURES and $CIRCUIT_RESET_SECONDS
+        clock: Monotonic time source
+        sleep: Function used to wait between attempts
+        jitter: Returns a random fraction of the backoff delay to wait
+    """
+
+    def __init__(self, name: str, initial: float, minimum: float = 1, maximum: float = 64,
+                 deadline: Optional[float] = None, breaker: Optional[CircuitBreaker] = None,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep,
+                 jitter: Callable[[], float] = random.random):
+        self.name = name
+        self.limit = AdaptiveLimit(initial, minimum=minimum, maximum=maximum)
+        self.deadline = deadline if deadline is not None \
+            else float(os.getenv("RETRY_DEADLINE_SECONDS", DEFAULT_DEADLINE_SECONDS))
+        self.breaker = breaker or CircuitBreaker(
+            failures=int(os.getenv("CIRCUIT_FAILURES", DEFAULT_CIRCUIT_FAILURES)),
+            reset_after=float(os.getenv("CIRCUIT_RESET_SECONDS", DEFAULT_CIRCUIT_RESET_SECONDS)), clock=clock)
+        self.clock = clock
+        self.sleep = sleep
+        self.jitter = jitter
+
+    def call(self, fn: Callable[[], object], retry: bool = True):
+        """
+        Result of ``fn()``, calling it again after a throttled answer while the deadline allows.
+
+        Args:
+            fn: The request, it is made again after a 429 or 503 so it must be safe to repeat
+            retry: False for requests that cannot be repeated, e.g. uploads from a stream; they still count
+                towards the limit and the circuit breaker
+        """
+        give_up = self.clock() + self.deadline
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                wait = self.breaker.retry_after()
+                if not retry or self.clock() + wait > give_up:
+                    raise CircuitOpen(self.name, wait)
+                self.sleep(wait)
+                continue
+            ticket = self.limit.acquire()
+            try:
+                result = fn()
+            except Exception as e:
+                if not is_throttled(e):
+                    # the API answered, the error is the request's and says nothing about its capacity
+                    self.limit.release_neutral()
+                    self.breaker.success()
+                    raise
+                self.limit.release(ticket, throttled=True)
+                self._observe()
+                metrics.inc('throttled_total', api=self.name)
+                if self.breaker.failure():
+                    metrics.inc('circuit_opens_total', api=self.name)
+                    logger.warning(f"{self.name} keeps throttling, pausing calls for {self.breaker.reset_after}s")
+                # full jitter, so callers throttled together do not come back together
+                delay = self.jitter() * min(MAX_DELAY, BASE_DELAY * 2 ** attempt)
+                if not retry or self.clock() + delay > give_up:
+                    raise
+                metrics.inc('retries_total', reason='throttled')
+                self.sleep(delay)
+                attempt += 1
+                continue
+            self.limit.release(ticket)
+            self.breaker.success()
+            self._observe()
+            return result
+
+    def _observe(self):
+        metrics.set('concurrency_limit', self.limit.limit, api=self.name)
+
+
+_controllers: Dict[str, AdaptiveController] = {}
+_controllers_lock = threading.Lock()
+
+
+def _limit_from_env(name, limit, default):
+    value = os.getenv(f"ADAPTIVE_{name.upper()}_{limit.upper()}")
+    return float(value) if value else default
+
+
+def get_controller(name: str) -> AdaptiveController:
+    """Return the process-wide controller for an API listed in ``ADAPTIVE_LIMITS``."""
+    with _controllers_lock:
+        if name not in _controllers:
+            if name not in ADAPTIVE_LIMITS:
+                raise ValueError(f"Unknown adaptive API: {name}")
+            limits = {limit: _limit_from_env(name, limit, default) for limit, default in ADAPTIVE_LIMITS[name].items()}
+            _controllers[name] = AdaptiveController(name, **limits)
+        return _controllers[name]
@@ -0,0 +1,582 @@
+"""
+Storage backends behind the bucket interface the pipeline already uses.
+
+Everything that touches storage calls ``bucket.blob(name)`` and the blob's
+``exists``/``download_*``/``upload_*`` methods, so a backend is anything with
+that surface. ``gcs`` is a Cloud Storage bucket behind the shared gcs rate
+limit and an on-disk LRU read-through cache, ``local`` maps object names to
+files under a directory and ``memory`` keeps objects in a dict for the life of
+the process. The local backends make it possible to run the whole pipeline
+offline.
+"""
+import datetime
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+
+from .temp_utils import get_temp_dir
+
+BACKENDS = ('gcs', 'local', 'memory')
+
+DEFAULT_CACHE_MB = 512
+# Renders and narration are read once, caching them would only evict the small objects that are read repeatedly
+DEFAULT_CACHE_OBJECT_MB = 32
+
+_memory_buckets: Dict[str, 'MemoryBucket'] = {}
+_caches: Dict[str, 'BlobCache'] = {}
+_registry_lock = threading.Lock()
+
+
+class NotFound(FileNotFoundError):
+    """Raised by the local backends for a missing object, where GCS raises google.api_core NotFound."""
+
+
+def bucket_name() -> str:
+    """Bucket named by $GCS_BUCKET, with or without its gs:// scheme."""
+    return os.getenv("GCS_BUCKET", "").split("://")[-1]
+
+
+def get_bucket(name: Optional[str] = None, backend: Optional[str] = None):
+    """
+    Bucket-like store for ``name`` (default $GCS_BUCKET) on ``backend`` (default $STORAGE_BACKEND, ``gcs``).
+
+    ``local`` keeps objects under $STORAGE_ROOT/<name> (default a directory in the itihasa temp directory) and
+    ``memory`` returns the same in-process bucket for a name every time. ``gcs`` buckets are rate limited and,
+    unless $STORAGE_CACHE_MB is 0, read through a CachedBucket.
+    """
+    name = name or bucket_name()
+    backend = backend or os.getenv("STORAGE_BACKEND", 'gcs')
+    if backend == 'local':
+        return LocalBucket(os.path.join(os.getenv("STORAGE_ROOT", get_temp_dir('buckets')), name), name=name)
+    if backend == 'memory':
+        with _registry_lock:
+            return _memory_buckets.setdefault(name, MemoryBucket(name))
+    if backend == 'gcs':
+        from .clients import storage_client
+        from .rate_limit import RateLimitedBucket
+
+        # one storage client per process, shared by every bucket
+        bucket = RateLimitedBucket(storage_client().bucket(name))
+        cache = get_blob_cache()
+        # the cache sits outside the rate limit so hits never wait for a token
+        return CachedBucket(bucket, cache=cache) if cache else bucket
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+
+def get_blob_cache() -> Optional['BlobCache']:
+    """
+    Process-wide BlobCache of $STORAGE_CACHE_MB megabytes (default 512) in $STORAGE_CACHE_DIR, None if the size is 0.
+
+    Every bucket in the process shares it so they agree on what is cached and on the total size.
+    """
+    max_mb = int(os.getenv("STORAGE_CACHE_MB", DEFAULT_CACHE_MB))
+    if max_mb <= 0:
+        return None
+    directory = os.getenv("STORAGE_CACHE_DIR", get_temp_dir('blob-cache'))
+    with _registry_lock:
+        if directory not in _caches:
+            _caches[directory] = BlobCache(directory, max_bytes=max_mb * 1024 * 1024)
+        return _caches[directory]
+
+
+class StoredBlob:
+    """
+    Blob methods shared by the local backends, written in terms of ``_reader``, ``_writer`` and ``_stat``.
+
+    Args:
+        bucket: Bucket the blob belongs to
+        name: Object name
+    """
+
+    def __init__(self, bucket, name: str):
+        self.bucket = bucket
+        self.name = name
+        self.content_type = None
+        self.size = None
+        self.md5_hash = None
+        self.crc32c = None
+        self.updated = None
+        self.generation = None
+
+    def _reader(self):
+        raise NotImplementedError
+
+    def _writer(self):
+        raise NotImplementedError
+
+    def _stat(self):
+        """(size, modified timestamp, generation) of the stored object, None if it does not exist."""
+        raise NotImplementedError
+
+    def exists(self) -> bool:
+        return self._stat() is not None
+
+    def reload(self):
+        stat = self._stat()
+        if stat is None:
+            raise NotFound(self.name)
+        self.size, modified, self.generation = stat
+        self.updated = datetime.datetime.fromtimestamp(modified, datetime.timezone.utc)
+
+    def download_to_file(self, f, start: Optional[int] = None, end: Optional[int] = None):
+        with self._reader() as source:
+            if start:
+                source.seek(start)
+            if end is None:
+                shutil.copyfileobj(source, f)
+            else:
+                f.write(source.read(end - (start or 0) + 1))
+
+    def download_to_filename(self, path: str):
+        with open(path, 'wb') as f:
+            self.download_to_file(f)
+
+    def download_as_bytes(self) -> bytes:
+        with self._reader() as source:
+            return source.read()
+
+    def download_as_text(self, encoding: str = 'utf-8') -> str:
+        return self.download_as_bytes().decode(encoding)
+
+    def upload_from_file(self, f, size: Optional[int] = None, content_type: Optional[str] = None):
+        with self._writer() as target:
+            if size is None:
+                shutil.copyfileobj(f, target)
+            else:
+                target.write(f.read(size))
+        self.content_type = content_type or self.content_type
+
+    def upload_from_filename(self, path: str, content_type: Optional[str] = None):
+        with open(path, 'rb') as f:
+            self.upload_from_file(f, content_type=content_type)
+
+    def upload_from_string(self, data, content_type: Optional[str] = None):
+        self.upload_from_file(io.BytesIO(data.encode('utf-8') if isinstance(data, str) else data),
+                              content_type=content_type)
+
+    def compose(self, sources: Iterable['StoredBlob']):
+        with self._writer() as target:
+            for source in sources:
+                source.download_to_file(target)
+
+    def open(self, mode: str = 'rb', chunk_size: Optional[int] = None, content_type: Optional[str] = None):
+        """Readable or writable stream; a written object only appears once the stream is closed."""
+        if mode.startswith('r'):
+            return self._reader() if 'b' in mode else io.TextIOWrapper(self._reader(), encoding='utf-8')
+        if mode != 'wb':
+            raise ValueError(f"Unsupported mode: {mode}")
+        self.content_type = content_type or self.content_type
+        return self._writer()
+
+
+class LocalBlob(StoredBlob):
+
+    def __init__(self, bucket, name: str):
+        super().__init__(bucket, name)
+        self.path = os.path.join(bucket.root, *name.split('/'))
+
+    def _reader(self):
+        try:
+            return open(self.path, 'rb')
+        except FileNotFoundError:
+            raise NotFound(self.name) from None
+
+    def _writer(self):
+        return _AtomicFile(self.path)
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_size, stat.st_mtime, stat.st_mtime_ns
+
+    def delete(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            raise NotFound(self.name) from None
+
+
+class _Commit:
+    """
+    Writer mixin that stores the object on close and drops it if the writer is abandoned, by an exception in
+    its with block or by being garbage collected unclosed, like an unfinished resumable upload.
+    """
+
+    def _commit(self):
+        raise NotImplementedError
+
+    def _abandon(self):
+        pass
+
+    def close(self):
+        if not self.closed:
+            super().close()
+            self._commit()
+
+    def abandon(self):
+        if not self.closed:
+            super().close()
+            self._abandon()
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abandon()
+
+    def __del__(self):
+        self.abandon()
+
+
+class _AtomicFile(_Commit, io.FileIO):
+    """File written next to its target and moved into place on close, so readers never see a partial object."""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._target = path
+        fd, self._partial = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.partial-')
+        super().__init__(fd, 'wb')
+
+    def _commit(self):
+        os.replace(self._partial, self._target)
+
+    def _abandon(self):
+        os.remove(self._partial)
+
+
+class LocalBucket:
+    """
+    Objects stored as files under ``root``, named by their path relative to it.
+
+    Args:
+        root: Directory holding the objects, created if missing
+        name: Bucket name reported to callers, the directory name by default
+    """
+
+    def __init__(self, root: str, name: Optional[str] = None):
+        self.root = os.path.abspath(root)
+        self.name = name or os.path.basename(self.root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def blob(self, name: str) -> LocalBlob:
+        return LocalBlob(self, name)
+
+    def list_blobs(self, prefix: Optional[str] = None, delimiter: Optional[str] = None, fields: Optional[str] = None):
+        names = []
+        for directory, subdirectories, files in os.walk(self.root):
+            subdirectories.sort()
+            for file_name in files:
+                if not file_name.startswith('.partial-'):
+                    names.append(os.path.relpath(os.path.join(directory, file_name), self.root).replace(os.sep, '/'))
+        for name in sorted(names):
+            if prefix and not name.startswith(prefix):
+                continue
+            if delimiter and delimiter in name[len(prefix or ''):]:
+                continue
+            blob = self.blob(name)
+            blob.reload()
+            yield blob
+
+
+class MemoryBlob(StoredBlob):
+
+    def _reader(self):
+        with self.bucket.lock:
+            if self.name not in self.bucket.objects:
+                raise NotFound(self.name)
+            return io.BytesIO(self.bucket.objects[self.name][0])
+
+    def _writer(self):
+        return _MemoryWriter(self.bucket, self.name)
+
+    def _stat(self):
+        with self.bucket.lock:
+            stored = self.bucket.objects.get(self.name)
+        return None if stored is None else (len(stored[0]), stored[1], stored[2])
+
+    def delete(self):
+        with self.bucket.lock:
+            if self.bucket.objects.pop(self.name, None) is None:
+                raise NotFound(self.name)
+
+
+class _MemoryWriter(_Commit, io.BytesIO):
+
+    def __init__(self, bucket, name: str):
+        super().__init__()
+        self._bucket = bucket
+        self._name = name
+
+    def close(self):
+        # the buffer is gone once closed, it is stored first
+        if not self.closed:
+            self._bucket.put(self._name, self.getvalue())
+        io.BytesIO.close(self)
+
+
+class MemoryBucket:
+    """Objects kept as bytes in a dict, shared by everything in the process that asks for the same bucket name."""
+
+    def __init__(self, name: str = 'memory'):
+        self.name = name
+        self.objects = {}
+        self.lock = threading.Lock()
+        self._generation = 0
+
+    def put(self, name: str, data: bytes):
+        with self.lock:
+            self._generation += 1
+            self.objects[name] = (bytes(data), datetime.datetime.now(datetime.timezone.utc).timestamp(),
+                                  self._generation)
+
+    def blob(self, name: str) -> MemoryBlob:
+        return MemoryBlob(self, name)
+
+    def list_blobs(self, prefix: Optional[str] = None, delimiter: Optional[str] = None, fields: Optional[str] = None):
+        with self.lock:
+            names = sorted(self.objects)
+        for name in names:
+            if prefix and not name.startswith(prefix):
+                continue
+            if delimiter and delimiter in name[len(prefix or ''):]:
+                continue
+            blob = self.blob(name)
+            try:
+                blob.reload()
+            except NotFound:
+                continue
+            yield blob
+
+
+class BlobCache:
+    """
+    Size-bounded on-disk LRU cache of object contents keyed by object name.
+
+    Args:
+        directory: Cache directory, defaults to $STORAGE_CACHE_DIR or a directory in the itihasa temp directory
+        max_bytes: Total size kept before the least recently used entries are evicted
+        max_object_bytes: Objects larger than this are never cached, defaults to $STORAGE_CACHE_OBJECT_MB megabytes
+    """
+
+    def __init__(self, directory: Optional[str] = None, max_bytes: int = DEFAULT_CACHE_MB * 1024 * 1024,
+                 max_object_bytes: Optional[int] = None):
+        self.directory = directory or os.getenv("STORAGE_CACHE_DIR", get_temp_dir('blob-cache'))
+        self.max_bytes = max_bytes
+        self.max_object_bytes = max_object_bytes or \
+            int(os.getenv("STORAGE_CACHE_OBJECT_MB", DEFAULT_CACHE_OBJECT_MB)) * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        os.makedirs(self.directory, exist_ok=True)
+        # entries left by earlier runs, least recently used first
+        existing = []
+        for file_name in os.listdir(self.directory):
+            path = os.path.join(self.directory, file_name)
+            if not file_name.startswith('.'):
+                stat = os.stat(path)
+                existing.append((stat.st_mtime, file_name, stat.st_size))
+        for _, file_name, size in sorted(existing):
+            self._entries[file_name] = size
+        self._size = sum(self._entries.values())
+
+    @staticmethod
+    def key(name: str) -> str:
+        return hashlib.sha256(name.encode('utf-8')).hexdigest()
+
+    def path(self, name: str) -> Optional[str]:
+        """Path of the cached copy of ``name``, marked as recently used, or None on a miss."""
+        key = self.key(name)
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        path = os.path.join(self.directory, key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # evicted by another process sharing the directory
+            self.discard(name)
+            return None
+        return path
+
+    def size(self, name: str) -> Optional[int]:
+        with self._lock:
+            return self._entries.get(self.key(name))
+
+    def partial_path(self) -> str:
+        fd, path = tempfile.mkstemp(dir=self.directory, prefix='.partial-')
+        os.close(fd)
+        return path
+
+    def admit(self, name: str, partial_path: str) -> bool:
+        """Move a downloaded file into the cache, False (leaving the file) if it is too large to cache."""
+        size = os.path.getsize(partial_path)
+        if size > self.max_object_bytes or size > self.max_bytes:
+            return False
+        key = self.key(name)
+        os.replace(partial_path, os.path.join(self.directory, key))
+        with self._lock:
+            self._size += size - self._entries.pop(key, 0)
+            self._entries[key] = size
+            evicted = []
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                old_key, old_size = self._entries.popitem(last=False)
+                self._size -= old_size
+                evicted.append(old_key)
+        for old_key in evicted:
+            try:
+                os.remove(os.path.join(self.directory, old_key))
+            except FileNotFoundError:
+                pass
+        return True
+
+    def put_bytes(self, name: str, data: bytes):
+        if len(data) > self.max_object_bytes:
+            self.discard(name)
+            return
+        partial = self.partial_path()
+        with open(partial, 'wb') as f:
+            f.write(data)
+        self.admit(name, partial)
+
+    def discard(self, name: str):
+        key = self.key(name)
+        with self._lock:
+            self._size -= self._entries.pop(key, 0)
+        try:
+            os.remove(os.path.join(self.directory, key))
+        except FileNotFoundError:
+            pass
+
+
+class CachedBucket:
+    """
+    Read-through cache in front of a remote bucket.
+
+    Whole-object reads are served from the BlobCache and fill it on a miss, writes made through the bucket
+    update or drop the cached copy. Objects changed by other writers are not noticed until they are evicted,
+    which suits this pipeline where a part's artifacts are written once.
+
+    Args:
+        bucket: Remote bucket, usually a RateLimitedBucket
+        cache: BlobCache to use, one with ``max_bytes`` is created by default
+        max_bytes: Cache size when the cache is created here
+    """
+
+    def __init__(self, bucket, cache: Optional[BlobCache] = None, max_bytes: int = DEFAULT_CACHE_MB * 1024 * 1024):
+        self._bucket = bucket
+        self.cache = cache or BlobCache(max_bytes=max_bytes)
+
+    def blob(self, *args, **kwargs):
+        return _CachedBlob(self._bucket.blob(*args, **kwargs), self.cache)
+
+    def __getattr__(self, item):
+        return getattr(self._bucket, item)
+
+
+class _CachedBlob:
+
+    def __init__(self, blob, cache: BlobCache):
+        object.__setattr__(self, '_blob', blob)
+        object.__setattr__(self, '_cache', cache)
+
+    def __setattr__(self, key, value):
+        setattr(self._blob, key, value)
+
+    def __getattr__(self, item):
+        return getattr(self._blob, item)
+
+    @property
+    def size(self):
+        cached = self._cache.size(self._blob.name)
+        return self._blob.size if cached is None else cached
+
+    def exists(self, *args, **kwargs) -> bool:
+        return self._cache.size(self._blob.name) is not None or self._blob.exists(*args, **kwargs)
+
+    def reload(self, *args, **kwargs):
+        # the size of a cached object is known without asking the bucket
+        if self._cache.size(self._blob.name) is None:
+            self._blob.reload(*args, **kwargs)
+
+    def download_to_filename(self, path: str, *args, **kwargs):
+        cached = self._cache.path(self._blob.name)
+        if cached is None:
+            partial = self._cache.partial_path()
+            try:
+                self._blob.download_to_filename(partial, *args, **kwargs)
+            except BaseException:
+                os.remove(partial)
+                raise
+            if not self._cache.admit(self._blob.name, partial):
+                # too large to cache, the download is the file itself
+                shutil.move(partial, path)
+                return
+            cached = os.path.join(self._cache.directory, self._cache.key(self._blob.name))
+        shutil.copyfile(cached, path)
+
+    def download_to_file(self, f, start: Optional[int] = None, end: Optional[int] = None, *args, **kwargs):
+        cached = self._cache.path(self._blob.name)
+        if cached is None:
+            return self._blob.download_to_file(f, *args, start=start, end=end, **kwargs)
+        with open(cached, 'rb') as source:
+            if start:
+                source.seek(start)
+            if end is None:
+                shutil.copyfileobj(source, f)
+            else:
+                f.write(source.read(end - (start or 0) + 1))
+
+    def download_as_bytes(self, *args, **kwargs) -> bytes:
+        cached = self._cache.path(self._blob.name)
+        if cached is None:
+            data = self._blob.download_as_bytes(*args, **kwargs)
+            self._cache.put_bytes(self._blob.name, data)
+            return data
+        with open(cached, 'rb') as f:
+            return f.read()
+
+    def download_as_text(self, encoding: str = 'utf-8', *args, **kwargs) -> str:
+        return self.download_as_bytes().decode(encoding)
+
+    def upload_from_string(self, data, *args, **kwargs):
+        self._cache.discard(self._blob.name)
+        self._blob.upload_from_string(data, *args, **kwargs)
+        self._cache.put_bytes(self._blob.name, data.encode('utf-8') if isinstance(data, str) else data)
+
+    def upload_from_filename(self, path: str, *args, **kwargs):
+        self._cache.discard(self._blob.name)
+        self._blob.upload_from_filename(path, *args, **kwargs)
+        if os.path.getsize(path) <= self._cache.max_object_bytes:
+            partial = self._cache.partial_path()
+            shutil.copyfile(path, partial)
+            if not self._cache.admit(self._blob.name, partial):
+                os.remove(partial)
+
+    def upload_from_file(self, *args, **kwargs):
+        self._cache.discard(self._blob.name)
+        return self._blob.upload_from_file(*args, **kwargs)
+
+    def compose(self, *args, **kwargs):
+        self._cache.discard(self._blob.name)
+        return self._blob.compose(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        self._cache.discard(self._blob.name)
+        return self._blob.delete(*args, **kwargs)
+
+    def open(self, mode: str = 'r', *args, **kwargs):
+        if not mode.startswith('r'):
+            self._cache.discard(self._blob.name)
+        return self._blob.open(mode, *args, **kwargs)
+
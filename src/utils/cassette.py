@@ -0,0 +1,378 @@
+"""
+Record and replay of Gemini, Imagen and long-audio TTS calls.
+
+With $CASSETTE_MODE set to ``record`` every request and response of
+``generate_content``, ``generate_images`` and ``synthesize_long_audio`` made
+through ``utils.clients`` is saved to a cassette: a SQLite index of responses
+keyed by a hash of the request, with images and synthesized audio stored once
+per content hash next to it. ``replay`` serves the recorded responses back
+instead of calling the services, in recorded order when the same request was
+made more than once, and writes recorded audio into the bucket the request
+names. ``auto`` replays what it has and records the rest. Replayed calls return
+at once unless $CASSETTE_LATENCY scales the recorded latencies back in.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+from typing import Callable, Dict, Optional, Tuple
+
+from .temp_utils import get_temp_dir
+
+MODES = ('off', 'record', 'replay', 'auto')
+
+_cassettes: Dict[str, 'Cassette'] = {}
+_registry_lock = threading.Lock()
+
+
+class CassetteMiss(LookupError):
+    """Raised in replay mode for a request the cassette has no recording of."""
+
+
+def request_key(call: str, *parts) -> str:
+    """Hash of a call and everything in its request that changes the response."""
+    payload = json.dumps([call, *parts], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def cassette_mode() -> str:
+    mode = os.getenv("CASSETTE_MODE", 'off') or 'off'
+    if mode not in MODES:
+        raise ValueError(f"Unknown cassette mode: {mode}")
+    return mode
+
+
+def get_cassette() -> 'Cassette':
+    """Process-wide Cassette in $CASSETTE_DIR (default ``cassettes`` in the itihasa temp directory)."""
+    directory = os.getenv("CASSETTE_DIR") or get_temp_dir('cassettes')
+    with _registry_lock:
+        if directory not in _cassettes:
+            _cassettes[directory] = Cassette(directory)
+        return _cassettes[directory]
+
+
+class Cassette:
+    """
+    Recorded responses by request key, with binary payloads stored once per content hash.
+
+    Args:
+        directory: Directory of the ``calls.db`` index and the ``blobs`` payloads
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.blob_dir = os.path.join(directory, 'blobs')
+        os.makedirs(self.blob_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        # how many recordings of each key this process has replayed
+        self._replayed: Dict[str, int] = {}
+        self._conn = sqlite3.connect(os.path.join(directory, 'calls.db'), check_same_thread=False)
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS calls (
+                    key TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    call TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    latency REAL NOT NULL,
+                    created REAL NOT NULL,
+                    PRIMARY KEY (key, seq)
+                )""")
+
+    def put_blob(self, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        path = os.path.join(self.blob_dir, digest)
+        if not os.path.exists(path):
+            fd, partial = tempfile.mkstemp(dir=self.blob_dir, prefix='.partial-')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(partial, path)
+        return digest
+
+    def blob(self, digest: str) -> bytes:
+        with open(os.path.join(self.blob_dir, digest), 'rb') as f:
+            return f.read()
+
+    def record(self, key: str, call: str, response: dict, latency: float):
+        data = json.dumps(response, ensure_ascii=False)
+        with self._lock, self._conn:
+            seq = self._conn.execute("SELECT COUNT(*) FROM calls WHERE key = ?", (key,)).fetchone()[0]
+            self._conn.execute("INSERT INTO calls (key, seq, call, response, latency, created) "
+                               "VALUES (?, ?, ?, ?, ?, ?)", (key, seq, call, data, latency, time.time()))
+
+    def next(self, key: str) -> Optional[Tuple[dict, float]]:
+        """Next recording of ``key`` in recorded order, the last one once all were replayed, None if there is none."""
+        with self._lock:
+            seq = self._replayed.get(key, 0)
+            row = self._conn.execute("SELECT response, latency FROM calls WHERE key = ? AND seq <= ? "
+                                     "ORDER BY seq DESC LIMIT 1", (key, seq)).fetchone()
+            if row is None:
+                return None
+            self._replayed[key] = seq + 1
+        return json.loads(row[0]), row[1]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class _Player:
+    """Plays a call back from the cassette or makes it on the lazily built client and records it."""
+
+    def __init__(self, factory: Callable[[], object], cassette: Cassette, mode: str, latency_scale: float,
+                 sleep: Callable[[float], None]):
+        self._factory = factory
+        self._client = None
+        self._client_lock = threading.Lock()
+        self.cassette = cassette
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.sleep = sleep
+
+    @property
+    def client(self):
+        # never built in replay mode, so replaying needs no credentials
+        with self._client_lock:
+            if self._client is None:
+                self._client = self._factory()
+            return self._client
+
+    def __getattr__(self, item):
+        # anything that is not recorded goes to the real client
+        if item.startswith('_'):
+            raise AttributeError(item)
+        return getattr(self.client, item)
+
+    def _replay(self, key: str, call: str) -> Optional[Tuple[dict, float]]:
+        if self.mode not in ('replay', 'auto'):
+            return None
+        hit = self.cassette.next(key)
+        if hit is None and self.mode == 'replay':
+            raise CassetteMiss(f"No recorded {call} call for request {key}")
+        return hit
+
+    def _wait(self, latency: float):
+        if self.latency_scale > 0:
+            self.sleep(latency * self.latency_scale)
+
+
+def _generation_config(config):
+    if config is None:
+        return None
+    return config.to_dict() if hasattr(config, 'to_dict') else config
+
+
+def _usage(response) -> dict:
+    usage = getattr(response, 'usage_metadata', None)
+    fields = ('prompt_token_count', 'candidates_token_count', 'total_token_count')
+    return {field: getattr(usage, field) for field in fields if isinstance(getattr(usage, field, None), int)}
+
+
+class ReplayedResponse:
+    """A recorded ``generate_content`` response; ``text`` raises like the real one if the response had none."""
+
+    def __init__(self, data: dict):
+        self._data = data
+        finish_reason = data.get('finish_reason')
+        self.candidates = [SimpleNamespace(finish_reason=SimpleNamespace(name=finish_reason))] \
+            if finish_reason else []
+        self.usage_metadata = SimpleNamespace(**data.get('usage', {}))
+
+    @property
+    def text(self) -> str:
+        if self._data.get('text') is None:
+            raise ValueError(self._data.get('error') or 'The recorded response has no text')
+        return self._data['text']
+
+
+class CassetteModel(_Player):
+    """``GenerativeModel`` stand-in recording or replaying ``generate_content``."""
+
+    def __init__(self, factory, model_id: str, cassette: Cassette, mode: str, latency_scale: float = 0.0,
+                 sleep: Callable[[float], None] = time.sleep):
+        super().__init__(factory, cassette, mode, latency_scale, sleep)
+        self.model_id = model_id
+
+    def generate_content(self, contents, generation_config=None, **kwargs):
+        key = request_key('generate_content', self.model_id, contents, _generation_config(generation_config),
+                          sorted(kwargs.items()))
+        hit = self._replay(key, 'generate_content')
+        if hit is not None:
+            self._wait(hit[1])
+            return ReplayedResponse(hit[0])
+        started = time.monotonic()
+        response = self.client.generate_content(contents, generation_config=generation_config, **kwargs)
+        latency = time.monotonic() - started
+        try:
+            text, error = response.text, None
+        except Exception as e:
+            # blocked responses have no text, the replay raises the same way
+            text, error = None, str(e)
+        candidates = getattr(response, 'candidates', None) or []
+        finish_reason = getattr(candidates[0], 'finish_reason', None) if candidates else None
+        self.cassette.record(key, 'generate_content', {
+            'text': text if isinstance(text, str) else None,
+            'error': error,
+            'finish_reason': getattr(finish_reason, 'name', finish_reason) if finish_reason is not None else None,
+            'usage': _usage(response),
+        }, latency)
+        return response
+
+
+class CassetteImageModel(_Player):
+    """``ImageGenerationModel`` stand-in recording or replaying ``generate_images``."""
+
+    def __init__(self, factory, model_id: str, cassette: Cassette, mode: str, latency_scale: float = 0.0,
+                 sleep: Callable[[float], None] = time.sleep):
+        super().__init__(factory, cassette, mode, latency_scale, sleep)
+        self.model_id = model_id
+
+    def generate_images(self, prompt, number_of_images=1, **kwargs):
+        key = request_key('generate_images', self.model_id, prompt, number_of_images, sorted(kwargs.items()))
+        hit = self._replay(key, 'generate_images')
+        if hit is not None:
+            self._wait(hit[1])
+            return SimpleNamespace(images=[SimpleNamespace(_mime_type=image['mime_type'],
+                                                           _image_bytes=self.cassette.blob(image['blob']))
+                                           for image in hit[0]['images']])
+        started = time.monotonic()
+        response = self.client.generate_images(prompt=prompt, number_of_images=number_of_images, **kwargs)
+        latency = time.monotonic() - started
+        self.cassette.record(key, 'generate_images', {
+            'images': [{'mime_type': image._mime_type, 'blob': self.cassette.put_blob(image._image_bytes)}
+                       for image in response.images],
+        }, latency)
+        return response
+
+
+def _output_object(uri: str) -> Tuple[str, str]:
+    # gs://<bucket>/<object> as (bucket, object)
+    bucket, name = uri.split('://', 1)[-1].split('/', 1)
+    return bucket, name
+
+
+def _synthesis_request(request) -> dict:
+    # the output location and project do not change the audio, a replay may write it anywhere
+    data = type(request).to_dict(request) if hasattr(type(request), 'to_dict') else dict(vars(request))
+    data.pop('output_gcs_uri', None)
+    data.pop('parent', None)
+    return data
+
+
+class _RecordingOperation:
+    """Wraps a synthesis operation and saves its audio once the operation is done and the audio has landed."""
+
+    def __init__(self, operation, save: Callable[[], bool]):
+        self._operation = operation
+        self._save = save
+        self._saved = False
+
+    def done(self):
+        done = self._operation.done()
+        if done and not self._saved and not self._operation.exception():
+            self._saved = self._save()
+        return done
+
+    def __getattr__(self, item):
+        return getattr(self._operation, item)
+
+
+class ReplayedOperation:
+    """Synthesis operation whose recorded audio is written into the bucket after the recorded latency."""
+
+    def __init__(self, name: str):
+        self.operation = SimpleNamespace(name=name)
+        self._done = threading.Event()
+        self._error = None
+
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def exception(self):
+        return self._error
+
+    def finish(self, error: Optional[BaseException] = None):
+        self._error = error
+        self._done.set()
+
+
+class CassetteSpeechClient(_Player):
+    """
+    ``TextToSpeechLongAudioSynthesizeClient`` stand-in recording or replaying ``synthesize_long_audio``.
+
+    Args:
+        get_bucket: Returns the bucket of a name, recorded audio is read from and replayed audio written to it
+    """
+
+    def __init__(self, factory, get_bucket: Callable[[str], object], cassette: Cassette, mode: str,
+                 latency_scale: float = 0.0, sleep: Callable[[float], None] = time.sleep):
+        super().__init__(factory, cassette, mode, latency_scale, sleep)
+        self.get_bucket = get_bucket
+
+    def synthesize_long_audio(self, request, **kwargs):
+        key = request_key('synthesize_long_audio', _synthesis_request(request))
+        bucket_name, name = _output_object(request.output_gcs_uri)
+        hit = self._replay(key, 'synthesize_long_audio')
+        if hit is not None:
+            recorded, latency = hit
+            operation = ReplayedOperation(recorded['operation'])
+            if self.latency_scale > 0:
+                timer = threading.Timer(latency * self.latency_scale, self._write,
+                                        (operation, bucket_name, name, recorded['blob']))
+                timer.daemon = True
+                timer.start()
+            else:
+                self._write(operation, bucket_name, name, recorded['blob'])
+            return operation
+        started = time.monotonic()
+        operation = self.client.synthesize_long_audio(request=request, **kwargs)
+
+        def save():
+            # the audio can land a little after the operation reports done, the next poll tries again
+            try:
+                audio = self.get_bucket(bucket_name).blob(name).download_as_bytes()
+            except Exception:
+                return False
+            self.cassette.record(key, 'synthesize_long_audio', {
+                'operation': operation.operation.name, 'blob': self.cassette.put_blob(audio)},
+                time.monotonic() - started)
+            return True
+
+        return _RecordingOperation(operation, save)
+
+    def _write(self, operation: ReplayedOperation, bucket_name: str, name: str, digest: str):
+        try:
+            self.get_bucket(bucket_name).blob(name).upload_from_string(self.cassette.blob(digest),
+                                                                       content_type='audio/wav')
+        except Exception as e:
+            operation.finish(e)
+        else:
+            operation.finish()
+
+
+def wrap(kind: str, factory: Callable[[], object], model_id: Optional[str] = None):
+    """
+    Client built by ``factory``, behind a cassette player when $CASSETTE_MODE is not ``off``.
+
+    Args:
+        kind: ``generative_model``, ``image_model`` or ``tts``
+        factory: Builds the real client, only called when a call has to be made for real
+        model_id: Model of a generative or image model, part of every request key
+    """
+    mode = cassette_mode()
+    if mode == 'off':
+        return factory()
+    cassette = get_cassette()
+    latency_scale = float(os.getenv("CASSETTE_LATENCY", 0))
+    if kind == 'generative_model':
+        return CassetteModel(factory, model_id, cassette, mode, latency_scale)
+    if kind == 'image_model':
+        return CassetteImageModel(factory, model_id, cassette, mode, latency_scale)
+    if kind == 'tts':
+        from .blobstore import get_bucket
+        return CassetteSpeechClient(factory, get_bucket, cassette, mode, latency_scale)
+    raise ValueError(f"Unknown cassette client: {kind}")
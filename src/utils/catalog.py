@@ -0,0 +1,179 @@
+"""
+Local catalog of the artifacts stored in the bucket.
+
+Objects are laid out as ``<lang>/<content id>/<title>[-part-<n>]/<artifact>``,
+e.g. ``ta-IN/mahabharat/Mahabharat-part-12/staging_video.mp4``. The catalog
+keeps one row per object, synced from bucket listings (one request per thousand
+objects) and kept current by the uploads this process makes, so questions such
+as "which parts still need a video" are answered without a request per object.
+Objects written by others since the last listing are not in it until they are
+recorded or the prefix is synced again.
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from typing import Dict, Iterable, List, Optional
+
+from .temp_utils import get_temp_dir
+
+# A stored object split into its parts, key is everything before the artifact name and title is the part
+# folder without its -part-<n> suffix
+Artifact = namedtuple('Artifact', ['name', 'lang', 'content_id', 'key', 'title', 'part_number', 'artifact'])
+
+LIST_FIELDS = 'items(name,size,md5Hash,crc32c,updated,generation),nextPageToken'
+
+
+def parse_name(name: str) -> Optional[Artifact]:
+    """Split an object name into its catalog fields, None for names outside the part layout."""
+    segments = name.split('/')
+    if len(segments) != 4 or not all(segments):
+        return None
+    lang, content_id, folder, artifact = segments
+    title, _, part = folder.rpartition('-part-') if '-part-' in folder else (folder, '', '0')
+    return Artifact(name, lang, content_id, '/'.join(segments[:3]), title,
+                    int(part) if part.isdigit() else 0, artifact)
+
+
+class ArtifactCatalog:
+    """
+    SQLite-backed index of bucket objects by language, content id, part number and artifact.
+
+    Args:
+        bucket: Bucket the catalog describes
+        path: Database file, defaults to $ARTIFACT_CATALOG_PATH or a file in the itihasa temp directory
+    """
+
+    def __init__(self, bucket, path: Optional[str] = None):
+        self.bucket = bucket
+        self.path = path or os.getenv("ARTIFACT_CATALOG_PATH", os.path.join(get_temp_dir('catalog'), 'artifacts.db'))
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS artifacts (
+                    name TEXT PRIMARY KEY,
+                    lang TEXT NOT NULL,
+                    content_id TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    title TEXT NOT NULL,
+                    part_number INTEGER NOT NULL,
+                    artifact TEXT NOT NULL,
+                    size INTEGER,
+                    checksum TEXT,
+                    updated TEXT,
+                    generation INTEGER
+                )""")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS artifacts_part ON artifacts (lang, content_id, title, part_number)")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS syncs (
+                    prefix TEXT PRIMARY KEY,
+                    synced_at REAL NOT NULL
+                )""")
+
+    def sync(self, prefix: str, max_age: Optional[float] = None) -> Dict[str, int]:
+        """
+        Bring the rows under ``prefix`` in line with a listing of the bucket.
+
+        Only rows whose object generation changed are rewritten and rows of deleted objects are removed.
+        With ``max_age`` (default $ARTIFACT_CATALOG_MAX_AGE seconds, 0) a prefix synced more recently than
+        that is not listed again. Returns the number of added, updated and removed rows.
+        """
+        max_age = float(os.getenv("ARTIFACT_CATALOG_MAX_AGE", 0)) if max_age is None else max_age
+        with self._lock:
+            row = self._conn.execute("SELECT synced_at FROM syncs WHERE prefix = ?", (prefix,)).fetchone()
+        if row and max_age and time.time() - row[0] < max_age:
+            return {'added': 0, 'updated': 0, 'removed': 0}
+
+        listed = {}
+        for blob in self.bucket.list_blobs(prefix=prefix, fields=LIST_FIELDS):
+            artifact = parse_name(blob.name)
+            if artifact:
+                updated = getattr(blob, 'updated', None)
+                listed[blob.name] = (artifact, blob.size, blob.md5_hash or getattr(blob, 'crc32c', None),
+                                     updated.isoformat() if updated is not None else None, blob.generation)
+        counts = {'added': 0, 'updated': 0, 'removed': 0}
+        with self._lock, self._conn:
+            known = dict(self._conn.execute("SELECT name, generation FROM artifacts WHERE name LIKE ? ESCAPE '\\'",
+                                            (self._like(prefix),)))
+            for name, (artifact, size, checksum, updated, generation) in listed.items():
+                if name in known and known[name] == generation and generation is not None:
+                    continue
+                counts['updated' if name in known else 'added'] += 1
+                self._upsert(artifact, size, checksum, updated, generation)
+            removed = [(name,) for name in known if name not in listed]
+            self._conn.executemany("DELETE FROM artifacts WHERE name = ?", removed)
+            counts['removed'] = len(removed)
+            self._conn.execute("INSERT OR REPLACE INTO syncs (prefix, synced_at) VALUES (?, ?)", (prefix, time.time()))
+        return counts
+
+    @staticmethod
+    def _like(prefix):
+        return prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+    def _upsert(self, artifact, size, checksum, updated, generation):
+        self._conn.execute("""
+            INSERT OR REPLACE INTO artifacts
+                (name, lang, content_id, key, title, part_number, artifact, size, checksum, updated, generation)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", (*artifact, size, checksum, updated, generation))
+
+    def record(self, name: str, size: Optional[int] = None):
+        """Add an object this process just wrote, so the catalog stays current without another listing."""
+        artifact = parse_name(name)
+        if artifact is None:
+            return
+        with self._lock, self._conn:
+            self._upsert(artifact, size, None, time.strftime('%Y-%m-%dT%H:%M:%S%z'), None)
+
+    def forget(self, name: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM artifacts WHERE name = ?", (name,))
+
+    def covers(self, name: str) -> bool:
+        """Whether ``name`` lies under a synced prefix, so a missing row means the object does not exist."""
+        with self._lock:
+            prefixes = [row[0] for row in self._conn.execute("SELECT prefix FROM syncs")]
+        return any(name.startswith(prefix) for prefix in prefixes)
+
+    def exists(self, name: str) -> Optional[bool]:
+        """
+        Whether the object exists according to the catalog, None if the catalog does not cover it.
+
+        False only means the object was not there at the last listing and has not been recorded since; objects
+        other processes or services write in between are missing, so callers confirm a False with the bucket.
+        """
+        if not self.covers(name):
+            return None
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM artifacts WHERE name = ?", (name,)).fetchone() is not None
+
+    def size(self, name: str) -> Optional[int]:
+        """Size of the object in bytes as listed or recorded, None if the catalog does not know it."""
+        with self._lock:
+            row = self._conn.execute("SELECT size FROM artifacts WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def keys(self, lang: str, content_id: str, artifact: Optional[str] = None) -> List[str]:
+        """Part keys of a content by title and part number, only those that have ``artifact`` if it is given."""
+        query = "SELECT DISTINCT key, title, part_number FROM artifacts WHERE lang = ? AND content_id = ?"
+        args = [lang, content_id]
+        if artifact:
+            query += " AND artifact = ?"
+            args.append(artifact)
+        with self._lock:
+            return [row[0] for row in self._conn.execute(query + " ORDER BY title, part_number, key", args)]
+
+    def pending(self, lang: str, content_id: str, artifact: str, requires: Iterable[str] = ()) -> List[str]:
+        """Part keys that have every ``requires`` artifact but not ``artifact`` yet, in part order."""
+        done = set(self.keys(lang, content_id, artifact))
+        ready = None
+        for required in requires:
+            keys = set(self.keys(lang, content_id, required))
+            ready = keys if ready is None else ready & keys
+        candidates = self.keys(lang, content_id)
+        return [key for key in candidates if key not in done and (ready is None or key in ready)]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,102 @@
+"""
+Process-wide registry of Google Cloud clients, created on first use.
+
+Importing the Vertex AI, Text-to-Speech and Cloud Storage libraries takes
+seconds and every client opens its own channels, so nothing here is imported
+or built until a client is asked for. After that, every Publisher, curator and
+script in the process shares the same instance. The registry is cleared in a
+forked child, which must open its own channels. With $CASSETTE_MODE set the
+model and TTS clients are wrapped to record or replay their calls, see
+``utils.cassette``.
+"""
+import os
+import threading
+from typing import Callable, Dict, Optional
+
+from . import cassette
+
+_clients: Dict[tuple, object] = {}
+_lock = threading.RLock()
+_vertex_initialized = False
+
+
+def get_client(key: tuple, factory: Callable[[], object]):
+    """Client registered under ``key``, built with ``factory`` the first time it is asked for."""
+    with _lock:
+        if key not in _clients:
+            _clients[key] = factory()
+        return _clients[key]
+
+
+def reset():
+    """Forget every client, the next request for one builds it again."""
+    global _vertex_initialized
+    with _lock:
+        _clients.clear()
+        _vertex_initialized = False
+
+
+def init_vertex():
+    """Run ``vertexai.init`` once per process with $GCP_PARENT_PROJECT and $GCP_LOCATION."""
+    global _vertex_initialized
+    with _lock:
+        if not _vertex_initialized:
+            import vertexai
+
+            vertexai.init(project=os.getenv("GCP_PARENT_PROJECT"), location=os.getenv("GCP_LOCATION"))
+            _vertex_initialized = True
+
+
+def storage_client():
+    def build():
+        from google.cloud import storage
+        return storage.Client()
+
+    return get_client(('storage',), build)
+
+
+def generative_model(model_id: Optional[str] = None):
+    """Gemini model ``model_id``, $VERTEX_MODEL_ID by default."""
+    model_id = model_id or os.getenv("VERTEX_MODEL_ID", "gemini-2.0-flash-001")
+
+    def build():
+        init_vertex()
+        from vertexai.generative_models import GenerativeModel
+        return GenerativeModel(model_id)
+
+    return get_client(('generative_model', model_id), lambda: cassette.wrap('generative_model', build, model_id))
+
+
+def image_model(model_id: str):
+    def build():
+        init_vertex()
+        from vertexai.vision_models import ImageGenerationModel
+        return ImageGenerationModel.from_pretrained(model_id)
+
+    return get_client(('image_model', model_id), lambda: cassette.wrap('image_model', build, model_id))
+
+
+def tts_client():
+    def build():
+        from google.cloud import texttospeech
+        return texttospeech.TextToSpeechLongAudioSynthesizeClient()
+
+    return get_client(('tts',), lambda: cassette.wrap('tts', build))
+
+
+def generation_config(**kwargs):
+    """Vertex GenerationConfig built from ``kwargs``, imported on first use."""
+    from vertexai.generative_models import GenerationConfig
+    return GenerationConfig(**kwargs)
+
+
+def _after_fork():
+    # the parent's lock may have been held by another thread at the fork, the child starts with a fresh one
+    global _lock, _vertex_initialized
+    _lock = threading.RLock()
+    _clients.clear()
+    _vertex_initialized = False
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
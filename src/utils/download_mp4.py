@@ -1,30 +1,30 @@
-import os
+import argparse
 
 from config import set_system_env_defaults
 from publisher.youtube import YouTubePublisher
 
 if __name__ == '__main__':
-    start_offset = 85
+    parser = argparse.ArgumentParser(description='Prepare the Tamil Mahabharat parts for YouTube.')
+    # parts before --start were published by earlier runs whose details files are gone; later parts with a details
+    # file on disk are skipped either way
+    parser.add_argument('--start', type=int, default=0, help='Index of the first part to prepare')
+    parser.add_argument('--end', type=int, default=None, help='Index after the last part to prepare')
+    args = parser.parse_args()
+
     set_system_env_defaults()
-    key_cache = []
     ytp = YouTubePublisher(local_lang="Tamil")
-    # get only first level folders under path ta-IN/mahabharat/ - don't get subfolders or files under first level
-    # ensure listing supports getting from specific file
-    blobs = ytp.bucket.list_blobs(prefix='ta-IN/mahabharat/', delimiter='///')
-    for blob in blobs:
-        if blob.name.endswith('.mp4'):
-            key_cache.append(blob.name)
-
-            os.listd
-
-    key_cache.sort(key=lambda x: (x.rsplit('-', 1)[0], int(x.rsplit('-', 1)[1].rsplit('/', 1)[0])))
+    # the catalog keeps part keys with their part numbers, in part order, synced with a single listing
+    ytp.catalog.sync('ta-IN/mahabharat/')
+    keys = ytp.catalog.keys('ta-IN', 'mahabharat', 'staging_video.mp4')
 
-    for key in key_cache[start_offset:]:
-        # remove last part of key
-        # key = '/'.join(key.split('/')[:-1])
-        ytp.publish(key='/'.join(key.split('/')[:-1]),
-                    tags=['#tamil', '#spirituality', '#santana', '#mahabharat', '#history', '#accuracy', '#mythology',
-                          '#indianhistoryandculture'])
+    # parts are prepared concurrently and parts with a details file from an earlier run are skipped
+    results = ytp.publish_many(keys, start=args.start, end=args.end,
+                               tags=['#tamil', '#spirituality', '#santana', '#mahabharat', '#history', '#accuracy',
+                                     '#mythology', '#indianhistoryandculture'])
+    failed = [key for key, result in results.items() if isinstance(result, Exception)]
+    print(f"Prepared {len(results) - len(failed)} of {len(results)} parts")
+    for key in failed:
+        print(f"Error preparing {key}: {results[key]}")
 
 # # for each key download the mp4 file into local folder downloads/channel
 # for key in key_cache:
@@ -0,0 +1,153 @@
+"""
+Hedged requests for model calls whose latency has a long tail.
+
+A call that has not returned once it has taken longer than the rolling p95 of
+recent calls is sent a second time, and whichever copy answers first is used.
+Hedges are capped at a share of all calls and only sent when the API's rate
+limit has budget to spare right away, so they trim the slowest calls without
+adding more than a few percent of requests. Hedging is opt in with
+$HEDGE_REQUESTS=1; otherwise a call runs on the caller's thread as before.
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Optional
+
+from .metrics import metrics
+
+DEFAULT_QUANTILE = 0.95
+DEFAULT_BUDGET_PERCENT = 5
+DEFAULT_MIN_SAMPLES = 20
+DEFAULT_WINDOW = 200
+DEFAULT_WORKERS = 32
+
+_policies: Dict[str, 'HedgePolicy'] = {}
+_policies_lock = threading.Lock()
+
+
+class LatencyWindow:
+    """
+    The latest ``size`` latencies, for a quantile estimate that follows the API's current behaviour.
+
+    Args:
+        size: Number of latencies kept
+    """
+
+    def __init__(self, size: int = DEFAULT_WINDOW):
+        self._latencies = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._latencies)
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+
+class HedgePolicy:
+    """
+    Runs calls to one API, duplicating those that are slower than the rolling latency quantile.
+
+    Args:
+        name: API name used in metrics
+        enabled: Whether calls are hedged at all, defaults to $HEDGE_REQUESTS == '1'
+        quantile: Latency quantile after which a call is hedged, defaults to $HEDGE_QUANTILE
+        budget: Largest share of calls that may be hedged, defaults to $HEDGE_BUDGET_PERCENT percent
+        min_samples: Latencies observed before any call is hedged, defaults to $HEDGE_MIN_SAMPLES
+        window: Number of recent latencies the quantile is estimated from
+        max_workers: Threads running the calls and their hedges
+    """
+
+    def __init__(self, name: str, enabled: Optional[bool] = None, quantile: Optional[float] = None,
+                 budget: Optional[float] = None, min_samples: Optional[int] = None, window: int = DEFAULT_WINDOW,
+                 max_workers: int = DEFAULT_WORKERS):
+        self.name = name
+        self.enabled = os.getenv("HEDGE_REQUESTS", "0") == "1" if enabled is None else enabled
+        self.quantile = quantile or float(os.getenv("HEDGE_QUANTILE", DEFAULT_QUANTILE))
+        self.budget = budget if budget is not None \
+            else float(os.getenv("HEDGE_BUDGET_PERCENT", DEFAULT_BUDGET_PERCENT)) / 100
+        self.min_samples = min_samples if min_samples is not None \
+            else int(os.getenv("HEDGE_MIN_SAMPLES", DEFAULT_MIN_SAMPLES))
+        self.latencies = LatencyWindow(window)
+        self.calls = 0
+        self.hedged = 0
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f'hedge-{name}')
+
+    def threshold(self) -> Optional[float]:
+        """Seconds after which a call is hedged, None until enough latencies have been observed."""
+        if len(self.latencies) < self.min_samples:
+            return None
+        return self.latencies.quantile(self.quantile)
+
+    def call(self, fn: Callable[[], object], limiter=None, tokens: int = 0):
+        """
+        Result of ``fn()``, from a second call of it if the first is slower than the threshold.
+
+        Args:
+            fn: The request, it may be made twice so it must not have side effects
+            limiter: RateLimiter the hedge must find budget in, the caller has already paid for the first call
+            tokens: Tokens a hedge reserves from ``limiter``
+        """
+        if not self.enabled:
+            return fn()
+        with self._lock:
+            self.calls += 1
+        threshold = self.threshold()
+        primary = self._submit(fn)
+        if threshold is None or wait([primary], timeout=threshold).done:
+            return primary.result()
+        if not self._may_hedge(limiter, tokens):
+            return primary.result()
+        hedge = self._submit(fn)
+        if limiter is not None:
+            hedge.add_done_callback(lambda f: limiter.settle(tokens, f.result()) if not f.exception() else None)
+        return self._first(primary, hedge)
+
+    def _submit(self, fn) -> Future:
+        started = time.monotonic()
+        future = self._pool.submit(fn)
+        # every copy's latency counts, a lost hedge still tells how slow the API is
+        future.add_done_callback(lambda f: self.latencies.observe(time.monotonic() - started)
+                                 if not f.exception() else None)
+        return future
+
+    def _may_hedge(self, limiter, tokens: int) -> bool:
+        with self._lock:
+            if self.hedged + 1 > self.budget * self.calls:
+                return False
+            # a hedge never waits for budget, by then the first call is likely to be back
+            if limiter is not None and not limiter.try_acquire(tokens):
+                return False
+            self.hedged += 1
+        return True
+
+    def _first(self, primary: Future, hedge: Future):
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in sorted(done, key=lambda f: f is not primary):
+                if not future.exception():
+                    metrics.inc('hedges_total', api=self.name, outcome='won' if future is hedge else 'lost')
+                    return future.result()
+        metrics.inc('hedges_total', api=self.name, outcome='failed')
+        raise primary.exception()
+
+
+def get_hedge_policy(name: str) -> HedgePolicy:
+    """Process-wide HedgePolicy for an API, configured from the environment on first use."""
+    with _policies_lock:
+        if name not in _policies:
+            _policies[name] = HedgePolicy(name)
+        return _policies[name]
@@ -1,25 +1,38 @@
-import os
-import time
-
 from publisher import Publisher
+from publisher.farm import RenderFarm
 from config import set_system_env_defaults
+from utils.adaptive import CircuitOpen, is_throttled
+from utils.metrics import metrics
 
 if __name__ == '__main__':
     set_system_env_defaults()
-    key_cache = set()
     p = Publisher()
-    # get only first level folders under path ta-IN/mahabharat/ - don't get subfolders or files under first level
-    blobs = p.bucket.list_blobs(prefix='hi-IN/mahabharat/', delimiter='///')
-    for blob in blobs:
-        key_cache.add('/'.join(blob.name.split('/')[0:3]))
-
-    for key in key_cache:
-        try:
-            p.process_video(key=key)
-        except Exception as e:
-            print(f"Error processing {key}: {e}")
+    # one listing brings the local catalog up to date, parts that have audio but no video yet are left to do
+    counts = p.catalog.sync('hi-IN/mahabharat/')
+    print(f"Catalog synced: {counts}")
+    pending = p.catalog.pending('hi-IN', 'mahabharat', 'staging_video.mp4', requires=['audio.wav'])
+    print(f"{len(pending)} videos left to render")
 
-        # sleep for 1 seconds to avoid rate limit
-        time.sleep(5)
+    # rendered on $RENDER_WORKERS processes (default one per core), each part in its own workspace, with the
+    # covers of the parts queued next generated here in the meantime
+    farm = RenderFarm(prefetch=p.prefetch_cover)
+    failed = 0
+    throttled = []
+    for key, error in farm.run(pending):
+        if error is not None and (is_throttled(error) or isinstance(error, CircuitOpen)):
+            # still throttled after retrying until the deadline, tried once more once the rest are done
+            throttled.append(key)
+        elif error is not None:
+            failed += 1
+            print(f"Error processing {key}: {error}")
+    if throttled:
+        print(f"Retrying {len(throttled)} throttled videos")
+        for key, error in farm.run(throttled):
+            if error is not None:
+                failed += 1
+                print(f"Error processing {key}: {error}")
 
-    print("All videos processed successfully!")
+    print("All videos processed successfully!" if not failed else f"{failed} videos failed")
+    # the workers' render timings are merged into this process's metrics as each part finishes
+    exported = metrics.export()
+    print(f"Metrics written to {exported['textfile']} and {exported['summary']}")
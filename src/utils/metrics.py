@@ -0,0 +1,288 @@
+"""
+Process-wide metrics for the pipeline stages, transfers and model calls.
+
+Stages are timed into latency histograms and counted by outcome, alongside
+counters for bytes moved, model tokens and retries and gauges for queue
+depths. The registry can be written as a Prometheus textfile (for the node
+exporter's textfile collector) and as a JSON summary of a run, with latency
+percentiles estimated from the histogram buckets, to show which stage limits
+throughput.
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import ContextDecorator
+from typing import Dict, Optional, Sequence, Tuple
+
+from .temp_utils import get_temp_dir
+
+PREFIX = 'itihasa_'
+
+# Seconds, from a cached lookup to a long-audio synthesis
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+# name: (type, help), metrics are created on first use
+METRICS = {
+    'stage_seconds': ('histogram', 'Time spent in a pipeline stage'),
+    'stage_total': ('counter', 'Pipeline stage runs by outcome'),
+    'transfer_bytes_total': ('counter', 'Bytes moved to or from the bucket'),
+    'model_tokens_total': ('counter', 'Model tokens by direction'),
+    'retries_total': ('counter', 'Requests repeated or split after an incomplete answer'),
+    'queue_depth': ('gauge', 'Items waiting in front of a stage'),
+    'queue_depth_max': ('gauge', 'Most items seen waiting in front of a stage'),
+    'rate_limit_wait_seconds': ('histogram', 'Time spent waiting for rate limit budget'),
+    'source_files_total': ('counter', 'Source files queued for processing'),
+    'hedges_total': ('counter', 'Duplicate requests sent for slow calls by which copy answered first'),
+    'throttled_total': ('counter', 'Calls answered with a quota or overload error'),
+    'concurrency_limit': ('gauge', 'Calls an API currently allows in flight'),
+    'circuit_opens_total': ('counter', 'Times calls to an API were paused after repeated throttling'),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format(labels: Labels, extra: Labels = ()) -> str:
+    pairs = labels + extra
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}' if pairs else ''
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count per label set."""
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.series: Dict[Labels, list] = {}
+
+    def observe(self, labels: Labels, value: float):
+        counts, total, count = self.series.get(labels) or ([0] * len(self.buckets), 0.0, 0)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        self.series[labels] = [counts, total + value, count + 1]
+
+    def quantile(self, labels: Labels, q: float) -> Optional[float]:
+        """Estimate of quantile ``q`` by linear interpolation inside the bucket it falls in."""
+        counts, _, count = self.series[labels]
+        if not count:
+            return None
+        rank = q * count
+        lower, below = 0.0, 0
+        for bound, cumulative in zip(self.buckets, counts):
+            if cumulative >= rank:
+                inside = cumulative - below
+                return lower + (bound - lower) * ((rank - below) / inside if inside else 1.0)
+            lower, below = bound, cumulative
+        # above the last bucket, the largest bound is the best estimate available
+        return self.buckets[-1]
+
+
+class MetricsRegistry:
+    """
+    Counters, gauges and histograms keyed by name and labels.
+
+    Args:
+        prefix: Prepended to every metric name on export
+    """
+
+    def __init__(self, prefix: str = PREFIX):
+        self.prefix = prefix
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._values: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Histogram] = {}
+
+    @staticmethod
+    def _check(name: str):
+        if name not in METRICS:
+            raise ValueError(f"Unknown metric: {name}")
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        self._check(name)
+        key = _labels(labels)
+        with self._lock:
+            series = self._values.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def set(self, name: str, value: float, **labels):
+        self._check(name)
+        with self._lock:
+            self._values.setdefault(name, {})[_labels(labels)] = value
+
+    def set_max(self, name: str, value: float, **labels):
+        self._check(name)
+        key = _labels(labels)
+        with self._lock:
+            series = self._values.setdefault(name, {})
+            series[key] = max(series.get(key, value), value)
+
+    def observe(self, name: str, value: float, **labels):
+        self._check(name)
+        with self._lock:
+            histogram = self._histograms.setdefault(name, Histogram())
+            histogram.observe(_labels(labels), value)
+
+    def timed(self, stage: str, **labels) -> 'Timer':
+        """Context manager and decorator recording a stage's latency and outcome."""
+        return Timer(self, stage, labels)
+
+    def value(self, name: str, **labels) -> float:
+        with self._lock:
+            return self._values.get(name, {}).get(_labels(labels), 0)
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+            self._histograms.clear()
+            self.started = time.time()
+
+    def drain(self) -> dict:
+        """Picklable copy of everything recorded since the last drain, cleared from the registry, see ``merge``."""
+        with self._lock:
+            snapshot = {'values': {name: dict(series) for name, series in self._values.items()},
+                        'histograms': {name: (histogram.buckets, {labels: (list(counts), total, count)
+                                                                   for labels, (counts, total, count)
+                                                                   in histogram.series.items()})
+                                       for name, histogram in self._histograms.items()}}
+            self._values.clear()
+            self._histograms.clear()
+        return snapshot
+
+    def merge(self, snapshot: dict):
+        """
+        Add what another process drained, so work done in worker processes is exported with the run.
+
+        Counters and histograms are summed, ``*_max`` gauges keep the larger value and other gauges take the
+        merged value.
+        """
+        with self._lock:
+            for name, series in snapshot['values'].items():
+                kind = METRICS[name][0]
+                values = self._values.setdefault(name, {})
+                for labels, value in series.items():
+                    if kind == 'counter':
+                        values[labels] = values.get(labels, 0) + value
+                    elif name.endswith('_max'):
+                        values[labels] = max(values.get(labels, value), value)
+                    else:
+                        values[labels] = value
+            for name, (buckets, series) in snapshot['histograms'].items():
+                histogram = self._histograms.setdefault(name, Histogram(buckets))
+                for labels, (counts, total, count) in series.items():
+                    mine, my_total, my_count = histogram.series.get(labels) or ([0] * len(buckets), 0.0, 0)
+                    histogram.series[labels] = [[a + b for a, b in zip(mine, counts)], my_total + total,
+                                                my_count + count]
+
+    def prometheus(self) -> str:
+        """Registry in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name in sorted(set(self._values) | set(self._histograms)):
+                kind, help_text = METRICS[name]
+                metric = self.prefix + name
+                lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} {kind}']
+                if kind == 'histogram':
+                    histogram = self._histograms[name]
+                    for labels, (counts, total, count) in sorted(histogram.series.items()):
+                        for bound, cumulative in zip(histogram.buckets, counts):
+                            lines.append(f'{metric}_bucket{_format(labels, (("le", repr(float(bound))),))} '
+                                         f'{cumulative}')
+                        lines.append(f'{metric}_bucket{_format(labels, (("le", "+Inf"),))} {count}')
+                        lines.append(f'{metric}_sum{_format(labels)} {total}')
+                        lines.append(f'{metric}_count{_format(labels)} {count}')
+                else:
+                    for labels, value in sorted(self._values[name].items()):
+                        lines.append(f'{metric}{_format(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> dict:
+        """Per-stage latency percentiles and totals, with every counter and gauge by label set."""
+        with self._lock:
+            elapsed = time.time() - self.started
+            stages = {}
+            histogram = self._histograms.get('stage_seconds')
+            for labels, (_, total, count) in sorted(histogram.series.items()) if histogram else []:
+                stages[','.join(f'{key}={value}' for key, value in labels)] = {
+                    'count': count,
+                    'total_seconds': round(total, 3),
+                    'mean_seconds': round(total / count, 3),
+                    'p50_seconds': round(histogram.quantile(labels, 0.5), 3),
+                    'p95_seconds': round(histogram.quantile(labels, 0.95), 3),
+                    # share of the run spent in the stage, summed over concurrent workers
+                    'busy_ratio': round(total / elapsed, 3) if elapsed > 0 else None,
+                }
+            waits = {}
+            histogram = self._histograms.get('rate_limit_wait_seconds')
+            for labels, (_, total, count) in sorted(histogram.series.items()) if histogram else []:
+                waits[','.join(value for _, value in labels)] = {'count': count, 'total_seconds': round(total, 3)}
+            values = {name: {','.join(f'{key}={value}' for key, value in labels): value
+                             for labels, value in sorted(series.items())}
+                      for name, series in sorted(self._values.items())}
+        return {'elapsed_seconds': round(elapsed, 3), 'stages': stages, 'rate_limit_waits': waits,
+                'metrics': values}
+
+    def export(self, run_id: Optional[str] = None, textfile: Optional[str] = None,
+               summary_dir: Optional[str] = None) -> Dict[str, str]:
+        """
+        Write the Prometheus textfile and the JSON summary of a run, returning their paths.
+
+        Args:
+            run_id: Names the summary file, the current time by default
+            textfile: Prometheus textfile path, defaults to $METRICS_TEXTFILE or itihasa.prom in the summary directory
+            summary_dir: Directory of the summaries, defaults to $METRICS_DIR or a directory in the itihasa temp
+                directory
+        """
+        summary_dir = summary_dir or os.getenv("METRICS_DIR") or get_temp_dir('metrics')
+        textfile = textfile or os.getenv("METRICS_TEXTFILE", os.path.join(summary_dir, 'itihasa.prom'))
+        summary_path = os.path.join(summary_dir, f'run-{run_id or time.strftime("%Y%m%d-%H%M%S")}.json')
+        _write_atomic(textfile, self.prometheus())
+        _write_atomic(summary_path, json.dumps(self.summary(), indent=2))
+        return {'textfile': textfile, 'summary': summary_path}
+
+
+def _write_atomic(path: str, text: str):
+    # the textfile collector may read at any time, it must never see half a file
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, partial = tempfile.mkstemp(dir=directory, prefix='.partial-')
+    # mkstemp creates the file private to this user, a node_exporter running as another user must read it
+    os.fchmod(fd, 0o644)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(partial, path)
+
+
+class Timer(ContextDecorator):
+    """Observes ``stage_seconds`` and counts ``stage_total`` by outcome for the block or call it wraps."""
+
+    def __init__(self, registry: MetricsRegistry, stage: str, labels: Dict[str, object]):
+        self.registry = registry
+        self.stage = stage
+        self.labels = labels
+        self._started = threading.local()
+
+    def __enter__(self):
+        # a decorated function may run on several threads at once
+        starts = getattr(self._started, 'stack', None)
+        if starts is None:
+            starts = self._started.stack = []
+        starts.append(time.monotonic())
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        elapsed = time.monotonic() - self._started.stack.pop()
+        self.registry.observe('stage_seconds', elapsed, stage=self.stage, **self.labels)
+        self.registry.inc('stage_total', stage=self.stage, outcome='error' if exc_type else 'ok', **self.labels)
+        return False
+
+
+metrics = MetricsRegistry()
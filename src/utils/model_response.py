@@ -0,0 +1,85 @@
+"""
+Parsing of JSON answers returned by the generative model.
+
+Answers are parsed once. When the model stops early (for example at its output
+token limit) the JSON is cut off mid-string; ``loads_partial`` keeps every value
+that was completed before the cut, so the languages that did come back are not
+thrown away with the ones that did not.
+"""
+import json
+from typing import Dict, Iterable, List, Optional
+
+
+def strip_fences(text: str) -> str:
+    """Remove the markdown code fences models wrap JSON in when no response schema is set."""
+    text = text.strip()
+    if text.startswith('```'):
+        text = text.split('\n', 1)[1] if '\n' in text else ''
+        if text.rstrip().endswith('```'):
+            text = text.rstrip()[:-3]
+    return text
+
+
+def loads_partial(text: str):
+    """
+    Load JSON, or the longest prefix of it that ends after a complete string value or container.
+
+    Returns None if not even a prefix can be recovered.
+    """
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    closers: List[str] = []
+    in_string = escape = is_value = after_colon = False
+    cut = None
+    for i, ch in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == '\\':
+                escape = True
+            elif ch == '"':
+                in_string = False
+                if is_value:
+                    cut = (i + 1, ''.join(reversed(closers)))
+                    after_colon = False
+            continue
+        if ch == '"':
+            in_string = True
+            is_value = after_colon or (closers and closers[-1] == ']')
+        elif ch in '{[':
+            closers.append('}' if ch == '{' else ']')
+            after_colon = False
+        elif ch in '}]':
+            if not closers:
+                break
+            closers.pop()
+            cut = (i + 1, ''.join(reversed(closers)))
+        elif ch == ':':
+            after_colon = True
+        elif ch == ',':
+            after_colon = False
+    if cut is None:
+        return None
+    try:
+        return json.loads(text[:cut[0]] + cut[1])
+    except ValueError:
+        return None
+
+
+def parse_answer(text: Optional[str]) -> Optional[dict]:
+    """Return the ``answer`` object of a model response, salvaging what it can from truncated JSON."""
+    if not text:
+        return None
+    data = loads_partial(strip_fences(text))
+    answer = data.get('answer') if isinstance(data, dict) else None
+    return answer if isinstance(answer, dict) else None
+
+
+def completed(answer: Optional[dict], language_codes: Iterable[str]) -> Dict[str, str]:
+    """The translations of ``answer`` that are present and non-empty for the given language codes."""
+    if not answer:
+        return {}
+    return {code: answer[code] for code in language_codes
+            if isinstance(answer.get(code), str) and answer[code].strip()}
@@ -0,0 +1,230 @@
+"""
+Process-wide token-bucket rate limiting for the cloud APIs the pipeline calls.
+
+Every API gets one shared budget (see ``RATE_LIMITS``), so all threads and
+components draw from the same quota instead of sleeping for fixed intervals.
+Limits can be overridden with ``RATE_LIMIT_<API>_<LIMIT>`` environment
+variables, e.g. ``RATE_LIMIT_VERTEX_TOKENS_PER_MINUTE=2000000``.
+"""
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from .adaptive import get_controller
+from .metrics import metrics
+
+RATE_LIMITS = {
+    # Gemini generate_content calls
+    "vertex": {"requests_per_minute": 60, "tokens_per_minute": 1000000},
+    # long-audio synthesis jobs
+    "tts": {"requests_per_minute": 30},
+    # Imagen generate_images calls
+    "imagen": {"requests_per_minute": 20},
+    # bucket object operations
+    "gcs": {"requests_per_minute": 6000},
+}
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count used to reserve budget before the real usage is known."""
+    return len(text) // 4 + 1
+
+
+class TokenBucket:
+    """
+    Refills at ``per_minute / 60`` units a second up to ``burst`` units.
+
+    A request larger than the burst size is let through once the bucket is full
+    and leaves it in debt, so oversized requests are slowed down but never starve.
+
+    Args:
+        per_minute: Sustained budget per minute
+        burst: Bucket capacity, defaults to ten seconds worth of budget
+        clock: Monotonic time source
+        sleep: Function used to wait for the bucket to refill
+    """
+
+    def __init__(self, per_minute: float, burst: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep):
+        if per_minute <= 0:
+            raise ValueError(f"Invalid rate: {per_minute}")
+        self.rate = per_minute / 60.0
+        self.capacity = burst if burst is not None else max(1.0, per_minute / 6.0)
+        self.clock = clock
+        self.sleep = sleep
+        self._level = self.capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self._level = min(self.capacity, self._level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, amount: float = 1) -> float:
+        """Block until ``amount`` units are available and take them; returns the seconds spent waiting."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                needed = min(amount, self.capacity)
+                if self._level >= needed:
+                    self._level -= amount
+                    return waited
+                delay = (needed - self._level) / self.rate
+            self.sleep(delay)
+            waited += delay
+
+    def try_acquire(self, amount: float = 1) -> bool:
+        """Take ``amount`` units if they are available now, without waiting."""
+        with self._lock:
+            self._refill()
+            if self._level < min(amount, self.capacity):
+                return False
+            self._level -= amount
+            return True
+
+    def consume(self, amount: float):
+        """Take (or with a negative amount return) units without waiting; the level may go negative."""
+        with self._lock:
+            self._refill()
+            self._level = min(self.capacity, self._level - amount)
+
+    def level(self) -> float:
+        with self._lock:
+            self._refill()
+            return self._level
+
+
+class RateLimiter:
+    """
+    Request and token budgets for one API.
+
+    Args:
+        name: API name, used in logs
+        requests_per_minute: Maximum calls per minute
+        tokens_per_minute: Optional maximum model tokens per minute
+    """
+
+    def __init__(self, name: str, requests_per_minute: float, tokens_per_minute: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute, clock=clock, sleep=sleep)
+        self.tokens = TokenBucket(tokens_per_minute, clock=clock, sleep=sleep) if tokens_per_minute else None
+
+    def acquire(self, tokens: int = 0) -> float:
+        """Wait for one request and ``tokens`` tokens of budget; returns the seconds spent waiting."""
+        waited = self.requests.acquire(1)
+        if self.tokens is not None and tokens:
+            waited += self.tokens.acquire(tokens)
+        metrics.observe('rate_limit_wait_seconds', waited, api=self.name)
+        return waited
+
+    def try_acquire(self, tokens: int = 0) -> bool:
+        """Take one request and ``tokens`` tokens of budget if both are available now, for optional calls."""
+        if not self.requests.try_acquire(1):
+            return False
+        if self.tokens is not None and tokens and not self.tokens.try_acquire(tokens):
+            self.requests.consume(-1)
+            return False
+        return True
+
+    def settle(self, reserved: int, response) -> int:
+        """
+        Correct a token reservation with the usage reported on a model response.
+
+        Returns the number of tokens the call actually used (``reserved`` if the response has no usage). The
+        reported input and output tokens are counted in the ``model_tokens_total`` metric.
+        """
+        used = reserved
+        usage = getattr(response, 'usage_metadata', None)
+        total = getattr(usage, 'total_token_count', None) if usage is not None else None
+        for direction, field in (('input', 'prompt_token_count'), ('output', 'candidates_token_count')):
+            count = getattr(usage, field, None) if usage is not None else None
+            if isinstance(count, int) and count > 0:
+                metrics.inc('model_tokens_total', count, api=self.name, direction=direction)
+        if isinstance(total, int) and total > 0:
+            used = total
+        if self.tokens is not None and used != reserved:
+            self.tokens.consume(used - reserved)
+        return used
+
+
+_limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def _limit_from_env(name, limit, default):
+    value = os.getenv(f"RATE_LIMIT_{name.upper()}_{limit.upper()}")
+    return float(value) if value else default
+
+
+def get_rate_limiter(name: str) -> RateLimiter:
+    """Return the process-wide limiter for an API listed in ``RATE_LIMITS``."""
+    with _limiters_lock:
+        if name not in _limiters:
+            if name not in RATE_LIMITS:
+                raise ValueError(f"Unknown rate limited API: {name}")
+            limits = {limit: _limit_from_env(name, limit, default) for limit, default in RATE_LIMITS[name].items()}
+            _limiters[name] = RateLimiter(name, **limits)
+        return _limiters[name]
+
+
+class RateLimitedBucket:
+    """
+    Wraps a storage bucket so every object operation draws from the shared ``gcs`` budget.
+
+    Operations also run under the ``gcs`` AdaptiveController, so throttled ones are retried, except those
+    reading from or writing to a caller's stream, which cannot be repeated. Anything not listed as a call is
+    passed straight through to the wrapped bucket.
+    """
+
+    BLOB_CALLS = {'exists', 'reload', 'delete', 'download_to_filename', 'download_to_file', 'download_as_bytes',
+                  'download_as_text', 'upload_from_filename', 'upload_from_file', 'upload_from_string', 'compose',
+                  'open'}
+    STREAM_CALLS = {'download_to_file', 'upload_from_file', 'open'}
+
+    def __init__(self, bucket, limiter: Optional[RateLimiter] = None, controller=None):
+        self._bucket = bucket
+        self._limiter = limiter or get_rate_limiter('gcs')
+        self._controller = controller or get_controller('gcs')
+
+    def blob(self, *args, **kwargs):
+        return _RateLimitedBlob(self._bucket.blob(*args, **kwargs), self._limiter, self._controller)
+
+    def list_blobs(self, *args, **kwargs):
+        def call():
+            self._limiter.acquire()
+            return self._bucket.list_blobs(*args, **kwargs)
+
+        return self._controller.call(call)
+
+    def __getattr__(self, item):
+        return getattr(self._bucket, item)
+
+
+class _RateLimitedBlob:
+
+    def __init__(self, blob, limiter, controller):
+        object.__setattr__(self, '_blob', blob)
+        object.__setattr__(self, '_limiter', limiter)
+        object.__setattr__(self, '_controller', controller)
+
+    def __setattr__(self, key, value):
+        # metadata such as content_type is set on the wrapped blob
+        setattr(self._blob, key, value)
+
+    def __getattr__(self, item):
+        attr = getattr(self._blob, item)
+        if item not in RateLimitedBucket.BLOB_CALLS:
+            return attr
+
+        def call(*args, **kwargs):
+            def attempt():
+                self._limiter.acquire()
+                return attr(*args, **kwargs)
+
+            return self._controller.call(attempt, retry=item not in RateLimitedBucket.STREAM_CALLS)
+
+        return call
@@ -31,6 +31,26 @@ def get_temp_dir(subdir: Optional[str] = None) -> str:
     return temp_dir
 
 
+def get_state_dir(subdir: Optional[str] = None) -> str:
+    """
+    Get a directory for state that must survive the temp directory being cleaned.
+
+    Args:
+        subdir: Optional subdirectory to create within the state directory
+
+    Returns:
+        str: Path to $ITIHASA_STATE_DIR, by default ~/.itihasa
+    """
+    state_dir = os.getenv("ITIHASA_STATE_DIR") or os.path.join(os.path.expanduser('~'), '.itihasa')
+
+    if subdir:
+        state_dir = os.path.join(state_dir, subdir)
+
+    os.makedirs(state_dir, exist_ok=True, mode=0o700)
+
+    return state_dir
+
+
 @contextmanager
 def temp_directory(prefix: str = 'itihasa_', cleanup: bool = True) -> ContextManager[str]:
     """
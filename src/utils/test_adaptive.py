@@ -0,0 +1,173 @@
+import os
+import sys
+import threading
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from google.api_core import exceptions
+
+from utils import adaptive
+from utils.adaptive import AdaptiveController, AdaptiveLimit, CircuitBreaker, CircuitOpen, get_controller, \
+    is_throttled
+from utils.metrics import metrics
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestAdaptiveLimit(unittest.TestCase):
+
+    def test_additive_increase_multiplicative_decrease(self):
+        limit = AdaptiveLimit(4, maximum=8)
+        for _ in range(4):
+            limit.release(limit.acquire())
+        # one more call in flight per limit's worth of successes
+        self.assertAlmostEqual(limit.limit, 5, delta=0.1)
+        limit.release(limit.acquire(), throttled=True)
+        self.assertAlmostEqual(limit.limit, 2.5, delta=0.1)
+
+    def test_burst_of_throttled_calls_decreases_once(self):
+        limit = AdaptiveLimit(8)
+        tickets = [limit.acquire() for _ in range(4)]
+        for ticket in tickets:
+            limit.release(ticket, throttled=True)
+        self.assertEqual(limit.limit, 4)
+        self.assertEqual(limit.in_flight, 0)
+
+    def test_calls_wait_for_a_free_slot(self):
+        limit = AdaptiveLimit(1)
+        ticket = limit.acquire()
+        entered = threading.Event()
+
+        def second():
+            limit.release(limit.acquire())
+            entered.set()
+        thread = threading.Thread(target=second)
+        thread.start()
+        self.assertFalse(entered.wait(0.1))
+        limit.release(ticket)
+        self.assertTrue(entered.wait(5))
+        thread.join()
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def test_opens_after_failures_and_probes_after_reset(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker(failures=2, reset_after=10, clock=clock)
+        self.assertFalse(breaker.failure())
+        self.assertTrue(breaker.failure())
+        self.assertFalse(breaker.allow())
+        self.assertEqual(breaker.retry_after(), 10)
+        clock.now = 10
+        self.assertTrue(breaker.allow())
+        # only the probe goes out until it answers
+        self.assertFalse(breaker.allow())
+        self.assertTrue(breaker.failure())
+        clock.now = 20
+        self.assertTrue(breaker.allow())
+        breaker.success()
+        self.assertEqual(breaker.state, 'closed')
+
+
+class TestAdaptiveController(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.clock = FakeClock()
+
+    def _controller(self, deadline=60, failures=5):
+        return AdaptiveController('test', 4, deadline=deadline,
+                                  breaker=CircuitBreaker(failures=failures, reset_after=30, clock=self.clock),
+                                  clock=self.clock, sleep=self.clock.sleep, jitter=lambda: 1.0)
+
+    def _flaky(self, errors):
+        errors = list(errors)
+
+        def call():
+            if errors:
+                raise errors.pop(0)
+            return 'ok'
+        return call
+
+    def test_throttled_calls_are_retried_with_backoff(self):
+        controller = self._controller()
+        call = self._flaky([exceptions.TooManyRequests('quota'), exceptions.ServiceUnavailable('down')])
+        self.assertEqual(controller.call(call), 'ok')
+        self.assertEqual(self.clock.now, 1 + 2)
+        self.assertEqual(metrics.value('throttled_total', api='test'), 2)
+        self.assertEqual(metrics.value('retries_total', reason='throttled'), 2)
+        self.assertLess(controller.limit.limit, 4)
+
+    def test_other_errors_are_raised_at_once(self):
+        controller = self._controller()
+        with self.assertRaises(exceptions.BadRequest):
+            controller.call(self._flaky([exceptions.BadRequest('bad')]))
+        self.assertEqual(self.clock.now, 0)
+
+    def test_other_errors_leave_the_limit_alone(self):
+        controller = self._controller()
+        for error in (exceptions.BadRequest('bad'), exceptions.InternalServerError('boom')):
+            with self.assertRaises(type(error)):
+                controller.call(self._flaky([error]))
+        self.assertEqual(controller.limit.limit, 4)
+        self.assertEqual(controller.limit.in_flight, 0)
+        controller.call(self._flaky([]))
+        self.assertGreater(controller.limit.limit, 4)
+
+    def test_gives_up_at_the_deadline(self):
+        controller = self._controller(deadline=5, failures=100)
+        with self.assertRaises(exceptions.TooManyRequests):
+            controller.call(self._flaky([exceptions.TooManyRequests('quota')] * 10))
+        self.assertLessEqual(self.clock.now, 5)
+
+    def test_streams_are_not_retried(self):
+        controller = self._controller()
+        with self.assertRaises(exceptions.TooManyRequests):
+            controller.call(self._flaky([exceptions.TooManyRequests('quota')]), retry=False)
+
+    def test_open_circuit_fails_fast_past_the_deadline(self):
+        controller = self._controller(deadline=10, failures=2)
+        for _ in range(2):
+            with self.assertRaises(exceptions.TooManyRequests):
+                controller.call(self._flaky([exceptions.TooManyRequests('quota')]), retry=False)
+        with self.assertRaises(CircuitOpen):
+            controller.call(lambda: 'ok')
+        self.assertEqual(metrics.value('circuit_opens_total', api='test'), 1)
+
+    def test_open_circuit_is_waited_out_within_the_deadline(self):
+        controller = self._controller(deadline=60, failures=1)
+        call = self._flaky([exceptions.TooManyRequests('quota')])
+        self.assertEqual(controller.call(call), 'ok')
+        # the retry waited for the circuit to let a probe through
+        self.assertEqual(self.clock.now, 30)
+        self.assertEqual(controller.breaker.state, 'closed')
+
+    def test_is_throttled(self):
+        self.assertTrue(is_throttled(exceptions.ResourceExhausted('quota')))
+        self.assertFalse(is_throttled(exceptions.NotFound('missing')))
+        self.assertFalse(is_throttled(ValueError('bad')))
+
+    def test_registry_is_shared_and_reads_env(self):
+        with patch.dict(adaptive._controllers, clear=True), \
+                patch.dict('os.environ', {'ADAPTIVE_TTS_MAXIMUM': '6', 'RETRY_DEADLINE_SECONDS': '12'}):
+            controller = get_controller('tts')
+            self.assertIs(controller, get_controller('tts'))
+            self.assertEqual(controller.limit.maximum, 6)
+            self.assertEqual(controller.deadline, 12)
+            with self.assertRaises(ValueError):
+                get_controller('unknown')
+
+
+if __name__ == '__main__':
+    unittest.main()
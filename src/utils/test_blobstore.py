@@ -0,0 +1,149 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.blobstore import BlobCache, CachedBucket, LocalBucket, MemoryBucket, NotFound, get_bucket
+from utils.transfer import TransferManager
+
+
+class CountingBucket:
+    """Remote stand-in that counts the requests reaching it."""
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self.calls = []
+
+    def blob(self, name):
+        return CountingBlob(self, self.bucket.blob(name))
+
+
+class CountingBlob:
+
+    def __init__(self, remote, blob):
+        self.remote = remote
+        self.blob = blob
+        self.name = blob.name
+
+    def __getattr__(self, item):
+        attr = getattr(self.blob, item)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            self.remote.calls.append((item, self.name))
+            return attr(*args, **kwargs)
+
+        return call
+
+
+class TestLocalBuckets(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_local_round_trip_through_parallel_transfers(self):
+        bucket = LocalBucket(os.path.join(self.tmp.name, 'bucket'))
+        transfer = TransferManager(bucket, chunk_size=256 * 1024, max_workers=4)
+        data = os.urandom(256 * 1024 * 3 + 17)
+        source = os.path.join(self.tmp.name, 'source.bin')
+        with open(source, 'wb') as f:
+            f.write(data)
+        transfer.upload(source, 'ta-IN/m/T-part-1/audio.wav')
+        target = os.path.join(self.tmp.name, 'target.bin')
+        transfer.download('ta-IN/m/T-part-1/audio.wav', target)
+        with open(target, 'rb') as f:
+            self.assertEqual(f.read(), data)
+        self.assertEqual([blob.name for blob in bucket.list_blobs(prefix='ta-IN/')], ['ta-IN/m/T-part-1/audio.wav'])
+        transfer.write_text('ta-IN/m/T-part-1/subtitles.txt', 'வணக்கம்')
+        self.assertEqual(transfer.read_text('ta-IN/m/T-part-1/subtitles.txt'), 'வணக்கம்')
+
+    def test_abandoned_stream_leaves_no_object(self):
+        for bucket in (LocalBucket(os.path.join(self.tmp.name, 'bucket')), MemoryBucket()):
+            transfer = TransferManager(bucket)
+            with self.assertRaises(RuntimeError):
+                with transfer.open_upload('video.mp4') as stream:
+                    stream.write(b'partial')
+                    raise RuntimeError('render failed')
+            self.assertFalse(bucket.blob('video.mp4').exists())
+            self.assertEqual(list(bucket.list_blobs()), [])
+            with transfer.open_upload('video.mp4') as stream:
+                stream.write(b'whole')
+            self.assertEqual(bucket.blob('video.mp4').download_as_bytes(), b'whole')
+
+    def test_memory_buckets_are_shared_by_name(self):
+        first = get_bucket('shared', backend='memory')
+        first.blob('a/b').upload_from_string('text')
+        self.assertEqual(get_bucket('shared', backend='memory').blob('a/b').download_as_text(), 'text')
+        with self.assertRaises(NotFound):
+            first.blob('missing').download_as_bytes()
+
+    def test_backend_from_environment(self):
+        with patch.dict('os.environ', {'STORAGE_BACKEND': 'local', 'STORAGE_ROOT': self.tmp.name,
+                                       'GCS_BUCKET': 'gs://itihasa'}):
+            bucket = get_bucket()
+        self.assertIsInstance(bucket, LocalBucket)
+        self.assertEqual(bucket.root, os.path.join(self.tmp.name, 'itihasa'))
+
+
+class TestCachedBucket(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.remote = CountingBucket(MemoryBucket())
+        self.cache = BlobCache(os.path.join(self.tmp.name, 'cache'), max_bytes=100, max_object_bytes=40)
+        self.bucket = CachedBucket(self.remote, cache=self.cache)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_repeated_reads_skip_the_remote(self):
+        self.remote.bucket.put('k/subtitles.txt', b'subtitles')
+        transfer = TransferManager(self.bucket)
+        self.assertEqual(transfer.read_text('k/subtitles.txt'), 'subtitles')
+        self.assertEqual(transfer.read_text('k/subtitles.txt'), 'subtitles')
+        path = os.path.join(self.tmp.name, 'copy.txt')
+        transfer.download('k/subtitles.txt', path)
+        self.assertTrue(self.bucket.blob('k/subtitles.txt').exists())
+        self.assertEqual(self.remote.calls, [('download_as_bytes', 'k/subtitles.txt')])
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 1))
+
+    def test_writes_update_the_cached_copy(self):
+        self.bucket.blob('k/summary.txt').upload_from_string('first')
+        self.bucket.blob('k/summary.txt').upload_from_string('second')
+        self.assertEqual(self.bucket.blob('k/summary.txt').download_as_text(), 'second')
+        self.bucket.blob('k/summary.txt').delete()
+        self.assertFalse(self.bucket.blob('k/summary.txt').exists())
+
+    def test_large_objects_are_not_cached(self):
+        self.remote.bucket.put('k/video.mp4', b'v' * 50)
+        path = os.path.join(self.tmp.name, 'video.mp4')
+        self.bucket.blob('k/video.mp4').download_to_filename(path)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'v' * 50)
+        self.assertIsNone(self.cache.size('k/video.mp4'))
+        self.assertEqual(os.listdir(self.cache.directory), [])
+
+    def test_least_recently_used_entries_are_evicted(self):
+        for name in ('a', 'b', 'c'):
+            self.remote.bucket.put(name, name.encode() * 40)
+        self.bucket.blob('a').download_as_bytes()
+        self.bucket.blob('b').download_as_bytes()
+        self.bucket.blob('a').download_as_bytes()
+        self.bucket.blob('c').download_as_bytes()
+        self.assertIsNotNone(self.cache.size('a'))
+        self.assertIsNone(self.cache.size('b'))
+        self.assertEqual(len(os.listdir(self.cache.directory)), 2)
+        # a new process picks up the entries already on disk
+        reopened = BlobCache(self.cache.directory, max_bytes=100, max_object_bytes=40)
+        self.assertEqual(reopened.size('c'), 40)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmark.fakes import FakeGenerativeModel, FakeImageModel, FakeLongAudioClient
+from utils import cassette, clients
+from utils.blobstore import MemoryBucket
+from utils.cassette import Cassette, CassetteImageModel, CassetteMiss, CassetteModel, CassetteSpeechClient
+
+COVER = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'default_cover.png'))
+
+
+def _synthesis(text):
+    return SimpleNamespace(input=SimpleNamespace(text=text), output_gcs_uri='gs://test/k/audio.wav')
+
+
+def _wait(operation):
+    deadline = time.monotonic() + 5
+    while not operation.done() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+class TestCassette(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cassette = Cassette(self.tmp.name)
+        self.slept = []
+
+    def tearDown(self):
+        self.cassette.close()
+        self.tmp.cleanup()
+
+    def _replayer(self, cls, *args, **kwargs):
+        # a fresh cassette on the same directory, as in a later run, whose client must never be built
+        def unavailable():
+            raise AssertionError('replay called the real client')
+
+        return cls(unavailable, *args, Cassette(self.tmp.name), 'replay', **kwargs)
+
+    def test_model_calls_replay_in_recorded_order(self):
+        fake = FakeGenerativeModel(latency=0.25, sleep=lambda seconds: None)
+        recorder = CassetteModel(lambda: fake, 'gemini', self.cassette, 'record')
+        first = recorder.generate_content('<TEXT>\none\n</TEXT>')
+        fake.output_ratio = 2.0
+        second = recorder.generate_content('<TEXT>\none\n</TEXT>')
+
+        player = self._replayer(CassetteModel, 'gemini', latency_scale=1.0, sleep=self.slept.append)
+        self.assertEqual(player.generate_content('<TEXT>\none\n</TEXT>').text, first.text)
+        replayed = player.generate_content('<TEXT>\none\n</TEXT>')
+        self.assertEqual(replayed.text, second.text)
+        self.assertEqual(replayed.candidates[0].finish_reason.name, 'STOP')
+        self.assertEqual(replayed.usage_metadata.candidates_token_count,
+                         second.usage_metadata.candidates_token_count)
+        # the recorded latency is measured around the call, the fake returned at once
+        self.assertEqual(len(self.slept), 2)
+        with self.assertRaises(CassetteMiss):
+            player.generate_content('<TEXT>\ntwo\n</TEXT>')
+
+    def test_generation_config_is_part_of_the_request(self):
+        recorder = CassetteModel(lambda: FakeGenerativeModel(latency=0, sleep=lambda seconds: None), 'gemini',
+                                 self.cassette, 'record')
+        recorder.generate_content('prompt', generation_config=clients.generation_config(temperature=0.2))
+        player = self._replayer(CassetteModel, 'gemini')
+        with self.assertRaises(CassetteMiss):
+            player.generate_content('prompt', generation_config=clients.generation_config(temperature=0.8))
+
+    def test_images_are_stored_once(self):
+        recorder = CassetteImageModel(lambda: FakeImageModel(COVER, latency=0), 'imagen', self.cassette, 'record')
+        recorder.generate_images(prompt='a river', number_of_images=1)
+        recorder.generate_images(prompt='a forest', number_of_images=1)
+        self.assertEqual(len(os.listdir(self.cassette.blob_dir)), 1)
+        image = self._replayer(CassetteImageModel, 'imagen').generate_images(prompt='a forest').images[0]
+        with open(COVER, 'rb') as f:
+            self.assertEqual(image._image_bytes, f.read())
+        self.assertEqual(image._mime_type, 'image/png')
+
+    def test_synthesized_audio_is_replayed_into_the_bucket(self):
+        recorded_bucket = MemoryBucket('recorded')
+        recorder = CassetteSpeechClient(lambda: FakeLongAudioClient(recorded_bucket, latency=0, speedup=1000),
+                                        lambda name: recorded_bucket, self.cassette, 'record')
+        _wait(recorder.synthesize_long_audio(_synthesis('x' * 30)))
+        audio = recorded_bucket.blob('k/audio.wav').download_as_bytes()
+
+        replay_bucket = MemoryBucket('replayed')
+        player = self._replayer(CassetteSpeechClient, lambda name: replay_bucket)
+        operation = player.synthesize_long_audio(_synthesis('x' * 30))
+        self.assertTrue(operation.done())
+        self.assertIsNone(operation.exception())
+        self.assertEqual(replay_bucket.blob('k/audio.wav').download_as_bytes(), audio)
+
+    def test_auto_mode_records_misses(self):
+        fake = FakeGenerativeModel(latency=0, sleep=lambda seconds: None)
+        auto = CassetteModel(lambda: fake, 'gemini', self.cassette, 'auto')
+        auto.generate_content('prompt')
+        self.assertEqual(fake.calls, 1)
+        self.assertEqual(self._replayer(CassetteModel, 'gemini').generate_content('prompt').text,
+                         '{"summary": "prompt"}')
+
+    def test_clients_are_wrapped_by_mode(self):
+        with patch.dict('os.environ', {'CASSETTE_MODE': 'replay', 'CASSETTE_DIR': self.tmp.name}):
+            try:
+                self.assertIsInstance(clients.tts_client(), CassetteSpeechClient)
+            finally:
+                clients.reset()
+                cassette._cassettes.pop(self.tmp.name).close()
+
+
+if __name__ == '__main__':
+    unittest.main()
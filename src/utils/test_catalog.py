@@ -0,0 +1,92 @@
+import os
+import sys
+import tempfile
+import unittest
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.catalog import ArtifactCatalog, parse_name
+
+
+class FakeBucket:
+
+    def __init__(self):
+        self.objects = {}
+        self.listings = []
+
+    def put(self, name, generation=1, size=10):
+        self.objects[name] = SimpleNamespace(name=name, size=size, md5_hash=f'md5-{generation}', crc32c=None,
+                                             updated=datetime(2024, 1, 1, tzinfo=timezone.utc),
+                                             generation=generation)
+
+    def list_blobs(self, prefix=None, fields=None):
+        self.listings.append((prefix, fields))
+        return [blob for name, blob in sorted(self.objects.items()) if name.startswith(prefix)]
+
+
+class TestArtifactCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.bucket = FakeBucket()
+        self.catalog = ArtifactCatalog(self.bucket, path=os.path.join(self.tmp.name, 'artifacts.db'))
+
+    def tearDown(self):
+        self.catalog.close()
+        self.tmp.cleanup()
+
+    def test_parse_name(self):
+        artifact = parse_name('ta-IN/mahabharat/Mahabharat - Vyasa-part-12/audio.wav')
+        self.assertEqual(artifact.key, 'ta-IN/mahabharat/Mahabharat - Vyasa-part-12')
+        self.assertEqual(artifact.title, 'Mahabharat - Vyasa')
+        self.assertEqual(artifact.part_number, 12)
+        self.assertEqual(artifact.artifact, 'audio.wav')
+        self.assertIsNone(parse_name('ta-IN/mahabharat/audio.wav'))
+
+    def test_sync_is_incremental(self):
+        self.bucket.put('ta-IN/m/T-part-1/audio.wav')
+        self.bucket.put('ta-IN/m/T-part-2/audio.wav')
+        self.assertEqual(self.catalog.sync('ta-IN/m/'), {'added': 2, 'updated': 0, 'removed': 0})
+        self.assertEqual(self.catalog.sync('ta-IN/m/'), {'added': 0, 'updated': 0, 'removed': 0})
+        self.bucket.put('ta-IN/m/T-part-1/audio.wav', generation=2)
+        del self.bucket.objects['ta-IN/m/T-part-2/audio.wav']
+        self.assertEqual(self.catalog.sync('ta-IN/m/'), {'added': 0, 'updated': 1, 'removed': 1})
+        self.assertIn('items(', self.bucket.listings[0][1])
+
+    def test_recent_sync_is_not_listed_again(self):
+        self.catalog.sync('ta-IN/m/')
+        self.catalog.sync('ta-IN/m/', max_age=60)
+        self.assertEqual(len(self.bucket.listings), 1)
+
+    def test_exists_only_answers_for_synced_prefixes(self):
+        self.bucket.put('ta-IN/m/T-part-1/audio.wav')
+        self.assertIsNone(self.catalog.exists('ta-IN/m/T-part-1/audio.wav'))
+        self.catalog.sync('ta-IN/m/')
+        self.assertTrue(self.catalog.exists('ta-IN/m/T-part-1/audio.wav'))
+        self.assertFalse(self.catalog.exists('ta-IN/m/T-part-1/staging_video.mp4'))
+        self.catalog.record('ta-IN/m/T-part-1/staging_video.mp4', 5)
+        self.assertTrue(self.catalog.exists('ta-IN/m/T-part-1/staging_video.mp4'))
+
+    def test_size_of_listed_and_recorded_objects(self):
+        self.bucket.put('ta-IN/m/T-part-1/audio.wav', size=10)
+        self.catalog.sync('ta-IN/m/')
+        self.catalog.record('ta-IN/m/T-part-1/staging_video.mp4')
+        self.assertEqual(self.catalog.size('ta-IN/m/T-part-1/audio.wav'), 10)
+        self.assertIsNone(self.catalog.size('ta-IN/m/T-part-1/staging_video.mp4'))
+        self.assertIsNone(self.catalog.size('ta-IN/m/T-part-2/audio.wav'))
+
+    def test_pending_in_part_order(self):
+        for part in (10, 2, 1):
+            self.bucket.put(f'ta-IN/m/T-part-{part}/audio.wav')
+        self.bucket.put('ta-IN/m/T-part-1/staging_video.mp4')
+        self.bucket.put('ta-IN/m/T-part-3/subtitles.txt')
+        self.catalog.sync('ta-IN/m/')
+        self.assertEqual(self.catalog.pending('ta-IN', 'm', 'staging_video.mp4', requires=['audio.wav']),
+                         ['ta-IN/m/T-part-2', 'ta-IN/m/T-part-10'])
+        self.assertEqual(self.catalog.keys('ta-IN', 'm', 'staging_video.mp4'), ['ta-IN/m/T-part-1'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import os
+import subprocess
+import sys
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils import clients
+
+
+class TestClients(unittest.TestCase):
+
+    def tearDown(self):
+        clients.reset()
+
+    def test_clients_are_built_once_and_shared(self):
+        built = []
+        factory = lambda: built.append(object()) or built[-1]
+        first = clients.get_client(('test',), factory)
+        self.assertIs(clients.get_client(('test',), factory), first)
+        self.assertEqual(len(built), 1)
+        clients.reset()
+        self.assertIsNot(clients.get_client(('test',), factory), first)
+
+    def test_models_share_one_vertex_init(self):
+        with patch('vertexai.init') as init, patch('vertexai.generative_models.GenerativeModel') as model:
+            first = clients.generative_model('gemini-test')
+            self.assertIs(clients.generative_model('gemini-test'), first)
+            clients.generative_model('gemini-other')
+        init.assert_called_once()
+        self.assertEqual(model.call_count, 2)
+
+    def test_importing_the_pipeline_loads_no_cloud_library(self):
+        src = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+        code = ("import sys, worker.orchestrator, publisher.youtube\n"
+                "print(sorted(m for m in ('vertexai', 'google.cloud.storage', 'google.cloud.texttospeech', "
+                "'moviepy', 'PIL') if m in sys.modules))")
+        result = subprocess.run([sys.executable, '-c', code], cwd=src, stdout=subprocess.PIPE, check=True)
+        self.assertEqual(result.stdout.decode().strip(), '[]')
+
+    def test_importing_main_has_no_side_effects(self):
+        src = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+        code = ("import os, main\n"
+                "from utils import clients\n"
+                "print(os.getenv('GCP_PARENT_PROJECT'), clients._clients)")
+        env = {k: v for k, v in os.environ.items() if k != 'GCP_PARENT_PROJECT'}
+        result = subprocess.run([sys.executable, '-c', code], cwd=src, stdout=subprocess.PIPE, env=env, check=True)
+        # the translation cache is opened on first use, like the clients
+        self.assertEqual(result.stdout.decode().strip(), 'None {}')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+import os
+import sys
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.hedging import HedgePolicy, LatencyWindow, get_hedge_policy
+from utils.metrics import metrics
+from utils.rate_limit import RateLimiter
+
+
+class TestLatencyWindow(unittest.TestCase):
+
+    def test_quantile_of_the_latest_latencies(self):
+        window = LatencyWindow(size=10)
+        self.assertIsNone(window.quantile(0.95))
+        for seconds in range(100):
+            window.observe(seconds)
+        self.assertEqual(len(window), 10)
+        self.assertEqual(window.quantile(0.5), 95)
+        self.assertEqual(window.quantile(0.95), 99)
+
+
+class TestHedgePolicy(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+
+    def _policy(self, **kwargs):
+        policy = HedgePolicy('test', enabled=True, min_samples=5, **kwargs)
+        for _ in range(5):
+            policy.latencies.observe(0.05)
+        return policy
+
+    def _slow_once(self, delay=2.0):
+        # the first copy stalls, any later one answers at once
+        calls = []
+        lock = threading.Lock()
+
+        def fn():
+            with lock:
+                calls.append(threading.current_thread().name)
+                first = len(calls) == 1
+            if first:
+                time.sleep(delay)
+                return 'slow'
+            return 'fast'
+        return fn, calls
+
+    def test_disabled_calls_run_inline(self):
+        policy = HedgePolicy('test', enabled=False)
+        self.assertEqual(policy.call(lambda: threading.current_thread().name), threading.current_thread().name)
+
+    def test_slow_call_is_hedged(self):
+        policy = self._policy(budget=1.0)
+        fn, calls = self._slow_once()
+        started = time.monotonic()
+        self.assertEqual(policy.call(fn), 'fast')
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(metrics.value('hedges_total', api='test', outcome='won'), 1)
+
+    def test_no_hedge_before_enough_samples(self):
+        policy = HedgePolicy('test', enabled=True, min_samples=5, budget=1.0)
+        fn, calls = self._slow_once(delay=0.2)
+        self.assertEqual(policy.call(fn), 'slow')
+        self.assertEqual(len(calls), 1)
+
+    def test_budget_caps_hedges(self):
+        policy = self._policy(budget=0.0)
+        fn, calls = self._slow_once(delay=0.2)
+        self.assertEqual(policy.call(fn), 'slow')
+        self.assertEqual(len(calls), 1)
+
+    def test_hedge_needs_rate_limit_budget_now(self):
+        limiter = RateLimiter('test', requests_per_minute=1, sleep=lambda seconds: None)
+        limiter.acquire()
+        policy = self._policy(budget=1.0)
+        fn, calls = self._slow_once(delay=0.2)
+        self.assertEqual(policy.call(fn, limiter=limiter), 'slow')
+        self.assertEqual(len(calls), 1)
+
+    def test_failed_hedge_falls_back_to_primary(self):
+        policy = self._policy(budget=1.0)
+        calls = []
+
+        def fn():
+            calls.append(1)
+            if len(calls) == 1:
+                time.sleep(0.3)
+                return 'primary'
+            raise RuntimeError('hedge failed')
+        self.assertEqual(policy.call(fn), 'primary')
+        self.assertEqual(metrics.value('hedges_total', api='test', outcome='lost'), 1)
+
+    def test_both_failing_raises_primary_error(self):
+        policy = self._policy(budget=1.0)
+        calls = []
+
+        def fn():
+            calls.append(1)
+            if len(calls) == 1:
+                time.sleep(0.3)
+                raise ValueError('primary')
+            raise RuntimeError('hedge')
+        with self.assertRaises(ValueError):
+            policy.call(fn)
+
+    def test_policies_are_shared_and_configured_from_env(self):
+        with patch.dict('os.environ', {'HEDGE_REQUESTS': '1', 'HEDGE_BUDGET_PERCENT': '10'}):
+            policy = get_hedge_policy('test-env')
+        self.assertIs(get_hedge_policy('test-env'), policy)
+        self.assertTrue(policy.enabled)
+        self.assertAlmostEqual(policy.budget, 0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()
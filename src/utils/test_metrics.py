@@ -0,0 +1,94 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.metrics import Histogram, MetricsRegistry
+from utils.rate_limit import RateLimiter
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_timer_records_latency_and_outcome(self):
+        @self.registry.timed('render')
+        def render(fail=False):
+            if fail:
+                raise RuntimeError('ffmpeg failed')
+
+        render()
+        with self.assertRaises(RuntimeError):
+            render(fail=True)
+        self.assertEqual(self.registry.value('stage_total', stage='render', outcome='ok'), 1)
+        self.assertEqual(self.registry.value('stage_total', stage='render', outcome='error'), 1)
+        self.assertEqual(self.registry.summary()['stages']['stage=render']['count'], 2)
+
+    def test_unknown_metrics_are_rejected(self):
+        with self.assertRaises(ValueError):
+            self.registry.inc('renders')
+
+    def test_quantiles_interpolate_within_buckets(self):
+        histogram = Histogram(buckets=(1, 2, 4))
+        for value in (0.5, 1.5, 1.5, 3):
+            histogram.observe((), value)
+        self.assertAlmostEqual(histogram.quantile((), 0.5), 1.5)
+        self.assertEqual(histogram.quantile((), 1.0), 4)
+
+    def test_drained_metrics_merge_into_another_registry(self):
+        worker = MetricsRegistry()
+        worker.inc('transfer_bytes_total', 100, direction='upload')
+        worker.set_max('queue_depth_max', 3, stage='render')
+        worker.observe('stage_seconds', 2.0, stage='render_video')
+        self.registry.inc('transfer_bytes_total', 50, direction='upload')
+        self.registry.set_max('queue_depth_max', 5, stage='render')
+        self.registry.observe('stage_seconds', 1.0, stage='render_video')
+        self.registry.merge(worker.drain())
+        self.assertEqual(worker.value('transfer_bytes_total', direction='upload'), 0)
+        self.assertEqual(self.registry.value('transfer_bytes_total', direction='upload'), 150)
+        self.assertEqual(self.registry.value('queue_depth_max', stage='render'), 5)
+        stage = self.registry.summary()['stages']['stage=render_video']
+        self.assertEqual((stage['count'], stage['total_seconds']), (2, 3.0))
+
+    def test_prometheus_textfile_format(self):
+        self.registry.inc('transfer_bytes_total', 2048, direction='upload')
+        self.registry.observe('stage_seconds', 0.3, stage='translate')
+        text = self.registry.prometheus()
+        self.assertIn('# TYPE itihasa_transfer_bytes_total counter', text)
+        self.assertIn('itihasa_transfer_bytes_total{direction="upload"} 2048', text)
+        self.assertIn('itihasa_stage_seconds_bucket{stage="translate",le="0.25"} 0', text)
+        self.assertIn('itihasa_stage_seconds_bucket{stage="translate",le="0.5"} 1', text)
+        self.assertIn('itihasa_stage_seconds_bucket{stage="translate",le="+Inf"} 1', text)
+        self.assertIn('itihasa_stage_seconds_count{stage="translate"} 1', text)
+
+    def test_export_writes_textfile_and_run_summary(self):
+        self.registry.set_max('queue_depth_max', 3, stage='render')
+        self.registry.set_max('queue_depth_max', 1, stage='render')
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = self.registry.export(run_id='job-1', summary_dir=tmp)
+            self.assertEqual(sorted(os.listdir(tmp)), ['itihasa.prom', 'run-job-1.json'])
+            # readable by a node_exporter running as another user
+            self.assertEqual(os.stat(paths['textfile']).st_mode & 0o777, 0o644)
+            with open(paths['summary']) as f:
+                summary = json.load(f)
+        self.assertEqual(summary['metrics']['queue_depth_max'], {'stage=render': 3})
+
+    def test_settle_counts_reported_tokens(self):
+        from utils import rate_limit
+
+        limiter = RateLimiter('vertex', requests_per_minute=600)
+        response = SimpleNamespace(usage_metadata=SimpleNamespace(prompt_token_count=120, candidates_token_count=80,
+                                                                  total_token_count=200))
+        before = rate_limit.metrics.value('model_tokens_total', api='vertex', direction='output')
+        limiter.settle(100, response)
+        self.assertEqual(rate_limit.metrics.value('model_tokens_total', api='vertex', direction='output'),
+                         before + 80)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.model_response import completed, loads_partial, parse_answer, strip_fences
+
+
+class TestModelResponse(unittest.TestCase):
+
+    def test_strip_fences(self):
+        self.assertEqual(strip_fences('```json\n{"a": 1}\n```'), '{"a": 1}\n')
+        self.assertEqual(strip_fences(' {"a": 1} '), '{"a": 1}')
+
+    def test_loads_partial_keeps_completed_values(self):
+        self.assertEqual(loads_partial('{"a": "x", "b": "y"}'), {'a': 'x', 'b': 'y'})
+        self.assertEqual(loads_partial('{"a": "x\\"}", "b": "trunc'), {'a': 'x"}'})
+        self.assertEqual(loads_partial('{"a": {"1": "x"}, "b": {"2": '), {'a': {'1': 'x'}})
+        self.assertEqual(loads_partial('["x", "y'), ['x'])
+        self.assertIsNone(loads_partial('{"a'))
+        self.assertIsNone(loads_partial('not json'))
+
+    def test_parse_answer(self):
+        text = '```json\n{"answer": {"ta-IN": "one", "hi-IN": "tw'
+        self.assertEqual(parse_answer(text), {'ta-IN': 'one'})
+        self.assertIsNone(parse_answer('{"answer": "text"}'))
+        self.assertIsNone(parse_answer(''))
+
+    def test_completed(self):
+        answer = {'ta-IN': 'one', 'hi-IN': ' ', 'te-IN': None}
+        self.assertEqual(completed(answer, ['ta-IN', 'hi-IN', 'te-IN', 'kn-IN']), {'ta-IN': 'one'})
+        self.assertEqual(completed(None, ['ta-IN']), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
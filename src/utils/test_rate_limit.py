@@ -0,0 +1,105 @@
+import os
+import sys
+import unittest
+from unittest.mock import MagicMock, patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google.api_core import exceptions
+
+from utils import rate_limit
+from utils.adaptive import AdaptiveController
+from utils.rate_limit import RateLimitedBucket, RateLimiter, TokenBucket, get_rate_limiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def test_burst_then_sustained_rate(self):
+        bucket = TokenBucket(60, burst=5, clock=self.clock, sleep=self.clock.sleep)
+        for _ in range(5):
+            self.assertEqual(bucket.acquire(), 0)
+        # one unit a second once the burst is spent
+        self.assertAlmostEqual(bucket.acquire(), 1.0)
+        self.assertAlmostEqual(bucket.acquire(), 1.0)
+        self.assertAlmostEqual(self.clock.now, 2.0)
+
+    def test_oversized_request_goes_into_debt(self):
+        bucket = TokenBucket(60, burst=10, clock=self.clock, sleep=self.clock.sleep)
+        self.assertEqual(bucket.acquire(25), 0)
+        self.assertAlmostEqual(bucket.level(), -15)
+        self.assertAlmostEqual(bucket.acquire(1), 16.0)
+
+    def test_consume_returns_unused_budget(self):
+        bucket = TokenBucket(60, burst=10, clock=self.clock, sleep=self.clock.sleep)
+        bucket.acquire(8)
+        bucket.consume(-5)
+        self.assertAlmostEqual(bucket.level(), 7)
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_settle_uses_reported_usage(self):
+        clock = FakeClock()
+        limiter = RateLimiter('vertex', 60, tokens_per_minute=6000, clock=clock, sleep=clock.sleep)
+        limiter.acquire(tokens=100)
+        response = MagicMock()
+        response.usage_metadata.total_token_count = 400
+        self.assertEqual(limiter.settle(100, response), 400)
+        self.assertAlmostEqual(limiter.tokens.level(), 600)
+
+    def test_try_acquire_never_waits(self):
+        clock = FakeClock()
+        limiter = RateLimiter('vertex', 60, tokens_per_minute=600, clock=clock, sleep=clock.sleep)
+        self.assertTrue(limiter.try_acquire(tokens=500))
+        # the request is given back when the tokens are not there
+        self.assertFalse(limiter.try_acquire(tokens=500))
+        self.assertAlmostEqual(limiter.requests.level(), 9)
+        self.assertEqual(clock.now, 0)
+
+    def test_registry_is_shared_and_reads_env(self):
+        with patch.dict(rate_limit._limiters, clear=True), \
+                patch.dict('os.environ', {'RATE_LIMIT_TTS_REQUESTS_PER_MINUTE': '120'}):
+            limiter = get_rate_limiter('tts')
+            self.assertIs(limiter, get_rate_limiter('tts'))
+            self.assertAlmostEqual(limiter.requests.rate, 2.0)
+            with self.assertRaises(ValueError):
+                get_rate_limiter('unknown')
+
+    def test_bucket_proxy_limits_object_calls(self):
+        limiter = MagicMock()
+        bucket = RateLimitedBucket(MagicMock(), limiter)
+        blob = bucket.blob('key/audio.wav')
+        blob.exists()
+        blob.download_to_filename('/tmp/audio.wav')
+        _ = blob.name
+        self.assertEqual(limiter.acquire.call_count, 2)
+
+    def test_bucket_proxy_retries_throttled_calls_but_not_streams(self):
+        clock = FakeClock()
+        controller = AdaptiveController('gcs', 4, deadline=60, clock=clock, sleep=clock.sleep)
+        wrapped = MagicMock()
+        wrapped.blob.return_value.exists.side_effect = [exceptions.TooManyRequests('quota'), True]
+        wrapped.blob.return_value.upload_from_file.side_effect = exceptions.TooManyRequests('quota')
+        blob = RateLimitedBucket(wrapped, MagicMock(), controller).blob('key/audio.wav')
+        self.assertTrue(blob.exists())
+        with self.assertRaises(exceptions.TooManyRequests):
+            blob.upload_from_file(MagicMock())
+        self.assertEqual(wrapped.blob.return_value.upload_from_file.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
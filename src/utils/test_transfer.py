@@ -0,0 +1,194 @@
+import gc
+import io
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.transfer import TransferManager
+
+
+class FakeBlob:
+
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.size = None
+        self.content_type = None
+
+    def reload(self):
+        self.bucket.calls.append(('reload', self.name))
+        self.size = len(self.bucket.objects[self.name])
+
+    def download_to_filename(self, path):
+        self.bucket.calls.append(('download', self.name))
+        with open(path, 'wb') as f:
+            f.write(self.bucket.objects[self.name])
+
+    def download_to_file(self, f, start=None, end=None):
+        self.bucket.calls.append(('range', self.name, start, end))
+        f.write(self.bucket.objects[self.name][start:end + 1])
+
+    def download_as_bytes(self):
+        return self.bucket.objects[self.name]
+
+    def upload_from_filename(self, path, content_type=None):
+        self.bucket.calls.append(('upload', self.name))
+        with open(path, 'rb') as f:
+            self.bucket.put(self.name, f.read())
+
+    def upload_from_file(self, f, size=None):
+        self.bucket.calls.append(('part', self.name))
+        self.bucket.put(self.name, f.read(size))
+
+    def upload_from_string(self, data, content_type=None):
+        self.bucket.put(self.name, data.encode('utf-8') if isinstance(data, str) else data)
+
+    def compose(self, sources):
+        self.bucket.calls.append(('compose', self.name, len(sources)))
+        self.bucket.put(self.name, b''.join(self.bucket.objects[source.name] for source in sources))
+
+    def delete(self):
+        with self.bucket.lock:
+            del self.bucket.objects[self.name]
+
+    def open(self, mode, chunk_size=None, content_type=None):
+        blob = self
+
+        class Writer:
+            # like a GCS BlobWriter, closing it finalizes whatever was written, also when it is collected
+            def __init__(self):
+                self.buffer = io.BytesIO()
+
+            def write(self, data):
+                return self.buffer.write(data)
+
+            def close(self):
+                if not self.buffer.closed:
+                    blob.bucket.put(blob.name, self.buffer.getvalue())
+                self.buffer.close()
+
+            def __del__(self):
+                self.close()
+
+        return Writer()
+
+
+class FakeBucket:
+
+    def __init__(self):
+        self.objects = {}
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def put(self, name, data):
+        with self.lock:
+            self.objects[name] = data
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+
+class TestTransferManager(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.bucket = FakeBucket()
+        self.transfer = TransferManager(self.bucket, chunk_size=256 * 1024, max_workers=4)
+        self.data = os.urandom(256 * 1024 * 3 + 123)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_large_download_is_sliced(self):
+        self.bucket.objects['key/audio.wav'] = self.data
+        path = os.path.join(self.tmp.name, 'audio.wav')
+        self.transfer.download('key/audio.wav', path)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        ranges = sorted(call[2:] for call in self.bucket.calls if call[0] == 'range')
+        self.assertEqual(ranges[0], (0, 256 * 1024 - 1))
+        self.assertEqual(ranges[-1], (256 * 1024 * 3, len(self.data) - 1))
+        self.assertEqual(os.listdir(self.tmp.name), ['audio.wav'])
+
+    def test_failed_slice_leaves_no_file(self):
+        self.bucket.objects['key/audio.wav'] = self.data
+        path = os.path.join(self.tmp.name, 'audio.wav')
+        download_to_file = FakeBlob.download_to_file
+
+        def flaky(blob, f, start=None, end=None):
+            if start == 256 * 1024:
+                raise ConnectionError('reset')
+            download_to_file(blob, f, start=start, end=end)
+
+        with patch.object(FakeBlob, 'download_to_file', flaky):
+            with self.assertRaises(ConnectionError):
+                self.transfer.download('key/audio.wav', path)
+        self.assertEqual(os.listdir(self.tmp.name), [])
+
+    def test_download_takes_the_size_from_the_catalog(self):
+        self.bucket.objects['key/audio.wav'] = self.data
+        self.bucket.objects['key/image.png'] = b'png'
+        catalog = MagicMock()
+        catalog.size.side_effect = lambda name: len(self.data) if name == 'key/audio.wav' else None
+        transfer = TransferManager(self.bucket, chunk_size=256 * 1024, max_workers=4, catalog=catalog)
+        transfer.download('key/audio.wav', os.path.join(self.tmp.name, 'audio.wav'))
+        self.assertNotIn(('reload', 'key/audio.wav'), self.bucket.calls)
+        transfer.download('key/image.png', os.path.join(self.tmp.name, 'image.png'))
+        self.assertIn(('reload', 'key/image.png'), self.bucket.calls)
+
+    def test_small_transfers_use_a_single_request(self):
+        self.bucket.objects['key/image.png'] = b'png'
+        path = os.path.join(self.tmp.name, 'image.png')
+        self.transfer.download('key/image.png', path)
+        self.transfer.upload(path, 'key/copy.png')
+        self.assertEqual(self.bucket.calls,
+                         [('reload', 'key/image.png'), ('download', 'key/image.png'), ('upload', 'key/copy.png')])
+
+    def test_large_upload_is_composed_from_parts(self):
+        path = os.path.join(self.tmp.name, 'video.mp4')
+        with open(path, 'wb') as f:
+            f.write(self.data)
+        self.transfer.upload(path, 'key/staging_video.mp4', content_type='video/mp4')
+        self.assertEqual(self.bucket.objects, {'key/staging_video.mp4': self.data})
+        self.assertIn(('compose', 'key/staging_video.mp4', 4), self.bucket.calls)
+
+    def test_text_is_read_and_written_in_memory(self):
+        self.transfer.write_text('key/summary.txt', 'சுருக்கம்')
+        self.assertEqual(self.transfer.read_text('key/summary.txt'), 'சுருக்கம்')
+
+    def test_open_upload_only_creates_the_object_on_success(self):
+        with self.transfer.open_upload('key/ok.mp4') as stream:
+            stream.write(b'data')
+        self.assertEqual(self.bucket.objects, {'key/ok.mp4': b'data'})
+        with self.assertRaises(RuntimeError):
+            with self.transfer.open_upload('key/failed.mp4') as stream:
+                stream.write(b'partial')
+                raise RuntimeError('render failed')
+        del stream
+        gc.collect()
+        self.assertEqual(self.bucket.objects, {'key/ok.mp4': b'data'})
+
+    def test_failed_part_upload_deletes_the_sent_parts(self):
+        path = os.path.join(self.tmp.name, 'video.mp4')
+        with open(path, 'wb') as f:
+            f.write(self.data)
+        upload_from_file = FakeBlob.upload_from_file
+
+        def flaky(blob, f, size=None):
+            if blob.name.endswith('.part-2'):
+                raise ConnectionError('reset')
+            upload_from_file(blob, f, size=size)
+
+        with patch.object(FakeBlob, 'upload_from_file', flaky):
+            with self.assertRaises(ConnectionError):
+                self.transfer.upload(path, 'key/staging_video.mp4')
+        self.assertEqual(self.bucket.objects, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
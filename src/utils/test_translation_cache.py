@@ -0,0 +1,54 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.translation_cache import TranslationCache
+
+
+class TestTranslationCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'translations.db')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_key_depends_on_every_input(self):
+        base = ('text', 'Sanskrit', {'Tamil': 'ta-IN'}, 'gemini', 1, {'type': 'object'})
+        key = TranslationCache.make_key(*base)
+        self.assertEqual(key, TranslationCache.make_key(*base))
+        for i, changed in enumerate(['other', 'Tamil', {'Hindi': 'hi-IN'}, 'gemini-pro', 2, {'type': 'string'}]):
+            args = list(base)
+            args[i] = changed
+            self.assertNotEqual(key, TranslationCache.make_key(*args))
+
+    def test_get_put_and_counters(self):
+        cache = TranslationCache(self.path)
+        self.assertIsNone(cache.get('k'))
+        cache.put('k', {'ta-IN': 'வணக்கம்'})
+        self.assertEqual(cache.get('k'), {'ta-IN': 'வணக்கம்'})
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (1, 1, 1))
+        cache.close()
+
+    def test_persists_across_instances(self):
+        TranslationCache(self.path).put('k', {'hi-IN': 'नमस्ते'})
+        self.assertEqual(TranslationCache(self.path).get('k'), {'hi-IN': 'नमस्ते'})
+
+    def test_evicts_least_recently_used(self):
+        cache = TranslationCache(self.path, max_bytes=60)
+        cache.put('a', {'x': 'a' * 20})
+        cache.put('b', {'x': 'b' * 20})
+        cache.get('a')
+        cache.put('c', {'x': 'c' * 20})
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('c'))
+
+
+if __name__ == '__main__':
+    unittest.main()
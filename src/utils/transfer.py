@@ -0,0 +1,181 @@
+"""
+Parallel and streaming transfers between local files and a storage bucket.
+
+Large objects are downloaded as byte-range slices on a thread pool, each slice
+written straight to its offset in the target file, and uploaded as parallel
+parts that are composed into the final object server side. Small text objects
+are read and written in memory, and ``open_upload`` lets a producer such as a
+running render stream its output into an object without a local file.
+"""
+import logging
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Optional
+
+from .metrics import metrics
+
+DEFAULT_CHUNK_MB = 16
+DEFAULT_WORKERS = 8
+# GCS composes at most 32 source objects in one request
+MAX_COMPOSE_SOURCES = 32
+# Resumable upload chunks must be a multiple of 256 KiB
+UPLOAD_CHUNK_ALIGNMENT = 256 * 1024
+
+
+class TransferManager:
+    """
+    Moves objects between a bucket and the local disk, in parallel slices once they are large.
+
+    Args:
+        bucket: Bucket to transfer with, usually a RateLimitedBucket so every request draws from the gcs budget
+        chunk_size: Slice size in bytes, defaults to $TRANSFER_CHUNK_MB megabytes; objects of at least two
+            slices are transferred in parallel
+        max_workers: Parallel slices per transfer, defaults to $TRANSFER_WORKERS
+        catalog: ArtifactCatalog whose recorded sizes spare downloads a metadata request, optional
+    """
+
+    def __init__(self, bucket, chunk_size: Optional[int] = None, max_workers: Optional[int] = None, catalog=None):
+        self.bucket = bucket
+        self.catalog = catalog
+        chunk_size = chunk_size or int(os.getenv("TRANSFER_CHUNK_MB", DEFAULT_CHUNK_MB)) * 1024 * 1024
+        # aligned so the same size can be used as a resumable upload chunk
+        self.chunk_size = max(UPLOAD_CHUNK_ALIGNMENT, chunk_size // UPLOAD_CHUNK_ALIGNMENT * UPLOAD_CHUNK_ALIGNMENT)
+        self.max_workers = max_workers or int(os.getenv("TRANSFER_WORKERS", DEFAULT_WORKERS))
+        self.logger = logging.getLogger(__name__)
+
+    def _parallel(self, size: int) -> bool:
+        return self.max_workers > 1 and size >= 2 * self.chunk_size
+
+    @metrics.timed('transfer', direction='download')
+    def download(self, name: str, path: str) -> str:
+        """Download an object to ``path``, in parallel byte ranges if it is large."""
+        blob = self.bucket.blob(name)
+        size = self.catalog.size(name) if self.catalog is not None else None
+        if size is None:
+            # only asked for when the catalog does not know it, it is another request per object
+            blob.reload()
+            size = blob.size or 0
+        if not self._parallel(size):
+            blob.download_to_filename(path)
+            metrics.inc('transfer_bytes_total', os.path.getsize(path), direction='download')
+            return path
+        # slices are written to a partial file, so a failed slice never leaves a truncated file at path
+        partial = path + '.partial'
+        with open(partial, 'wb') as f:
+            f.truncate(size)
+
+        def fetch(start):
+            with open(partial, 'r+b') as f:
+                f.seek(start)
+                blob.download_to_file(f, start=start, end=min(start + self.chunk_size, size) - 1)
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                list(pool.map(fetch, range(0, size, self.chunk_size)))
+            os.replace(partial, path)
+        except BaseException:
+            os.remove(partial)
+            raise
+        metrics.inc('transfer_bytes_total', size, direction='download')
+        self.logger.info(f"Downloaded {name} ({size} bytes) in {math.ceil(size / self.chunk_size)} slices")
+        return path
+
+    @metrics.timed('transfer', direction='upload')
+    def upload(self, path: str, name: str, content_type: Optional[str] = None) -> str:
+        """Upload ``path`` to an object, as parallel composed parts if it is large."""
+        size = os.path.getsize(path)
+        metrics.inc('transfer_bytes_total', size, direction='upload')
+        if not self._parallel(size):
+            self.bucket.blob(name).upload_from_filename(path, content_type=content_type)
+            return name
+        parts = min(MAX_COMPOSE_SOURCES, math.ceil(size / self.chunk_size))
+        part_size = math.ceil(size / parts)
+        part_names = [f'{name}.part-{i}' for i in range(parts)]
+        # parts are deleted once composed, or as far as they got if a part or the compose fails
+        uploaded = []
+
+        def send(i):
+            start = i * part_size
+            with open(path, 'rb') as f:
+                f.seek(start)
+                blob = self.bucket.blob(part_names[i])
+                blob.upload_from_file(f, size=min(part_size, size - start))
+                uploaded.append(blob)
+                return blob
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            try:
+                sources = list(pool.map(send, range(parts)))
+                destination = self.bucket.blob(name)
+                if content_type:
+                    destination.content_type = content_type
+                destination.compose(sources)
+            finally:
+                # pool.map stops at the first failure, parts still being sent finish before they are deleted
+                pool.shutdown(wait=True)
+                for blob in uploaded:
+                    try:
+                        blob.delete()
+                    except Exception as e:
+                        self.logger.warning(f"Could not delete upload part {blob.name}: {e}")
+        self.logger.info(f"Uploaded {name} ({size} bytes) in {parts} composed parts")
+        return name
+
+    @contextmanager
+    def open_upload(self, name: str, content_type: Optional[str] = None):
+        """
+        Writable stream into an object, uploaded in chunks while it is written.
+
+        The stream goes to a ``.partial`` object that is composed into ``name`` when the block exits cleanly
+        and deleted either way, so a failed producer never leaves a truncated object behind.
+        """
+        partial = self.bucket.blob(f'{name}.partial')
+        writer = partial.open('wb', chunk_size=self.chunk_size, content_type=content_type)
+        try:
+            yield writer
+        except BaseException:
+            self._abandon(partial, writer)
+            raise
+        try:
+            writer.close()
+            destination = self.bucket.blob(name)
+            if content_type:
+                destination.content_type = content_type
+            destination.compose([partial])
+        finally:
+            self._delete(partial)
+
+    def _abandon(self, partial, writer):
+        abandon = getattr(writer, 'abandon', None)
+        if abandon is not None:
+            # local and memory writers drop what was written themselves
+            abandon()
+            return
+        # a GCS BlobWriter cannot be cancelled, closing it finalizes the partial object, which is then deleted
+        try:
+            writer.close()
+        except Exception as e:
+            self.logger.warning(f"Could not close the upload of {partial.name}: {e}")
+            return
+        self._delete(partial)
+
+    def _delete(self, blob):
+        try:
+            blob.delete()
+        except Exception as e:
+            self.logger.warning(f"Could not delete {blob.name}: {e}")
+
+    def read_bytes(self, name: str) -> bytes:
+        data = self.bucket.blob(name).download_as_bytes()
+        metrics.inc('transfer_bytes_total', len(data), direction='download')
+        return data
+
+    def read_text(self, name: str, encoding: str = 'utf-8') -> str:
+        return self.read_bytes(name).decode(encoding)
+
+    def write_text(self, name: str, text: str, content_type: str = 'text/plain; charset=utf-8') -> str:
+        self.bucket.blob(name).upload_from_string(text, content_type=content_type)
+        metrics.inc('transfer_bytes_total', len(text.encode('utf-8')), direction='upload')
+        return name
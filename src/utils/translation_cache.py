@@ -0,0 +1,96 @@
+"""
+Content-addressed on-disk cache for parsed translation answers.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+from .temp_utils import get_temp_dir
+
+DEFAULT_MAX_MB = 512
+
+
+class TranslationCache:
+    """
+    SQLite-backed cache mapping a translation request to its parsed ``answer`` dict.
+
+    Entries are evicted least recently used first once the stored answers exceed
+    ``max_bytes``.
+
+    Args:
+        path: Database file, defaults to $TRANSLATION_CACHE_PATH or a file in the itihasa temp directory
+        max_bytes: Size budget for stored answers, defaults to $TRANSLATION_CACHE_MAX_MB megabytes
+    """
+
+    def __init__(self, path: Optional[str] = None, max_bytes: Optional[int] = None):
+        self.path = path or os.getenv("TRANSLATION_CACHE_PATH",
+                                      os.path.join(get_temp_dir('cache'), 'translations.db'))
+        self.max_bytes = max_bytes if max_bytes is not None \
+            else int(os.getenv("TRANSLATION_CACHE_MAX_MB", DEFAULT_MAX_MB)) * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS translations (
+                    key TEXT PRIMARY KEY,
+                    answer TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )""")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS translations_last_access ON translations (last_access)")
+
+    @staticmethod
+    def make_key(text: str, source_lang: str, target_langs_map: Dict[str, str], model_id: str,
+                 prompt_version, schema: Optional[dict] = None) -> str:
+        """Hash everything that changes the model's answer for a chunk, including the response schema it follows."""
+        payload = json.dumps([text, source_lang, target_langs_map, model_id, str(prompt_version), schema],
+                             sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT answer FROM translations WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            with self._conn:
+                self._conn.execute("UPDATE translations SET last_access = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, key: str, answer: dict):
+        data = json.dumps(answer, ensure_ascii=False)
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO translations (key, answer, size, created, last_access) "
+                               "VALUES (?, ?, ?, ?, ?)", (key, data, len(data.encode('utf-8')), now, now))
+            self._evict()
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM translations").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        stale = []
+        for key, size in self._conn.execute("SELECT key, size FROM translations ORDER BY last_access"):
+            if total <= self.max_bytes:
+                break
+            stale.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM translations WHERE key = ?", stale)
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM translations").fetchone()
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries, 'bytes': size}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
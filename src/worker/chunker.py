@@ -0,0 +1,123 @@
+"""
+Verse-aware chunking of source texts into token-budgeted translation requests.
+
+Source files such as ``data/mahabharat/mbs*.txt`` start every verse on a line
+indented by at most three spaces, continue it on deeper indented lines and mark
+a change of speaker with a ``[name]`` line. The chunker keeps verses whole,
+prefers to cut where a new speaker starts and keeps filling a chunk across file
+boundaries, so short chapters no longer become their own under-filled request.
+"""
+from collections import namedtuple
+from typing import Callable, Iterable, Iterator, List, Tuple
+
+from utils.rate_limit import estimate_tokens
+
+# index counts the chunks that start in source_file
+Chunk = namedtuple('Chunk', ['source_file', 'index', 'text', 'tokens'])
+
+# Deepest indentation of a line that starts a new verse
+VERSE_INDENT = 3
+
+
+def _indent(line: str) -> int:
+    return len(line) - len(line.lstrip(' '))
+
+
+def is_speaker(line: str) -> bool:
+    stripped = line.strip()
+    return stripped.startswith('[') and stripped.endswith(']')
+
+
+class VerseChunker:
+    """
+    Streams chunks of whole verses up to an input token budget.
+
+    Args:
+        max_tokens: Input token budget of a chunk; a single verse larger than this becomes its own chunk
+        speaker_fill: Once a chunk is this full, a new speaker starts a new chunk instead of joining it
+        count_tokens: Token estimator for a piece of text
+    """
+
+    def __init__(self, max_tokens: int, speaker_fill: float = 0.75,
+                 count_tokens: Callable[[str], int] = estimate_tokens):
+        if max_tokens < 1:
+            raise ValueError(f"Invalid chunk token budget: {max_tokens}")
+        self.max_tokens = max_tokens
+        self.speaker_fill = speaker_fill
+        self.count_tokens = count_tokens
+
+    def iter_verses(self, lines: Iterable[str]) -> Iterator[Tuple[bool, str]]:
+        """Group lines into (starts_with_speaker, text) verses; blank lines end a verse."""
+        verse = []
+        for line in lines:
+            line = line.rstrip('\r\n')
+            if not line.strip():
+                if verse:
+                    yield is_speaker(verse[0]), '\n'.join(verse)
+                    verse = []
+                continue
+            # a speaker tag opens a verse, the lines after it belong to the same verse
+            starts = is_speaker(line) or _indent(line) <= VERSE_INDENT
+            if verse and starts and not (len(verse) == 1 and is_speaker(verse[0])):
+                yield is_speaker(verse[0]), '\n'.join(verse)
+                verse = []
+            verse.append(line)
+        if verse:
+            yield is_speaker(verse[0]), '\n'.join(verse)
+
+    def split(self, text: str) -> List[str]:
+        """
+        Cut a chunk's text into two halves of about the same size on a verse boundary, or on a line boundary
+        if it is a single verse. Text of a single line cannot be split and is returned as is.
+        """
+        units = [verse for _, verse in self.iter_verses(text.splitlines())]
+        if len(units) < 2:
+            units = [line for line in text.splitlines() if line.strip()]
+        if len(units) < 2:
+            return [text]
+        sizes = [self.count_tokens(unit) for unit in units]
+        half, total, cut = sum(sizes) / 2, 0, 1
+        for i, size in enumerate(sizes[:-1]):
+            total += size
+            cut = i + 1
+            if total >= half:
+                break
+        return ['\n'.join(units[:cut]), '\n'.join(units[cut:])]
+
+    def iter_chunks(self, sources: Iterable[Tuple[str, Iterable[str]]]) -> Iterator[Chunk]:
+        """
+        Yield chunks over every (source_file, lines) pair in order, continuing across file boundaries.
+
+        A chunk is attributed to the file its first verse comes from.
+        """
+        verses = ((source_file, speaker, self.count_tokens(verse), verse)
+                  for source_file, lines in sources
+                  for speaker, verse in self.iter_verses(lines))
+        counts = {}
+        for source_file, texts, tokens in self._fill(verses):
+            index = counts.get(source_file, 0)
+            counts[source_file] = index + 1
+            yield Chunk(source_file, index, '\n'.join(texts), tokens)
+
+    def count_chunks(self, verse_sizes: Iterable[Tuple[str, bool, int]]) -> int:
+        """Number of chunks iter_chunks would produce, from (source_file, starts_with_speaker, tokens) per verse."""
+        return sum(1 for _ in self._fill((source_file, speaker, size, None)
+                                         for source_file, speaker, size in verse_sizes))
+
+    def _fill(self, verses):
+        # packs (source_file, speaker, tokens, text) verses into (first source_file, texts, tokens) chunks
+        texts: List[str] = []
+        tokens = 0
+        owner = None
+        for source_file, speaker, size, text in verses:
+            full = tokens + size > self.max_tokens
+            new_speaker = speaker and tokens >= self.speaker_fill * self.max_tokens
+            if texts and (full or new_speaker):
+                yield owner, texts, tokens
+                texts, tokens = [], 0
+            if not texts:
+                owner = source_file
+            texts.append(text)
+            tokens += size
+        if texts:
+            yield owner, texts, tokens
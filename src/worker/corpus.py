@@ -0,0 +1,111 @@
+"""
+Streaming access to a source corpus for the curator.
+
+Source files are memory-mapped and read a line at a time, so only the verses of
+the chunk being built are held in memory no matter how large the corpus is.
+Part totals come from a pre-scan index of verse sizes that is cached next to
+the other itihasa state and only rebuilt for files whose size or modification
+time changed.
+"""
+import json
+import mmap
+import os
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from utils.temp_utils import get_temp_dir
+from worker.chunker import VerseChunker
+
+# Bump when the verse rules or the token estimate change so cached indexes are rebuilt
+INDEX_VERSION = 1
+
+# Files in a source folder that are notes rather than source text
+SKIP_FILES = ('changelog',)
+
+
+def iter_lines(path: str) -> Iterator[str]:
+    """Yield the decoded lines of a file, without line endings, from a read-only memory map."""
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for line in iter(data.readline, b''):
+                yield line.decode('utf-8').rstrip('\r\n')
+
+
+class CorpusReader:
+    """
+    Lazily lists and reads the files of a source path, a single file or a folder.
+
+    Args:
+        source_path: Source file or folder, folders are walked in sorted order
+        index_path: Pre-scan index file, defaults to $CORPUS_INDEX_PATH or a file in the itihasa temp directory
+    """
+
+    def __init__(self, source_path: str, index_path: Optional[str] = None):
+        self.source_path = source_path
+        self.index_path = index_path or os.getenv("CORPUS_INDEX_PATH",
+                                                  os.path.join(get_temp_dir('corpus'), 'index.json'))
+        self._lock = threading.Lock()
+
+    def iter_files(self) -> Iterator[Tuple[str, str]]:
+        """Yield (source_file, path) in reading order; source_file is the base name used in part keys."""
+        if os.path.isfile(self.source_path):
+            yield os.path.basename(self.source_path), self.source_path
+            return
+        for root, dirs, files in os.walk(self.source_path):
+            dirs.sort()
+            for file in sorted(files):
+                if file in SKIP_FILES:
+                    continue
+                yield file, os.path.join(root, file)
+
+    def iter_sources(self) -> Iterator[Tuple[str, Iterator[str]]]:
+        """Yield (source_file, lines) with the lines of each file read lazily."""
+        for source_file, path in self.iter_files():
+            yield source_file, iter_lines(path)
+
+    def count_parts(self, chunker: Optional[VerseChunker] = None) -> int:
+        """
+        Number of parts the corpus splits into, one per file without a chunker.
+
+        The verse sizes of every file are taken from the pre-scan index, so counting only reads
+        files that are new or changed since the index was written.
+        """
+        if chunker is None:
+            return sum(1 for _ in self.iter_files())
+        index = self._load_index()
+        verses = []
+        changed = False
+        for source_file, path in self.iter_files():
+            stat = os.stat(path)
+            entry = index.get(path)
+            if not entry or entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime_ns:
+                entry = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'verses': self._scan(chunker, path)}
+                index[path] = entry
+                changed = True
+            verses.extend((source_file, speaker, tokens) for speaker, tokens in entry['verses'])
+        if changed:
+            self._save_index(index)
+        return chunker.count_chunks(verses)
+
+    @staticmethod
+    def _scan(chunker: VerseChunker, path: str) -> List[list]:
+        return [[speaker, chunker.count_tokens(verse)] for speaker, verse in chunker.iter_verses(iter_lines(path))]
+
+    def _load_index(self) -> Dict[str, dict]:
+        with self._lock:
+            try:
+                with open(self.index_path, 'r') as file:
+                    data = json.load(file)
+            except (OSError, ValueError):
+                return {}
+        return data.get('files', {}) if data.get('version') == INDEX_VERSION else {}
+
+    def _save_index(self, index: Dict[str, dict]):
+        # written to a temporary file first so a crash never leaves a truncated index behind
+        with self._lock:
+            tmp_path = f'{self.index_path}.tmp'
+            with open(tmp_path, 'w') as file:
+                json.dump({'version': INDEX_VERSION, 'files': index}, file)
+            os.replace(tmp_path, self.index_path)
@@ -0,0 +1,201 @@
+"""
+Durable record of curation progress per chunk, language and stage.
+
+The ledger replaces hand-edited ``from_chunk`` values and changelog notes: every
+chunk of a source file is given a stable part number the first time it is
+chunked, and each stage of each part is tracked with its status, attempt count,
+timings and output key, so a crashed run resumes exactly where it stopped.
+"""
+import os
+import sqlite3
+import sys
+import threading
+import time
+from typing import Iterable, List, Optional
+
+from utils.temp_utils import get_state_dir
+
+STAGES = ('translate', 'synthesize', 'render', 'upload')
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class JobLedger:
+    """
+    SQLite-backed ledger of chunks and the stage jobs run for them.
+
+    Args:
+        path: Database file, defaults to $JOB_LEDGER_PATH or a file in the itihasa state directory
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv("JOB_LEDGER_PATH") or os.path.join(get_state_dir('ledger'), 'jobs.db')
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self._conn:
+            # parts are numbered per source directory and language set, as manifests for different languages
+            # share a content id
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS parts (
+                    content_id TEXT NOT NULL,
+                    source TEXT NOT NULL,
+                    languages TEXT NOT NULL,
+                    source_file TEXT NOT NULL,
+                    chunk_index INTEGER NOT NULL,
+                    part_number INTEGER NOT NULL,
+                    chunk_hash TEXT,
+                    PRIMARY KEY (content_id, source, languages, source_file, chunk_index)
+                )""")
+            # chunk boundaries depend on the budget, it is kept so a content is always cut the same way
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS budgets (
+                    content_id TEXT NOT NULL,
+                    source TEXT NOT NULL,
+                    languages TEXT NOT NULL,
+                    max_input_tokens INTEGER NOT NULL,
+                    PRIMARY KEY (content_id, source, languages)
+                )""")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    content_id TEXT NOT NULL,
+                    part_number INTEGER NOT NULL,
+                    language TEXT NOT NULL,
+                    stage TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    started_at REAL,
+                    finished_at REAL,
+                    output_key TEXT,
+                    error TEXT,
+                    PRIMARY KEY (content_id, part_number, language, stage)
+                )""")
+
+    def assign_part(self, content_id: str, source_file: str, chunk_index: int, first_part: int,
+                    chunk_hash: Optional[str] = None, source: str = '', languages: Iterable[str] = ()) -> int:
+        """
+        Return the part number of a chunk of a source file, assigning a new one if it was never seen.
+
+        Chunks seen in an earlier run keep their part number; a new chunk is numbered after both
+        ``first_part`` and the highest part number already handed out for the content, source and
+        languages. As chunks are assigned in reading order, a resumed run numbers its new chunks exactly
+        like an uninterrupted one. A chunk whose ``chunk_hash`` changed (e.g. the last chunk of a run grew
+        once more files were added) keeps its part number, but its jobs in ``languages`` are cleared so
+        the part is produced again instead of being skipped as already published.
+
+        Args:
+            content_id: Content id of the manifest
+            source_file: File the chunk was read from
+            chunk_index: Position of the chunk in the file
+            first_part: Lowest part number handed out
+            chunk_hash: Hash of the chunk's text
+            source: Source directory of the manifest
+            languages: Language codes the manifest translates into
+        """
+        content_id = str(content_id)
+        languages = sorted(languages)
+        scope = (content_id, source, ','.join(languages))
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT part_number, chunk_hash FROM parts WHERE content_id = ? AND source = ? AND languages = ? "
+                "AND source_file = ? AND chunk_index = ?", scope + (source_file, chunk_index)).fetchone()
+            if row:
+                part_number = row[0]
+                if chunk_hash is not None and row[1] is not None and row[1] != chunk_hash:
+                    self._conn.execute(
+                        f"DELETE FROM jobs WHERE content_id = ? AND part_number = ? "
+                        f"AND language IN ({','.join('?' * len(languages))})",
+                        (content_id, part_number, *languages))
+                    self._conn.execute(
+                        "UPDATE parts SET chunk_hash = ? WHERE content_id = ? AND source = ? AND languages = ? "
+                        "AND source_file = ? AND chunk_index = ?", (chunk_hash,) + scope + (source_file, chunk_index))
+                return part_number
+            highest = self._conn.execute(
+                "SELECT MAX(part_number) FROM parts WHERE content_id = ? AND source = ? AND languages = ?",
+                scope).fetchone()[0]
+            part_number = max(first_part, highest + 1) if highest is not None else first_part
+            self._conn.execute("INSERT INTO parts (content_id, source, languages, source_file, chunk_index, "
+                               "part_number, chunk_hash) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                               scope + (source_file, chunk_index, part_number, chunk_hash))
+        return part_number
+
+    def chunk_budget(self, content_id: str, tokens: int, source: str = '', languages: Iterable[str] = ()) -> int:
+        """
+        Return the input token budget the chunks of a content, source and languages are cut with.
+
+        The first call keeps ``tokens`` and later calls return it, so a learned budget only applies to
+        content that has not been chunked yet and resumed runs keep their part numbers.
+
+        Args:
+            content_id: Content id of the manifest
+            tokens: Budget to keep if none was kept yet
+            source: Source directory of the manifest
+            languages: Language codes the manifest translates into
+        """
+        scope = (str(content_id), source, ','.join(sorted(languages)))
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT max_input_tokens FROM budgets WHERE content_id = ? AND source = ? AND languages = ?",
+                scope).fetchone()
+            if row:
+                return row[0]
+            self._conn.execute("INSERT INTO budgets (content_id, source, languages, max_input_tokens) "
+                               "VALUES (?, ?, ?, ?)", scope + (tokens,))
+        return tokens
+
+    def start(self, content_id: str, part_number: int, language: str, stage: str):
+        with self._lock, self._conn:
+            self._conn.execute("""
+                INSERT INTO jobs (content_id, part_number, language, stage, status, attempts, started_at)
+                VALUES (?, ?, ?, ?, ?, 1, ?)
+                ON CONFLICT (content_id, part_number, language, stage) DO UPDATE SET
+                    status = excluded.status, attempts = attempts + 1, started_at = excluded.started_at,
+                    finished_at = NULL, error = NULL""",
+                               (str(content_id), part_number, language, stage, RUNNING, time.time()))
+
+    def finish(self, content_id: str, part_number: int, language: str, stage: str, output_key: str = None):
+        self._set(content_id, part_number, language, stage, DONE, output_key=output_key)
+
+    def fail(self, content_id: str, part_number: int, language: str, stage: str, error: str):
+        self._set(content_id, part_number, language, stage, FAILED, error=str(error))
+
+    def _set(self, content_id, part_number, language, stage, status, output_key=None, error=None):
+        with self._lock, self._conn:
+            self._conn.execute("""
+                INSERT INTO jobs (content_id, part_number, language, stage, status, finished_at, output_key, error)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (content_id, part_number, language, stage) DO UPDATE SET
+                    status = excluded.status, finished_at = excluded.finished_at,
+                    output_key = COALESCE(excluded.output_key, output_key), error = excluded.error""",
+                               (str(content_id), part_number, language, stage, status, time.time(),
+                                output_key, error))
+
+    def status(self, content_id: str, part_number: int, language: str, stage: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status FROM jobs WHERE content_id = ? AND part_number = ? AND language = ? AND stage = ?",
+                (str(content_id), part_number, language, stage)).fetchone()
+        return row[0] if row else None
+
+    def is_done(self, content_id: str, part_number: int, language: str, stage: str) -> bool:
+        return self.status(content_id, part_number, language, stage) == DONE
+
+    def summary(self, content_id: str) -> List[tuple]:
+        """Rows of (language, stage, status, count, highest part) for a progress report."""
+        with self._lock:
+            return self._conn.execute("""
+                SELECT language, stage, status, COUNT(*), MAX(part_number) FROM jobs WHERE content_id = ?
+                GROUP BY language, stage, status ORDER BY language, stage, status""", (str(content_id),)).fetchall()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+if __name__ == '__main__':
+    # print progress for a content id, e.g. python -m worker.ledger mahabharat
+    ledger = JobLedger()
+    for language, stage, status, count, highest in ledger.summary(sys.argv[1]):
+        print(f"{language:8} {stage:12} {status:8} {count:6} parts (highest part {highest})")
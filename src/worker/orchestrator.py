@@ -1,22 +1,40 @@
+import hashlib
 import json
 import logging
 import os
+import time
 import uuid
-from datetime import time
-from time import sleep
+from collections import namedtuple
+from functools import cached_property
 
-from google.cloud import storage
-import vertexai
-from vertexai.generative_models import GenerativeModel, GenerationConfig
-from google.cloud import texttospeech
 from publisher import Publisher
-import concurrent.futures
+from worker.pipeline import Stage, StagePipeline
+from worker.chunker import VerseChunker
+from worker.corpus import CorpusReader
+from worker.ledger import JobLedger
+from worker.sizing import OutputRatios, ratios_path
+from worker.tts_tracker import SynthesisTracker
 
-from config import LANG_CODE_MAP, get_translation_prompt, ContentConfig
+from config import LANG_CODE_MAP, TRANSLATION_PROMPT_VERSION, get_translation_prompt, ContentConfig, \
+    get_packed_translation_prompt, get_packed_translation_schema, get_translation_schema, get_translations_schema
+from utils.model_response import completed, parse_answer
+from utils import clients
+from utils.adaptive import get_controller
+from utils.hedging import get_hedge_policy
+from utils.metrics import metrics
+from utils.rate_limit import estimate_tokens, get_rate_limiter
+from utils.translation_cache import TranslationCache
 
 # Update logging format to include job_id
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(job_id)s - %(message)s')
-vertexai.init(project=os.getenv("GCP_PARENT_PROJECT"), location=os.getenv("GCP_LOCATION"))
+
+# Follow-up requests for the languages still missing from an answer
+TRANSLATION_RETRIES = 2
+# How many times a request that does not fit max_output_tokens may be halved
+MAX_SPLIT_DEPTH = 4
+
+# Parsed answer of one model call, truncated is set when the output hit max_output_tokens
+Generation = namedtuple('Generation', ['answer', 'truncated', 'output_tokens'])
 
 
 class JobIDFilter(logging.Filter):
@@ -33,101 +51,333 @@ class ContentCurator:
     def __init__(self, config: ContentConfig):
         self.logger = logging.getLogger(__name__)
         self.config = config
-        self.gen_model = GenerativeModel(os.getenv("VERTEX_MODEL_ID", "gemini-2.0-flash-001"))
-        self.tts_client = texttospeech.TextToSpeechLongAudioSynthesizeClient()
-        self.audio_config = texttospeech.AudioConfig(
-            audio_encoding=texttospeech.AudioEncoding.LINEAR16,
-            speaking_rate=0.85
-        )
+        self.model_id = os.getenv("VERTEX_MODEL_ID", "gemini-2.0-flash-001")
+        self.translation_cache = TranslationCache()
         self.target_languages = config.translations
         self.job_id = uuid.uuid4()
         self.publisher = Publisher()
         self.retry_from_chunk = self.config.from_chunk
         # Add JobIDFilter to the logger
         job_id_filter = JobIDFilter(self.job_id)
-        self.chunks = []
         self.logger.addFilter(job_id_filter)
-        self.storage_client = storage.Client()
-        self.bucket = self.storage_client.bucket(os.getenv("GCS_BUCKET").split("://")[1])
-
-    def chunkify(self, text, max_lines_per_chunk=100, overlap=0.02):
-        # split text into chunks of 100 lines with 20% overlap
-        lines = text.splitlines()
-        chunks = []
-        for i in range(0, len(lines), max_lines_per_chunk):
-            chunk = lines[i:i + max_lines_per_chunk]
-            if i > 0:
-                o = lines[i - int(max_lines_per_chunk * overlap):i]
-                chunk = o + chunk
-            chunks.append('\n'.join(chunk))
-        return chunks
+        self.vertex_limiter = get_rate_limiter('vertex')
+        # opt-in duplicate requests for model calls slower than the recent p95
+        self.hedger = get_hedge_policy('vertex')
+        self.tts_limiter = get_rate_limiter('tts')
+        # in-flight limits that adapt to throttling, throttled calls are retried until $RETRY_DEADLINE_SECONDS
+        self.vertex = get_controller('vertex')
+        self.tts = get_controller('tts')
+        self.ledger = JobLedger()
+        self.corpus = CorpusReader(self.config.source_path)
+        # set from the corpus pre-scan index when chunking starts, used for part labels in prompts
+        self.total_parts = 0
+        # learned in earlier runs too, they size the chunks of content that has not been chunked yet
+        self.output_ratios = OutputRatios(path=ratios_path())
+
+    # clients are shared process-wide and, like the bucket, created on first use
+
+    @cached_property
+    def gen_model(self):
+        return clients.generative_model(self.model_id)
+
+    @cached_property
+    def tts_client(self):
+        return clients.tts_client()
+
+    @cached_property
+    def audio_config(self):
+        from google.cloud import texttospeech
+        return texttospeech.AudioConfig(audio_encoding=texttospeech.AudioEncoding.LINEAR16, speaking_rate=0.85)
+
+    @cached_property
+    def bucket(self):
+        # the publisher's bucket, so its read cache sees the subtitles written here
+        return self.publisher.bucket
+
+    @cached_property
+    def tts_tracker(self):
+        return SynthesisTracker(self.bucket, logger=self.logger)
 
     def curate(self):
-        # open the source file if its file or if its folder, start iterating over the files
-        if os.path.isfile(self.config.source_path):
-            with open(self.config.source_path, 'r') as file:
-                text = file.read()
-                self._process(text)
+        # one listing per language, after which the publisher answers existence checks from its catalog
+        for name in self.config.translations:
+            self.publisher.sync_catalog(self._key_name(0, LANG_CODE_MAP[name]))
+        # translate, synthesize, render and upload run as separate stages so consecutive chunks overlap
+        items = self._pack(self._iter_chunks()) if self.config.pack_tokens else self._iter_chunks()
+        stats = self._build_pipeline().run(items)
+        self.logger.info(f"Pipeline stats: {stats}")
+        self.logger.info(f"Translation cache stats: {self.translation_cache.stats()}")
+        self.logger.info(f"Learned output token ratios: {self.output_ratios.snapshot()}")
+        self.output_ratios.save()
+        exported = metrics.export(run_id=self.job_id)
+        self.logger.info(f"Metrics written to {exported['textfile']} and {exported['summary']}")
+
+    def _build_pipeline(self):
+        concurrency = self.config.stage_concurrency
+        if self.config.pack_tokens:
+            # several chunks share one translation request, items on the first queue are packs of chunks
+            translate = Stage('translate', self._translate_pack, concurrency['translate'], fan_out=True)
         else:
-            for root, dirs, files in os.walk(self.config.source_path):
-                files.sort()
-                for file in files:
-                    if file == 'changelog':
-                        continue
-                    with open(os.path.join(root, file), 'r') as f:
-                        text = f.read()
-                        self._process(text)
-                        print('Completed processing file:', file)
-
-    def _process(self, text):
-        if self.config.split_into_parts:
-            self.chunks = self.chunkify(text)
-            for i, chunk in enumerate(self.chunks):
-                self._translate(i + self.config.from_chunk + 1, chunk)
+            translate = Stage('translate', lambda item: self._translate(*item), concurrency['translate'], fan_out=True)
+        return StagePipeline([
+            translate,
+            # hands back a future per key, the tracker resolves it once audio.wav has landed
+            Stage('synthesize', lambda item: self._synthesize(item[0], item[2], item[1]), concurrency['synthesize']),
+            Stage('render', self._render, concurrency['render']),
+            Stage('upload', lambda item: self._upload(*item), concurrency['upload']),
+        ], queue_size=self.config.queue_size, logger=self.logger)
 
-            self.config.from_chunk = len(self.chunks) + self.config.from_chunk
+    def _iter_sources(self):
+        # yields (source_file, lines) for the source file, or for every file if the source is a folder
+        for source_file, lines in self.corpus.iter_sources():
+            self.logger.info(f"Queued file for processing: {source_file}")
+            metrics.inc('source_files_total')
+            yield source_file, lines
+
+    def _iter_chunks(self):
+        # yields (chunk_number, text) work items for the translate stage, skipping parts already published
+        if self.config.split_into_parts:
+            chunker = VerseChunker(self.chunk_tokens)
+            self.total_parts = self.config.from_chunk + self.corpus.count_parts(chunker)
+            chunks = ((chunk.source_file, chunk.index, chunk.text) for chunk in chunker.iter_chunks(self._iter_sources()))
         else:
-            self._translate(0, text)
-            self.config.from_chunk = 1
+            self.total_parts = self.corpus.count_parts()
+            chunks = ((source_file, None, '\n'.join(lines)) for source_file, lines in self._iter_sources())
+        for source_file, index, text in chunks:
+            if index is None:
+                part_number = 0
+            else:
+                # part numbers are kept in the ledger so a rerun maps every chunk to the same key
+                part_number = self.ledger.assign_part(self.config.id, source_file, index,
+                                                      first_part=self.config.from_chunk + 1,
+                                                      chunk_hash=hashlib.sha256(text.encode('utf-8')).hexdigest(),
+                                                      **self._ledger_scope())
+            if self._is_published(part_number):
+                self.logger.info(f"Skipping part {part_number} of {source_file}, already published")
+                continue
+            yield part_number, text
+
+    @cached_property
+    def chunk_tokens(self):
+        # the manifest's budget, otherwise one sized from the learned output ratios when the content is first
+        # chunked and kept in the ledger, as changing it would move chunk boundaries under existing part numbers
+        if self.config.max_input_tokens:
+            return self.config.max_input_tokens
+        scope = self._ledger_scope()
+        learned = self.config.chunk_tokens(self.output_ratios.combined(scope['languages']))
+        return self.ledger.chunk_budget(self.config.id, learned, **scope)
+
+    def _ledger_scope(self):
+        # parts are numbered per source directory and language set
+        return {'source': os.path.normpath(self.config.source_path),
+                'languages': [LANG_CODE_MAP[n] for n in self.config.translations]}
+
+    def _pack(self, items):
+        # groups consecutive (chunk_number, text) items into packs that fit the input token budget and whose
+        # translations are expected to fit max_output_tokens, a pack cut off at the limit is requested again chunk
+        # by chunk
+        codes = [LANG_CODE_MAP[n] for n in self.config.translations]
+        pack, tokens = [], 0
+        for chunk_number, text in items:
+            size = estimate_tokens(text)
+            if pack and (tokens + size > self.config.pack_tokens or
+                         self.output_ratios.expected(codes, tokens + size) > self.config.max_output_tokens):
+                yield pack
+                pack, tokens = [], 0
+            pack.append((chunk_number, text))
+            tokens += size
+        if pack:
+            yield pack
+
+    def _is_published(self, part_number):
+        return all(self.ledger.is_done(self.config.id, part_number, LANG_CODE_MAP[n], 'upload')
+                   for n in self.config.translations)
 
     def _translate(self, chunk_number, text):
-        # get part_info from the chunk number and total number of chunks
-        part_info = f'Part {chunk_number + 1} of {len(self.chunks)}' if self.chunks else ''
-        prompt = get_translation_prompt(part_info, text, self.config.source_language,
-                                        {k: LANG_CODE_MAP[k] for k in self.target_languages})
-        response = self.gen_model.generate_content(contents=prompt,
-                                                   generation_config=GenerationConfig(max_output_tokens=4000,
-                                                                                      temperature=0.2))
-
-        for n in self.config.translations:
-            sanitized_response = None
-            answer = ''
-            try:
-                tx = response.text.replace('```json', '')
-                tx = tx.replace('```', '')
-                answer = tx
-                response_dict = json.loads(tx)
-                if not response_dict.get('answer'):
-                    error = f'⚡Could not translate...'
-                    self.logger.error(error)
-                else:
-                    sanitized_response = response_dict['answer'][LANG_CODE_MAP.get(n)]
-            except Exception as e:
-                error = f'⚡Could not load json due to a run time exception for answer {answer}: {e}'
-                self.logger.error(error)
-            if sanitized_response:
-                key_name = self._synthesize(chunk_number, sanitized_response, n)
-                sleep(10)
-                self.publisher.process_video(key=key_name)
+        return self._translate_pack([(chunk_number, text)])
+
+    @metrics.timed('translate')
+    def _translate_pack(self, pack):
+        # returns a (chunk_number, language, translated text) item for every target language that came back,
+        # languages whose audio an earlier run already synthesized are passed on without text.
+        # chunks that are not cached are sent to the model together in one request
+        content_id = self.config.id
+        target_langs_map = {k: LANG_CODE_MAP[k] for k in self.target_languages}
+        translations = []
+        answers = {}
+        requests = []
+        for chunk_number, text in pack:
+            pending = [n for n in self.config.translations
+                       if not self.ledger.is_done(content_id, chunk_number, LANG_CODE_MAP[n], 'upload')]
+            synthesized = [n for n in pending if self.ledger.is_done(content_id, chunk_number, LANG_CODE_MAP[n],
+                                                                     'synthesize')]
+            translations.extend((chunk_number, n, None) for n in synthesized)
+            to_translate = [n for n in pending if n not in synthesized]
+            if not to_translate:
+                continue
+            for n in to_translate:
+                self.ledger.start(content_id, chunk_number, LANG_CODE_MAP[n], 'translate')
+            cache_key = TranslationCache.make_key(text, self.config.source_language, target_langs_map,
+                                                  self.model_id, TRANSLATION_PROMPT_VERSION,
+                                                  schema=get_translations_schema(target_langs_map.values()))
+            answer = self.translation_cache.get(cache_key)
+            if len(completed(answer, target_langs_map.values())) == len(target_langs_map):
+                self.logger.info(f"Translation cache hit for part {chunk_number}")
+            else:
+                requests.append((chunk_number, text, cache_key, answer))
+            answers[chunk_number] = (answer, to_translate)
+
+        # chunks without any cached languages are requested together, partially cached ones only ask for the rest
+        fetched = self._request_translations([(n, text) for n, text, _, cached in requests if not cached],
+                                             target_langs_map)
+        for chunk_number, text, cache_key, cached in requests:
+            if cached:
+                answer = self._request_translation(chunk_number, text, target_langs_map, answer=cached)
             else:
-                self.logger.warning("Skipping synthesis due to error in translation.")
+                answer = fetched.get(chunk_number)
+            # partial answers are cached too so a rerun only pays for the languages that are still missing
+            if answer and answer != cached:
+                self.translation_cache.put(cache_key, answer)
+            answers[chunk_number] = (answer, answers[chunk_number][1])
+
+        for chunk_number, (answer, to_translate) in answers.items():
+            for n in to_translate:
+                sanitized_response = answer.get(LANG_CODE_MAP.get(n)) if answer else None
+                if sanitized_response:
+                    self.ledger.finish(content_id, chunk_number, LANG_CODE_MAP[n], 'translate')
+                    translations.append((chunk_number, n, sanitized_response))
+                else:
+                    self.ledger.fail(content_id, chunk_number, LANG_CODE_MAP[n], 'translate', 'missing from answer')
+                    self.logger.warning(f"Skipping synthesis of part {chunk_number} in {n}, translation is missing.")
+        return translations
+
+    def _request_translations(self, chunks, target_langs_map):
+        # returns {chunk_number: answer} for a list of (chunk_number, text), languages missing from a packed
+        # answer are requested again for their chunk only
+        if len(chunks) <= 1:
+            return {n: self._request_translation(n, text, target_langs_map) for n, text in chunks}
+        prompt = get_packed_translation_prompt(chunks, self.config.source_language, target_langs_map)
+        schema = get_packed_translation_schema([n for n, _ in chunks], target_langs_map.values())
+        packed = self._generate(prompt, self.config.max_output_tokens, schema).answer or {}
+        answers = {}
+        for n, text in chunks:
+            answer = completed(packed.get(str(n)), target_langs_map.values())
+            if len(answer) < len(target_langs_map):
+                self.logger.warning(f"Part {n} incomplete in packed translation, requesting the rest on its own")
+                metrics.inc('retries_total', reason='incomplete_pack')
+                answer = self._request_translation(n, text, target_langs_map, answer=answer)
+            answers[n] = answer
+        return answers
+
+    def _request_translation(self, chunk_number, text, target_langs_map, answer=None):
+        # returns {language_code: translation} for every language that came back, starting from a partial
+        # answer and asking only for the language codes still missing from it
+        answer = dict(answer or {})
+        part_info = f'Part {chunk_number} of {self.total_parts}' if self.total_parts and chunk_number else ''
+        for attempt in range(TRANSLATION_RETRIES + 1):
+            missing = {name: code for name, code in target_langs_map.items() if code not in answer}
+            if not missing:
+                break
+            if attempt:
+                self.logger.info(f"Requesting {sorted(missing.values())} again for part {chunk_number}")
+                metrics.inc('retries_total', reason='missing_languages')
+            answer.update(self._translate_fitted(part_info, text, missing))
+        return answer or None
+
+    def _translate_fitted(self, part_info, text, target_langs_map, depth=0):
+        # returns {language_code: translation}, splitting the language set and then the text in halves while
+        # the expected output does not fit max_output_tokens or the model's answer was cut off at the limit
+        codes = list(target_langs_map.values())
+        input_tokens = estimate_tokens(text)
+        splittable = depth < MAX_SPLIT_DEPTH and (len(codes) > 1 or len(self._split(text)) > 1)
+        if splittable and self.output_ratios.expected(codes, input_tokens) > self.config.max_output_tokens:
+            return self._translate_split(part_info, text, target_langs_map, depth)
+        prompt = get_translation_prompt(part_info, text, self.config.source_language, target_langs_map)
+        generation = self._generate(prompt, self.config.max_output_tokens, get_translation_schema(codes))
+        received = completed(generation.answer, codes)
+        if not generation.truncated:
+            self.output_ratios.observe(input_tokens, received, generation.output_tokens)
+            return received
+        missing = {name: code for name, code in target_langs_map.items() if code not in received}
+        if not missing or not splittable:
+            return received
+        self.logger.warning(f"Translation into {sorted(missing.values())} hit max_output_tokens, splitting it")
+        metrics.inc('retries_total', reason='max_output_tokens')
+        received.update(self._translate_split(part_info, text, missing, depth))
+        return received
+
+    def _translate_split(self, part_info, text, target_langs_map, depth):
+        names = list(target_langs_map)
+        if len(names) > 1:
+            # languages are split first so every translation still sees the whole chunk
+            translations = {}
+            for group in (names[:len(names) // 2], names[len(names) // 2:]):
+                translations.update(self._translate_fitted(part_info, text, {n: target_langs_map[n] for n in group},
+                                                           depth + 1))
+            return translations
+        code = target_langs_map[names[0]]
+        pieces = [self._translate_fitted(part_info, half, target_langs_map, depth + 1) for half in self._split(text)]
+        if all(code in piece for piece in pieces):
+            return {code: '\n'.join(piece[code] for piece in pieces)}
+        return {}
+
+    def _split(self, text):
+        return VerseChunker(self.chunk_tokens).split(text)
+
+    def _generate(self, prompt, max_output_tokens, schema):
+        # one schema-constrained model call
+        tokens = estimate_tokens(prompt)
+
+        def request():
+            self.vertex_limiter.acquire(tokens=tokens)
+            with metrics.timed('generate', model=self.model_id):
+                response = self.hedger.call(lambda: self.gen_model.generate_content(
+                    contents=prompt,
+                    generation_config=clients.generation_config(max_output_tokens=max_output_tokens, temperature=0.2,
+                                                                response_mime_type="application/json",
+                                                                response_schema=schema)),
+                    limiter=self.vertex_limiter, tokens=tokens)
+            self.vertex_limiter.settle(tokens, response)
+            return response
+
+        response = self.vertex.call(request)
+        usage = getattr(response, 'usage_metadata', None)
+        output_tokens = getattr(usage, 'candidates_token_count', None)
+        output_tokens = output_tokens if isinstance(output_tokens, int) and output_tokens > 0 else None
+        try:
+            candidates = response.candidates
+            finish_reason = candidates[0].finish_reason if candidates else None
+            text = response.text
+        except Exception as e:
+            # raised when the response has no candidates, e.g. it was blocked
+            self.logger.error(f'⚡Could not read model response: {e}')
+            return Generation(None, False, output_tokens)
+        truncated = getattr(finish_reason, 'name', finish_reason) == 'MAX_TOKENS'
+        answer = parse_answer(text if isinstance(text, str) else None)
+        if answer is None:
+            self.logger.error(f'⚡Could not load json answer: {str(text)[:200]}')
+        return Generation(answer, truncated, output_tokens)
+
+    def _key_name(self, part_number, language_code):
+        return f'{language_code}/{self.config.id}/{self.config.name}-part-{part_number}' if part_number > 0 \
+            else f'{language_code}/{self.config.id}/{self.config.name}'
+
+    def _parse_key(self, key):
+        # inverse of _key_name, returns (part_number, language_code)
+        language_code = key.split('/', 1)[0]
+        part = key.rsplit('-part-', 1)[1] if '-part-' in key else '0'
+        return (int(part) if part.isdigit() else 0), language_code
 
     def _synthesize(self, part_number, tx, n):
+        from google.cloud import texttospeech
+
         voice_name = str(f'{LANG_CODE_MAP.get(n)}-Standard-B')
         language_code = LANG_CODE_MAP.get(n)
         voice = texttospeech.VoiceSelectionParams(language_code=language_code, name=voice_name)
-        key_name = f'{language_code}/{self.config.id}/{self.config.name}-part-{part_number}' if part_number > 0 \
-            else f'{language_code}/{self.config.id}/{self.config.name}'
+        key_name = self._key_name(part_number, language_code)
+        if tx is None:
+            # audio.wav was produced by an earlier run
+            return key_name
 
         request = texttospeech.SynthesizeLongAudioRequest(
             parent=os.getenv("GCP_PARENT_PROJECT_LOCATION"),
@@ -136,11 +386,68 @@ class ContentCurator:
             voice=voice,
             output_gcs_uri=f'{os.getenv("GCS_BUCKET")}/{key_name}/audio.wav'
         )
-        response = self.tts_client.synthesize_long_audio(request=request)
-        # also upload tx as raw translated text to the gcs bucket
-        blob = self.bucket.blob(f'{key_name}/subtitles.txt')
-        blob.upload_from_string(data=tx, content_type="text/plain; charset=utf-8")
+
+        def submit():
+            self.tts_limiter.acquire()
+            return self.tts_client.synthesize_long_audio(request=request)
+
+        self.ledger.start(self.config.id, part_number, language_code, 'synthesize')
+        started = time.monotonic()
+        try:
+            response = self.tts.call(submit)
+            # also upload tx as raw translated text to the gcs bucket
+            blob = self.bucket.blob(f'{key_name}/subtitles.txt')
+            blob.upload_from_string(data=tx, content_type="text/plain; charset=utf-8")
+            self.publisher.catalog.record(f'{key_name}/subtitles.txt')
+        except Exception as e:
+            self.ledger.fail(self.config.id, part_number, language_code, 'synthesize', e)
+            metrics.inc('stage_total', stage='synthesize', outcome='error')
+            raise
+        # the cover only needs the subtitles, it is generated while the audio is synthesized
+        self.publisher.prefetch_cover(key_name)
         self.logger.info(f"Synthesizing part {part_number} in {n} language")
-        self.logger.info(f"Synthesis response: {response}")
-        self.logger.info(f"Synthesized audio file: {key_name}/audio.wav")
-        return key_name
+        self.logger.info(f"Synthesis operation: {response.operation.name}")
+        future = self.tts_tracker.submit(key_name, response)
+        future.add_done_callback(lambda f: self._record_synthesis(part_number, language_code, key_name, f, started))
+        return future
+
+    def _record_synthesis(self, part_number, language_code, key_name, future, started=None):
+        if started is not None:
+            # from the request to audio.wav landing, the stage itself only holds a slot while submitting
+            metrics.observe('stage_seconds', time.monotonic() - started, stage='synthesize')
+            metrics.inc('stage_total', stage='synthesize', outcome='error' if future.exception() else 'ok')
+        if future.exception():
+            self.ledger.fail(self.config.id, part_number, language_code, 'synthesize', future.exception())
+        else:
+            # TTS writes audio.wav itself, the catalog only learns of it here
+            self.publisher.catalog.record(f'{key_name}/audio.wav')
+            self.ledger.finish(self.config.id, part_number, language_code, 'synthesize',
+                               output_key=f'{key_name}/audio.wav')
+
+    def _render(self, key):
+        part_number, language_code = self._parse_key(key)
+        self.ledger.start(self.config.id, part_number, language_code, 'render')
+        try:
+            tmp_file = self.publisher.render_video(key=key)
+        except Exception as e:
+            self.ledger.fail(self.config.id, part_number, language_code, 'render', e)
+            raise
+        self.ledger.finish(self.config.id, part_number, language_code, 'render', output_key=tmp_file)
+        if not tmp_file:
+            # render_video found the video already in the bucket or streamed it there
+            self.publisher.release_workspace(key)
+            self.ledger.finish(self.config.id, part_number, language_code, 'upload',
+                               output_key=f'{key}/staging_video.mp4')
+            return None
+        return key, tmp_file
+
+    def _upload(self, key, tmp_file):
+        part_number, language_code = self._parse_key(key)
+        self.ledger.start(self.config.id, part_number, language_code, 'upload')
+        try:
+            self.publisher.upload_video(key, tmp_file)
+        except Exception as e:
+            self.ledger.fail(self.config.id, part_number, language_code, 'upload', e)
+            raise
+        self.ledger.finish(self.config.id, part_number, language_code, 'upload', output_key=f'{key}/staging_video.mp4')
+        return key
@@ -0,0 +1,146 @@
+"""
+Stage-based asyncio executor used by the content curator.
+
+Each stage pulls items from a bounded queue, runs its blocking handler on a
+shared thread pool and pushes the results onto the next stage's queue, so a
+chunk can be translating while an earlier one is still rendering.
+"""
+import asyncio
+import concurrent.futures
+import logging
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from utils.metrics import metrics
+
+# Marks the end of the stream on a stage queue; one is sent per consumer.
+_DONE = object()
+
+
+def _describe(item: Any, limit: int = 80) -> str:
+    text = repr(item)
+    return text if len(text) <= limit else text[:limit] + '...'
+
+
+class Stage:
+    """
+    A named pipeline step with its own concurrency limit.
+
+    Args:
+        name: Stage name used in logs and stats
+        handler: Blocking callable taking one item; returning None drops the item. A handler may return a
+            ``concurrent.futures.Future`` to hand its result on later without holding a concurrency slot
+        concurrency: Maximum number of items this stage works on at once
+        fan_out: If True the handler returns an iterable and every element is passed on separately
+    """
+
+    def __init__(self, name: str, handler: Callable[[Any], Any], concurrency: int = 1, fan_out: bool = False):
+        if concurrency < 1:
+            raise ValueError(f"Invalid concurrency for stage {name}: {concurrency}")
+        self.name = name
+        self.handler = handler
+        self.concurrency = concurrency
+        self.fan_out = fan_out
+        self.processed = 0
+        self.failed = 0
+
+
+class StagePipeline:
+    """
+    Runs items through a list of stages connected by bounded queues.
+
+    Args:
+        stages: Stages in execution order
+        queue_size: Maximum number of items waiting in front of each stage
+        logger: Logger used to report failed items
+    """
+
+    def __init__(self, stages: List[Stage], queue_size: int = 8, logger: Optional[logging.Logger] = None):
+        if not stages:
+            raise ValueError("A pipeline needs at least one stage")
+        self.stages = stages
+        self.queue_size = queue_size
+        self.logger = logger or logging.getLogger(__name__)
+
+    def run(self, items: Iterable[Any]) -> Dict[str, Dict[str, int]]:
+        """Feed all items through the pipeline and block until every stage has drained."""
+        return asyncio.run(self.run_async(items))
+
+    async def run_async(self, items: Iterable[Any]) -> Dict[str, Dict[str, int]]:
+        loop = asyncio.get_running_loop()
+        queues = [asyncio.Queue(maxsize=self.queue_size) for _ in self.stages]
+        # one extra thread so that pulling from the source never waits on a busy stage
+        max_workers = sum(stage.concurrency for stage in self.stages) + 1
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            tasks = []
+            for i, stage in enumerate(self.stages):
+                next_stage = self.stages[i + 1] if i + 1 < len(self.stages) else None
+                next_queue = queues[i + 1] if next_stage else None
+                tasks.append(asyncio.ensure_future(
+                    self._run_stage(loop, executor, stage, queues[i], next_queue, next_stage)))
+            await self._feed(loop, executor, items, queues[0], self.stages[0].concurrency)
+            await asyncio.gather(*tasks)
+        return self.stats()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {stage.name: {'processed': stage.processed, 'failed': stage.failed} for stage in self.stages}
+
+    async def _feed(self, loop, executor, items, queue, consumers):
+        iterator = iter(items)
+        while True:
+            # the source may read files lazily, keep that off the event loop
+            item = await loop.run_in_executor(executor, next, iterator, _DONE)
+            if item is _DONE:
+                break
+            await queue.put(item)
+        for _ in range(consumers):
+            await queue.put(_DONE)
+
+    async def _run_stage(self, loop, executor, stage, in_queue, out_queue, next_stage):
+        deferred = []
+        await asyncio.gather(*[self._work(loop, executor, stage, in_queue, out_queue, deferred)
+                               for _ in range(stage.concurrency)])
+        await asyncio.gather(*deferred)
+        if out_queue is not None:
+            for _ in range(next_stage.concurrency):
+                await out_queue.put(_DONE)
+
+    async def _work(self, loop, executor, stage, in_queue, out_queue, deferred):
+        while True:
+            item = await in_queue.get()
+            if item is _DONE:
+                return
+            self._depth(stage, in_queue)
+            try:
+                result = await loop.run_in_executor(executor, stage.handler, item)
+            except Exception as e:
+                stage.failed += 1
+                self.logger.error(f"Stage {stage.name} failed for {_describe(item)}: {e}")
+                continue
+            if isinstance(result, concurrent.futures.Future):
+                deferred.append(asyncio.ensure_future(self._forward(stage, item, result, out_queue)))
+                continue
+            await self._emit(stage, result, out_queue)
+
+    async def _forward(self, stage, item, future, out_queue):
+        try:
+            result = await asyncio.wrap_future(future)
+        except Exception as e:
+            stage.failed += 1
+            self.logger.error(f"Stage {stage.name} failed for {_describe(item)}: {e}")
+            return
+        await self._emit(stage, result, out_queue)
+
+    @staticmethod
+    def _depth(stage, queue):
+        # sampled as items are taken, a queue that stays full points at the stage as the bottleneck
+        depth = queue.qsize()
+        metrics.set('queue_depth', depth, stage=stage.name)
+        metrics.set_max('queue_depth_max', depth, stage=stage.name)
+
+    async def _emit(self, stage, result, out_queue):
+        stage.processed += 1
+        if result is None or out_queue is None:
+            return
+        for output in (result if stage.fan_out else [result]):
+            if output is not None:
+                await out_queue.put(output)
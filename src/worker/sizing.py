@@ -0,0 +1,100 @@
+"""
+Learned output sizes of translations per target language.
+
+Scripts tokenize very differently, so a Malayalam translation can need several
+times the output tokens of a Hindi one for the same source verse. The ratios are
+learned from the token usage Gemini reports and used to split a request before
+sending it when its translations would not fit in ``max_output_tokens``. They
+are kept on disk between runs, so the chunk budget of new content is sized from
+them instead of from ``DEFAULT_OUTPUT_TOKEN_RATIO``.
+"""
+import json
+import os
+import threading
+from typing import Dict, Iterable, Optional
+
+from config import DEFAULT_OUTPUT_TOKEN_RATIO
+from utils.temp_utils import get_temp_dir
+
+
+def ratios_path() -> str:
+    """$OUTPUT_RATIOS_PATH or a file next to the translation cache in the itihasa temp directory."""
+    return os.getenv("OUTPUT_RATIOS_PATH") or os.path.join(get_temp_dir('cache'), 'output_ratios.json')
+
+
+class OutputRatios:
+    """
+    Moving average of output tokens per input token for every language code.
+
+    Args:
+        default: Ratio assumed for a language until it has been observed
+        smoothing: Weight of a new observation in the moving average
+        path: JSON file the ratios are loaded from and saved to, None to keep them in memory only
+    """
+
+    def __init__(self, default: float = DEFAULT_OUTPUT_TOKEN_RATIO, smoothing: float = 0.3,
+                 path: Optional[str] = None):
+        self.default = default
+        self.smoothing = smoothing
+        self.path = path
+        self._ratios: Dict[str, float] = self._load(path) if path else {}
+        self._lock = threading.Lock()
+
+    def ratio(self, language_code: str) -> float:
+        with self._lock:
+            return self._ratios.get(language_code, self.default)
+
+    def combined(self, language_codes: Iterable[str]) -> float:
+        """Output tokens expected per input token for translating into every one of the languages."""
+        return sum(self.ratio(code) for code in language_codes)
+
+    def expected(self, language_codes: Iterable[str], input_tokens: int) -> int:
+        """Output tokens expected for translating ``input_tokens`` into every one of the languages."""
+        return int(self.combined(language_codes) * input_tokens)
+
+    def observe(self, input_tokens: int, translations: Dict[str, str], output_tokens: Optional[int] = None):
+        """
+        Record the translations returned for an input of ``input_tokens`` tokens.
+
+        ``output_tokens`` is the response's reported output token count, shared between the languages by
+        the length of their translation; without it every translation's length is used as an estimate.
+        """
+        lengths = {code: len(text) for code, text in translations.items() if text}
+        total = sum(lengths.values())
+        if not total or input_tokens <= 0:
+            return
+        with self._lock:
+            for code, length in lengths.items():
+                tokens = output_tokens * length / total if output_tokens else length / 4 + 1
+                sample = tokens / input_tokens
+                previous = self._ratios.get(code)
+                self._ratios[code] = sample if previous is None \
+                    else previous + self.smoothing * (sample - previous)
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return {code: round(ratio, 2) for code, ratio in self._ratios.items()}
+
+    def save(self):
+        """Write the ratios to ``path`` for later runs."""
+        if not self.path:
+            return
+        # written to a temporary file first so a crash never leaves a truncated file behind
+        with self._lock:
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'w') as file:
+                json.dump(self._ratios, file, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def _load(path: str) -> Dict[str, float]:
+        # a missing or unreadable file only means starting from the default again
+        try:
+            with open(path) as file:
+                ratios = json.load(file)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(ratios, dict):
+            return {}
+        return {code: float(ratio) for code, ratio in ratios.items()
+                if isinstance(ratio, (int, float)) and ratio > 0}
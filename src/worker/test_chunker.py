@@ -0,0 +1,77 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from worker.chunker import VerseChunker
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data', 'mahabharat')
+
+SAMPLE = """  नारायणं नमस्कृत्य नरं चैव नरॊत्तमम
+       देवीं सरस्वतीं चैव ततॊ जयम उदीरयेत
+  लॊमहर्षणपुत्र उग्रश्रवाः सूतः
+   [सूत]
+       जनमेजयस्य राजर्षेः सर्पसत्रे महात्मनः
+       समीपे पार्थिवेन्द्रस्य सम्यक पारिक्षितस्य च
+  कृष्णद्वैपायन परॊक्ताः सुपुण्या विविधाः कथाः"""
+
+
+class TestVerseChunker(unittest.TestCase):
+
+    def test_iter_verses(self):
+        verses = list(VerseChunker(100).iter_verses(SAMPLE.splitlines()))
+        self.assertEqual(len(verses), 4)
+        self.assertEqual([speaker for speaker, _ in verses], [False, False, True, False])
+        self.assertEqual(verses[0][1].count('\n'), 1)
+        # the speaker tag stays with the verse it introduces
+        self.assertTrue(verses[2][1].startswith('   [सूत]\n       जनमेजयस्य'))
+
+    def test_blank_lines_separate_verses(self):
+        verses = list(VerseChunker(100).iter_verses(['line one', '', 'line two', 'line three']))
+        self.assertEqual([text for _, text in verses], ['line one', 'line two', 'line three'])
+
+    def test_chunks_never_split_verses(self):
+        chunker = VerseChunker(max_tokens=30, count_tokens=lambda text: len(text.splitlines()) * 10)
+        chunks = list(chunker.iter_chunks([('a.txt', SAMPLE.splitlines())]))
+        self.assertEqual('\n'.join(chunk.text for chunk in chunks), SAMPLE)
+        for chunk in chunks:
+            self.assertLessEqual(chunk.tokens, 30)
+            self.assertTrue(chunk.text.startswith('  ') and not chunk.text.startswith('       '))
+
+    def test_prefers_speaker_boundaries(self):
+        chunker = VerseChunker(max_tokens=40, count_tokens=lambda text: len(text.splitlines()) * 10)
+        chunks = list(chunker.iter_chunks([('a.txt', SAMPLE.splitlines())]))
+        self.assertEqual(chunks[1].text.splitlines()[0], '   [सूत]')
+
+    def test_fills_across_files(self):
+        chunker = VerseChunker(max_tokens=50, count_tokens=lambda text: 10)
+        sources = [('a.txt', ['  one', '  two']), ('b.txt', ['  three']), ('c.txt', ['  four', '  five', '  six'])]
+        chunks = list(chunker.iter_chunks(sources))
+        self.assertEqual([(c.source_file, c.index, c.text.count('\n') + 1) for c in chunks],
+                         [('a.txt', 0, 5), ('c.txt', 0, 1)])
+
+    def test_split_halves_on_verse_boundaries(self):
+        chunker = VerseChunker(2000)
+        first, second = chunker.split(SAMPLE)
+        self.assertEqual(first + '\n' + second, SAMPLE)
+        self.assertTrue(second.startswith('   [सूत]') or second.startswith('  कृष्ण'))
+        # a single verse is cut between its lines, a single line cannot be cut
+        self.assertEqual(chunker.split('  one\n       two'), ['  one', '       two'])
+        self.assertEqual(chunker.split('  one'), ['  one'])
+
+    def test_corpus_chunks_are_evenly_filled(self):
+        files = sorted(os.listdir(DATA_DIR))
+        sources = []
+        for name in files:
+            with open(os.path.join(DATA_DIR, name), encoding='utf-8') as f:
+                sources.append((name, f.read().splitlines()))
+        chunks = list(VerseChunker(max_tokens=2000).iter_chunks(sources))
+        self.assertLess(len(chunks), len(files) * 0.6)
+        for chunk in chunks[:-1]:
+            self.assertGreaterEqual(chunk.tokens, 1500)
+            self.assertLessEqual(chunk.tokens, 2000)
+
+
+if __name__ == '__main__':
+    unittest.main()
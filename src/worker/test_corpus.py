@@ -0,0 +1,73 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from worker.chunker import VerseChunker
+from worker.corpus import CorpusReader, iter_lines
+
+VERSE = "  first line of a verse\n       second line of the verse\n"
+
+
+class TestCorpusReader(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmp.name, 'source')
+        os.makedirs(os.path.join(self.source, 'book2'))
+        self.index_path = os.path.join(self.tmp.name, 'index.json')
+        self.reader = CorpusReader(self.source, index_path=self.index_path)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _write(self, name, text):
+        path = os.path.join(self.source, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def test_iter_lines(self):
+        path = self._write('a.txt', "one\r\ntwo\n\nthree")
+        self.assertEqual(list(iter_lines(path)), ['one', 'two', '', 'three'])
+        self.assertEqual(list(iter_lines(self._write('empty.txt', ''))), [])
+
+    def test_iter_files_walks_sorted_and_skips_changelog(self):
+        self._write('b.txt', VERSE)
+        self._write('a.txt', VERSE)
+        self._write('changelog', 'notes')
+        self._write(os.path.join('book2', 'c.txt'), VERSE)
+        self.assertEqual([name for name, _ in self.reader.iter_files()], ['a.txt', 'b.txt', 'c.txt'])
+        self.assertEqual(list(CorpusReader(os.path.join(self.source, 'a.txt')).iter_files()),
+                         [('a.txt', os.path.join(self.source, 'a.txt'))])
+
+    def test_count_parts_matches_chunker(self):
+        self._write('a.txt', VERSE * 30)
+        self._write('b.txt', VERSE * 7)
+        chunker = VerseChunker(200)
+        expected = len(list(chunker.iter_chunks(self.reader.iter_sources())))
+        self.assertEqual(self.reader.count_parts(chunker), expected)
+        self.assertEqual(self.reader.count_parts(), 2)
+
+    def test_count_parts_reuses_index_for_unchanged_files(self):
+        self._write('a.txt', VERSE * 30)
+        chunker = VerseChunker(200)
+        self.assertEqual(self.reader.count_parts(chunker), 3)
+        with open(self.index_path) as f:
+            self.assertEqual(len(json.load(f)['files']), 1)
+
+        with patch.object(CorpusReader, '_scan', side_effect=AssertionError('rescanned')):
+            self.assertEqual(self.reader.count_parts(chunker), 3)
+
+        # a changed file is scanned again
+        self._write('a.txt', VERSE * 60)
+        self.assertEqual(self.reader.count_parts(chunker), len(list(chunker.iter_chunks(self.reader.iter_sources()))))
+        self.assertGreater(self.reader.count_parts(chunker), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
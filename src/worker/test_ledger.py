@@ -0,0 +1,81 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from worker.ledger import JobLedger, DONE, FAILED, RUNNING
+
+
+class TestJobLedger(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'jobs.db')
+        self.ledger = JobLedger(self.path)
+
+    def tearDown(self):
+        self.ledger.close()
+        self.tmp.cleanup()
+
+    def _assign(self, source_file, count, first_part=1):
+        return [self.ledger.assign_part('m', source_file, i, first_part) for i in range(count)]
+
+    def test_assign_part_is_stable(self):
+        self.assertEqual(self._assign('a.txt', 3), [1, 2, 3])
+        self.assertEqual(self._assign('b.txt', 2), [4, 5])
+        self.assertEqual(self._assign('a.txt', 3, first_part=100), [1, 2, 3])
+        # a file that grew keeps its old parts and numbers the new chunks after everything else
+        self.assertEqual(self._assign('a.txt', 4), [1, 2, 3, 6])
+
+    def test_assign_part_honours_first_part(self):
+        self.assertEqual(self._assign('a.txt', 2, first_part=135), [135, 136])
+
+    def test_changed_chunk_keeps_its_part_and_is_redone(self):
+        self.assertEqual(self.ledger.assign_part('m', 'a.txt', 0, 1, chunk_hash='x', languages=['hi-IN']), 1)
+        self.ledger.finish('m', 1, 'hi-IN', 'upload')
+        self.assertEqual(self.ledger.assign_part('m', 'a.txt', 0, 1, chunk_hash='x', languages=['hi-IN']), 1)
+        self.assertTrue(self.ledger.is_done('m', 1, 'hi-IN', 'upload'))
+        self.assertEqual(self.ledger.assign_part('m', 'a.txt', 0, 1, chunk_hash='y', languages=['hi-IN']), 1)
+        self.assertFalse(self.ledger.is_done('m', 1, 'hi-IN', 'upload'))
+        self.assertEqual(self.ledger.assign_part('m', 'a.txt', 1, 1, chunk_hash='z', languages=['hi-IN']), 2)
+
+    def test_languages_and_sources_are_numbered_apart(self):
+        # the Hindi and Tamil manifests share the content id mahabharat
+        tamil = [self.ledger.assign_part('mahabharat', 'f.txt', i, 135, source='tamil', languages=['ta-IN'])
+                 for i in range(3)]
+        hindi = [self.ledger.assign_part('mahabharat', 'f.txt', i, 45, source='hindi', languages=['hi-IN'])
+                 for i in range(3)]
+        self.assertEqual(tamil, [135, 136, 137])
+        self.assertEqual(hindi, [45, 46, 47])
+        self.assertEqual(self.ledger.assign_part('mahabharat', 'g.txt', 0, 45, source='hindi', languages=['hi-IN']),
+                         48)
+
+    def test_chunk_budget_is_kept(self):
+        self.assertEqual(self.ledger.chunk_budget('m', 900, languages=['ml-IN']), 900)
+        self.assertEqual(self.ledger.chunk_budget('m', 400, languages=['ml-IN']), 900)
+        self.assertEqual(self.ledger.chunk_budget('m', 400, languages=['hi-IN']), 400)
+
+    def test_job_lifecycle(self):
+        self.assertIsNone(self.ledger.status('m', 1, 'ta-IN', 'render'))
+        self.ledger.start('m', 1, 'ta-IN', 'render')
+        self.assertEqual(self.ledger.status('m', 1, 'ta-IN', 'render'), RUNNING)
+        self.ledger.fail('m', 1, 'ta-IN', 'render', 'ffmpeg crashed')
+        self.assertEqual(self.ledger.status('m', 1, 'ta-IN', 'render'), FAILED)
+        self.ledger.start('m', 1, 'ta-IN', 'render')
+        self.ledger.finish('m', 1, 'ta-IN', 'render', output_key='/tmp/video.mp4')
+        self.assertTrue(self.ledger.is_done('m', 1, 'ta-IN', 'render'))
+        self.assertEqual(self.ledger.summary('m'), [('ta-IN', 'render', DONE, 1, 1)])
+        attempts = self.ledger._conn.execute("SELECT attempts FROM jobs").fetchone()[0]
+        self.assertEqual(attempts, 2)
+
+    def test_survives_reopen(self):
+        self.ledger.finish('m', 3, 'hi-IN', 'upload', output_key='hi-IN/m/part-3/staging_video.mp4')
+        self.ledger.close()
+        self.ledger = JobLedger(self.path)
+        self.assertTrue(self.ledger.is_done('m', 3, 'hi-IN', 'upload'))
+
+
+if __name__ == '__main__':
+    unittest.main()
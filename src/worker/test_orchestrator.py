@@ -1,7 +1,8 @@
 import unittest
 import sys
 import os
-from unittest.mock import patch, MagicMock, mock_open
+import tempfile
+from unittest.mock import patch, MagicMock
 
 # Add the project root to the path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
@@ -15,17 +16,24 @@ with patch('vertexai.init'), \
      patch('src.publisher.Publisher'):
     # Now import the modules
     from src.worker.orchestrator import ContentCurator, ContentConfig
+    from src.utils.rate_limit import estimate_tokens
 
 
 class TestContentCurator(unittest.TestCase):
 
     def setUp(self):
         # Mock the environment variables
+        self.tmp = tempfile.TemporaryDirectory()
         self.patcher = patch.dict('os.environ', {
             'GCP_PARENT_PROJECT': 'test-project',
             'GCP_LOCATION': 'us-central1',
             'VERTEX_MODEL_ID': 'gemini-2.0-flash-001',
-            'GCS_BUCKET': 'gs://test-bucket'
+            'GCS_BUCKET': 'gs://test-bucket',
+            'TRANSLATION_CACHE_PATH': os.path.join(self.tmp.name, 'translations.db'),
+            'JOB_LEDGER_PATH': os.path.join(self.tmp.name, 'jobs.db'),
+            'CORPUS_INDEX_PATH': os.path.join(self.tmp.name, 'index.json'),
+            'OUTPUT_RATIOS_PATH': os.path.join(self.tmp.name, 'output_ratios.json'),
+            'METRICS_DIR': os.path.join(self.tmp.name, 'metrics')
         })
         self.patcher.start()
         
@@ -50,7 +58,8 @@ class TestContentCurator(unittest.TestCase):
              patch('google.cloud.texttospeech.TextToSpeechLongAudioSynthesizeClient') as MockTTSClient, \
              patch('google.cloud.storage.Client') as MockStorageClient, \
              patch('vertexai.vision_models.ImageGenerationModel') as MockImageModel, \
-             patch('src.publisher.Publisher') as MockPublisher:
+             patch('src.publisher.Publisher'), \
+             patch('src.worker.orchestrator.Publisher') as MockPublisher:
             
             # Configure the mocks
             self.mock_gen_model = MockGenModel.return_value
@@ -68,9 +77,18 @@ class TestContentCurator(unittest.TestCase):
             
             # Create the curator instance
             self.curator = ContentCurator(self.config)
+            # the patched model class is shared between tests, give every test its own instance
+            self.curator.gen_model = MagicMock()
+            # clients are created on first use, outside these patches they would be real ones
+            self.curator.tts_client = self.mock_tts_client
+            # the process-wide vertex budget would make tests with many model calls wait for it to refill
+            self.curator.vertex_limiter = MagicMock()
     
     def tearDown(self):
         self.patcher.stop()
+        self.curator.ledger.close()
+        self.curator.translation_cache.close()
+        self.tmp.cleanup()
 
     def test_initialization(self):
         self.assertEqual(self.curator.config, self.config)
@@ -79,46 +97,197 @@ class TestContentCurator(unittest.TestCase):
         self.assertIsNotNone(self.curator.audio_config)
         self.assertIsNotNone(self.curator.job_id)
 
-    def test_chunkify(self):
-        text = "This is a test text. \n" * 100
-        chunks = self.curator.chunkify(text, max_lines_per_chunk=10, overlap=0.1)
-        self.assertTrue(len(chunks) > 1)
-        self.assertTrue(all(chunk in text for chunk in chunks))
-        self.assertTrue(all(chunk.count('\n') >= 1 for chunk in chunks))
-        self.assertTrue(all(chunk.count('\n') <= 10 for chunk in chunks))
-
-    @patch('os.path.isfile', return_value=True)
-    @patch('builtins.open', new_callable=mock_open, read_data="This is a test text.")
-    def test_curate_file(self, mock_file, mock_isfile):
-        # Mock the _process method to prevent actual processing
-        with patch.object(self.curator, '_process') as mock_process:
-            self.curator.curate()
-            mock_file.assert_called_once_with('/path/to/source', 'r')
-            mock_process.assert_called_once()
-
-    @patch('os.path.isfile', return_value=False)
-    @patch('os.walk', return_value=[('/path/to/source', [], ['file1.txt'])])
-    @patch('builtins.open', new_callable=mock_open, read_data="This is a test text.")
-    def test_curate_directory(self, mock_file, mock_walk, mock_isfile):
-        # Mock the _process method to prevent actual processing
-        with patch.object(self.curator, '_process') as mock_process:
-            self.curator.curate()
-            mock_file.assert_called_once_with('/path/to/source/file1.txt', 'r')
-            mock_process.assert_called_once()
+    def _write(self, name, text):
+        path = os.path.join(self.tmp.name, 'source', name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def test_iter_sources_file(self):
+        self.curator.corpus.source_path = self._write('file1.txt', "This is a test text.")
+        sources = [(name, list(lines)) for name, lines in self.curator._iter_sources()]
+        self.assertEqual(sources, [('file1.txt', ['This is a test text.'])])
+
+    def test_iter_sources_directory(self):
+        self._write('file2.txt', "second\n")
+        self._write('file1.txt', "This is a test text.")
+        self._write('changelog', "read up to file1")
+        self.curator.corpus.source_path = os.path.join(self.tmp.name, 'source')
+        sources = [(name, list(lines)) for name, lines in self.curator._iter_sources()]
+        self.assertEqual(sources, [('file1.txt', ['This is a test text.']), ('file2.txt', ['second'])])
+
+    def test_iter_chunks_counts_parts_from_index(self):
+        self._write('a.txt', "  first line of a verse\n       second line of the verse\n" * 30)
+        self.curator.corpus.source_path = os.path.join(self.tmp.name, 'source')
+        self.curator.config.max_input_tokens = 200
+        self.assertEqual([n for n, _ in self.curator._iter_chunks()], [1, 2, 3])
+        self.assertEqual(self.curator.total_parts, 3)
+
+    def _sources(self, *names):
+        verse = ["  first line of a verse", "       second line of the verse"]
+        return [(name, verse * 30) for name in names]
+
+    def test_iter_chunks(self):
+        self.curator.config.max_input_tokens = 200
+        with patch.object(self.curator, '_iter_sources', return_value=self._sources('a.txt')):
+            items = list(self.curator._iter_chunks())
+        self.assertEqual([n for n, _ in items], [1, 2, 3])
+        self.assertTrue(all(text.startswith('  first line') for _, text in items))
 
-    @patch.object(ContentCurator, '_translate')
-    def test_process(self, mock_translate):
-        text = "This is a test text. " * 100
-        
-        # Test with split_into_parts = True
-        self.curator._process(text)
-        self.assertTrue(mock_translate.called)
-        
         # Test with split_into_parts = False
-        mock_translate.reset_mock()
         self.curator.config.split_into_parts = False
-        self.curator._process(text)
-        mock_translate.assert_called_once_with(0, text)
+        with patch.object(self.curator, '_iter_sources', return_value=[('a.txt', ['one', 'two'])]):
+            self.assertEqual(list(self.curator._iter_chunks()), [(0, 'one\ntwo')])
+
+    @patch.object(ContentCurator, '_synthesize', side_effect=lambda n, tx, lang: f'en-US/test_id/Test Content-part-{n}')
+    @patch.object(ContentCurator, '_translate', side_effect=lambda n, text: [(n, 'English', text)])
+    def test_curate_runs_all_stages(self, mock_translate, mock_synthesize):
+        self.curator.publisher = MagicMock()
+        self.curator.publisher.render_video.side_effect = lambda key: f'/tmp/{key[-6:]}.mp4'
+        with patch.object(self.curator, '_iter_chunks', return_value=iter([(1, 'a'), (2, 'b')])):
+            self.curator.curate()
+        self.curator.publisher.sync_catalog.assert_called_once_with('en-US/test_id/Test Content')
+        self.assertEqual(mock_translate.call_count, 2)
+        self.assertEqual(mock_synthesize.call_count, 2)
+        self.curator.publisher.upload_video.assert_any_call('en-US/test_id/Test Content-part-1', '/tmp/part-1.mp4')
+        self.curator.publisher.upload_video.assert_any_call('en-US/test_id/Test Content-part-2', '/tmp/part-2.mp4')
+        self.assertTrue(self.curator.ledger.is_done('test_id', 2, 'en-US', 'upload'))
+        self.assertEqual(sorted(os.listdir(os.path.join(self.tmp.name, 'metrics'))),
+                         ['itihasa.prom', f'run-{self.curator.job_id}.json'])
+
+    def test_iter_chunks_resumes_from_ledger(self):
+        self.curator.config.max_input_tokens = 200
+        with patch.object(self.curator, '_iter_sources', return_value=self._sources('a.txt')):
+            self.assertEqual([n for n, _ in self.curator._iter_chunks()], [1, 2, 3])
+        self.curator.ledger.finish('test_id', 1, 'en-US', 'upload')
+        self.curator.ledger.finish('test_id', 3, 'en-US', 'upload')
+
+        # a rerun keeps the part numbers of known chunks and skips published parts, the last chunk of
+        # a.txt now continues into b.txt and is published again under its own part number
+        with patch.object(self.curator, '_iter_sources', return_value=self._sources('a.txt', 'b.txt')):
+            self.assertEqual([n for n, _ in self.curator._iter_chunks()], [2, 3, 4, 5])
+
+    def test_new_content_is_chunked_with_the_learned_ratios(self):
+        self.curator.config.max_output_tokens = 300
+        self.curator.output_ratios.observe(10, {'en-US': 'a' * 30}, output_tokens=30)
+        self.curator.output_ratios.save()
+        with patch.object(self.curator, '_iter_sources', return_value=self._sources('a.txt')):
+            chunks = list(self.curator._iter_chunks())
+        # 300 output tokens at 3 per input token rather than the default 1.5
+        self.assertEqual(self.curator.chunk_tokens, 100)
+        self.assertTrue(all(estimate_tokens(text) <= 100 for _, text in chunks))
+
+        # a later run has learned a different ratio but cuts the content it already numbered the same way
+        curator = ContentCurator(self.config)
+        self.assertAlmostEqual(curator.output_ratios.ratio('en-US'), 3.0)
+        curator.output_ratios.observe(10, {'en-US': 'a' * 10}, output_tokens=10)
+        self.assertEqual(curator.chunk_tokens, 100)
+        curator.ledger.close()
+        curator.translation_cache.close()
+
+    def test_translate_skips_synthesized_languages(self):
+        self.curator.ledger.finish('test_id', 7, 'en-US', 'synthesize')
+        self.assertEqual(self.curator._translate(7, 'text'), [(7, 'English', None)])
+        self.curator.gen_model.generate_content.assert_not_called()
+
+    def test_pack_groups_chunks_by_token_budget(self):
+        self.curator.config.pack_tokens = 10
+        packs = list(self.curator._pack([(1, 'a' * 16), (2, 'b' * 16), (3, 'c' * 40), (4, 'd')]))
+        self.assertEqual([[n for n, _ in pack] for pack in packs], [[1, 2], [3], [4]])
+
+    def test_pack_closes_before_the_output_budget(self):
+        self.curator.config.pack_tokens = 100
+        self.curator.config.max_output_tokens = 30
+        # 3 output tokens per input token, three 4 token chunks already need 36
+        self.curator.output_ratios.observe(10, {'en-US': 'a' * 30}, output_tokens=30)
+        packs = list(self.curator._pack([(n, 'a' * 16) for n in range(1, 6)]))
+        self.assertEqual([[n for n, _ in pack] for pack in packs], [[1, 2], [3, 4], [5]])
+
+    def test_packed_request_uses_the_output_budget(self):
+        self.curator.config.max_output_tokens = 1234
+        with patch.object(self.curator, '_generate', return_value=MagicMock(answer={})) as generate, \
+                patch.object(self.curator, '_request_translation', return_value={}):
+            self.curator._request_translations([(1, 'eka'), (2, 'dvi')], {'English': 'en-US'})
+        self.assertEqual(generate.call_args[0][1], 1234)
+
+    def test_translate_pack_splits_answers_per_part(self):
+        response = MagicMock()
+        response.text = '{"answer": {"1": {"en-US": "one"}, "2": {"en-US": "two"}}}'
+        self.curator.gen_model.generate_content.return_value = response
+        translations = self.curator._translate_pack([(1, 'eka'), (2, 'dvi')])
+        self.assertEqual(sorted(translations), [(1, 'English', 'one'), (2, 'English', 'two')])
+        self.curator.gen_model.generate_content.assert_called_once()
+        # both chunks are now cached and translate without another request
+        self.assertEqual(sorted(self.curator._translate_pack([(1, 'eka'), (2, 'dvi')])),
+                         [(1, 'English', 'one'), (2, 'English', 'two')])
+        self.curator.gen_model.generate_content.assert_called_once()
+
+    def _response(self, text):
+        response = MagicMock()
+        response.text = text
+        return response
+
+    def test_request_translation_retries_only_missing_languages(self):
+        self.curator.target_languages = self.curator.config.translations = ['Tamil', 'Hindi']
+        self.curator.gen_model.generate_content.side_effect = [
+            self._response('{"answer": {"ta-IN": "one", "hi-IN": "cut of'),
+            self._response('{"answer": {"hi-IN": "two"}}'),
+        ]
+        translations = self.curator._translate(1, 'eka')
+        self.assertEqual(sorted(translations), [(1, 'Hindi', 'two'), (1, 'Tamil', 'one')])
+        retry = self.curator.gen_model.generate_content.call_args_list[1][1]
+        self.assertIn("'Hindi': 'hi-IN'", retry['contents'])
+        self.assertNotIn("'Tamil'", retry['contents'])
+        self.assertEqual(retry['generation_config']._raw_generation_config.response_schema.required, ['answer'])
+
+    def test_translate_reuses_partial_cached_answer(self):
+        self.curator.target_languages = self.curator.config.translations = ['Tamil', 'Hindi']
+        self.curator.gen_model.generate_content.side_effect = [self._response('{"answer": {"ta-IN": "one"}}')] * 3
+        self.assertEqual(self.curator._translate(1, 'eka'), [(1, 'Tamil', 'one')])
+        self.assertEqual(self.curator.gen_model.generate_content.call_count, 3)
+
+        # a rerun only asks for Hindi, Tamil comes from the cache
+        self.curator.ledger.finish('test_id', 1, 'ta-IN', 'upload')
+        self.curator.gen_model.generate_content.side_effect = [self._response('{"answer": {"hi-IN": "two"}}')]
+        self.assertEqual(self.curator._translate(1, 'eka'), [(1, 'Hindi', 'two')])
+        self.assertNotIn("'Tamil'", self.curator.gen_model.generate_content.call_args[1]['contents'])
+
+    def _truncated(self, text):
+        response = self._response(text)
+        response.candidates[0].finish_reason.name = 'MAX_TOKENS'
+        return response
+
+    def test_truncated_answer_splits_languages_then_text(self):
+        self.curator.target_languages = self.curator.config.translations = ['Tamil', 'Hindi']
+        self.curator.gen_model.generate_content.side_effect = [
+            self._truncated('{"answer": {"ta-IN": "cut of'),
+            self._response('{"answer": {"ta-IN": "one"}}'),
+            # Hindi alone is still cut off, the chunk is split in half for it
+            self._truncated('{"answer": {"hi-IN": "cut'),
+            self._response('{"answer": {"hi-IN": "first"}}'),
+            self._response('{"answer": {"hi-IN": "second"}}'),
+        ]
+        text = '  verse one\n       continues\n  verse two'
+        translations = self.curator._translate(1, text)
+        self.assertEqual(sorted(translations), [(1, 'Hindi', 'first\nsecond'), (1, 'Tamil', 'one')])
+        halves = [call[1]['contents'] for call in self.curator.gen_model.generate_content.call_args_list[3:]]
+        self.assertIn('verse one', halves[0])
+        self.assertNotIn('verse two', halves[0])
+        self.assertIn('verse two', halves[1])
+
+    def test_learned_ratio_splits_languages_up_front(self):
+        self.curator.target_languages = self.curator.config.translations = ['Tamil', 'Hindi']
+        self.curator.config.max_output_tokens = 100
+        self.curator.output_ratios.observe(10, {'ta-IN': 'a' * 80}, output_tokens=80)
+        self.curator.gen_model.generate_content.side_effect = [
+            self._response('{"answer": {"ta-IN": "one"}}'),
+            self._response('{"answer": {"hi-IN": "two"}}'),
+        ]
+        self.assertEqual(sorted(self.curator._translate(1, 'eka ' * 40)), [(1, 'Hindi', 'two'), (1, 'Tamil', 'one')])
+        prompts = [call[1]['contents'] for call in self.curator.gen_model.generate_content.call_args_list]
+        self.assertNotIn("'Hindi'", prompts[0])
+        self.assertNotIn("'Tamil'", prompts[1])
 
 
 if __name__ == '__main__':
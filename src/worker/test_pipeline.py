@@ -0,0 +1,75 @@
+import concurrent.futures
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from worker.pipeline import Stage, StagePipeline
+
+
+class TestStagePipeline(unittest.TestCase):
+
+    def test_items_flow_through_all_stages(self):
+        pipeline = StagePipeline([
+            Stage('double', lambda x: x * 2, concurrency=2),
+            Stage('split', lambda x: [x, x + 1], fan_out=True),
+            Stage('collect', lambda x: x, concurrency=3),
+        ], queue_size=2)
+        results = []
+        pipeline.stages[-1].handler = lambda x: results.append(x) or x
+        stats = pipeline.run(range(5))
+        self.assertEqual(sorted(results), [0, 1, 2, 3, 4, 5, 6, 7, 8, 9])
+        self.assertEqual(stats['double'], {'processed': 5, 'failed': 0})
+        self.assertEqual(stats['collect']['processed'], 10)
+
+    def test_failed_and_dropped_items_do_not_stop_the_run(self):
+        def flaky(x):
+            if x == 2:
+                raise RuntimeError('boom')
+            return None if x == 3 else x
+
+        seen = []
+        stats = StagePipeline([Stage('flaky', flaky), Stage('sink', seen.append)]).run(range(5))
+        self.assertEqual(sorted(seen), [0, 1, 4])
+        self.assertEqual(stats['flaky'], {'processed': 4, 'failed': 1})
+
+    def test_stage_concurrency_is_bounded(self):
+        lock = threading.Lock()
+        active = {'now': 0, 'max': 0}
+
+        def slow(x):
+            with lock:
+                active['now'] += 1
+                active['max'] = max(active['max'], active['now'])
+            time.sleep(0.02)
+            with lock:
+                active['now'] -= 1
+            return x
+
+        StagePipeline([Stage('slow', slow, concurrency=3)]).run(range(12))
+        self.assertEqual(active['max'], 3)
+
+    def test_deferred_results_do_not_hold_a_slot(self):
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+        seen = []
+
+        def submit(x):
+            return pool.submit(lambda: time.sleep(0.05) or x)
+
+        start = time.monotonic()
+        stats = StagePipeline([Stage('submit', submit), Stage('sink', seen.append)]).run(range(4))
+        self.assertLess(time.monotonic() - start, 0.15)
+        self.assertEqual(sorted(seen), [0, 1, 2, 3])
+        self.assertEqual(stats['submit']['processed'], 4)
+        pool.shutdown()
+
+    def test_invalid_concurrency(self):
+        with self.assertRaises(ValueError):
+            Stage('bad', lambda x: x, concurrency=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from worker.sizing import OutputRatios
+
+
+class TestOutputRatios(unittest.TestCase):
+
+    def test_defaults_until_observed(self):
+        ratios = OutputRatios(default=1.5)
+        self.assertEqual(ratios.ratio('ta-IN'), 1.5)
+        self.assertEqual(ratios.expected(['ta-IN', 'hi-IN'], 100), 300)
+
+    def test_observe_shares_reported_tokens_by_length(self):
+        ratios = OutputRatios(default=1.5, smoothing=0.5)
+        ratios.observe(100, {'ta-IN': 'a' * 300, 'hi-IN': 'b' * 100}, output_tokens=400)
+        self.assertAlmostEqual(ratios.ratio('ta-IN'), 3.0)
+        self.assertAlmostEqual(ratios.ratio('hi-IN'), 1.0)
+        ratios.observe(100, {'ta-IN': 'a' * 100}, output_tokens=100)
+        self.assertAlmostEqual(ratios.ratio('ta-IN'), 2.0)
+        self.assertEqual(ratios.snapshot(), {'ta-IN': 2.0, 'hi-IN': 1.0})
+
+    def test_observe_estimates_without_usage(self):
+        ratios = OutputRatios()
+        ratios.observe(10, {'ta-IN': 'a' * 36})
+        self.assertAlmostEqual(ratios.ratio('ta-IN'), 1.0)
+        ratios.observe(0, {'hi-IN': 'text'})
+        ratios.observe(10, {'hi-IN': ''})
+        self.assertEqual(ratios.ratio('hi-IN'), ratios.default)
+
+    def test_ratios_are_kept_between_runs(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'output_ratios.json')
+            self.assertEqual(OutputRatios(path=path).snapshot(), {})
+            ratios = OutputRatios(path=path)
+            ratios.observe(100, {'ml-IN': 'a' * 100}, output_tokens=400)
+            ratios.save()
+            self.assertAlmostEqual(OutputRatios(path=path).ratio('ml-IN'), 4.0)
+            with open(path, 'w') as f:
+                f.write('{"ml-IN": ')
+            self.assertEqual(OutputRatios(path=path).snapshot(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
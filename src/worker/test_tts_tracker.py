@@ -0,0 +1,61 @@
+import os
+import sys
+import unittest
+from unittest.mock import MagicMock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from worker.tts_tracker import SynthesisTracker
+
+
+class FakeOperation:
+    def __init__(self, polls_until_done, error=None):
+        self.polls = 0
+        self.polls_until_done = polls_until_done
+        self.error = error
+
+    def done(self):
+        self.polls += 1
+        return self.polls >= self.polls_until_done
+
+    def exception(self):
+        return self.error
+
+
+class TestSynthesisTracker(unittest.TestCase):
+
+    def setUp(self):
+        self.bucket = MagicMock()
+        self.bucket.blob.return_value.exists.return_value = True
+        self.tracker = SynthesisTracker(self.bucket, initial_delay=0.001, max_delay=0.01, timeout=5)
+
+    def tearDown(self):
+        self.tracker.close()
+
+    def test_resolves_keys_when_audio_exists(self):
+        futures = [self.tracker.submit(f'ta-IN/m/part-{i}', FakeOperation(i + 1)) for i in range(5)]
+        self.assertEqual([f.result(timeout=5) for f in futures], [f'ta-IN/m/part-{i}' for i in range(5)])
+        self.bucket.blob.assert_any_call('ta-IN/m/part-4/audio.wav')
+        self.assertEqual(self.tracker.pending(), 0)
+
+    def test_failed_operation_sets_exception(self):
+        future = self.tracker.submit('key', FakeOperation(1, error=RuntimeError('quota')))
+        with self.assertRaises(RuntimeError):
+            future.result(timeout=5)
+
+    def test_waits_for_audio_after_operation_is_done(self):
+        self.bucket.blob.return_value.exists.side_effect = [False, False, True]
+        future = self.tracker.submit('key', FakeOperation(1))
+        self.assertEqual(future.result(timeout=5), 'key')
+        self.assertEqual(self.bucket.blob.return_value.exists.call_count, 3)
+
+    def test_times_out(self):
+        tracker = SynthesisTracker(self.bucket, initial_delay=0.001, max_delay=0.001, timeout=0.01)
+        future = tracker.submit('key', FakeOperation(10 ** 6))
+        with self.assertRaises(TimeoutError):
+            future.result(timeout=5)
+        tracker.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
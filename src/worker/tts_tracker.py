@@ -0,0 +1,114 @@
+"""
+Tracks long-audio synthesis operations without blocking the caller.
+
+Jobs are submitted as soon as the TTS request returns an operation and a single
+background thread polls all of them with exponential backoff. A job resolves
+once its operation is done and ``audio.wav`` is visible in the bucket.
+"""
+import concurrent.futures
+import logging
+import threading
+import time
+from typing import Optional
+
+
+class _Job:
+    def __init__(self, key, operation, delay, now, timeout):
+        self.key = key
+        self.operation = operation
+        self.future = concurrent.futures.Future()
+        self.delay = delay
+        self.next_poll = now + delay
+        self.deadline = now + timeout
+
+
+class SynthesisTracker:
+    """
+    Polls submitted long-audio operations together and resolves a future per key.
+
+    Args:
+        bucket: Bucket the operations write ``<key>/audio.wav`` into
+        logger: Logger used for progress and failures
+        initial_delay: Seconds before a new operation is polled for the first time
+        max_delay: Upper bound for the delay between two polls of the same operation
+        backoff: Factor the delay grows by after every poll that finds the job unfinished
+        timeout: Seconds after which an unfinished job is failed with a TimeoutError
+    """
+
+    def __init__(self, bucket, logger: Optional[logging.Logger] = None, initial_delay: float = 5.0,
+                 max_delay: float = 60.0, backoff: float = 1.5, timeout: float = 3600.0):
+        self.bucket = bucket
+        self.logger = logger or logging.getLogger(__name__)
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.backoff = backoff
+        self.timeout = timeout
+        self._jobs = []
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def submit(self, key: str, operation) -> concurrent.futures.Future:
+        """Start tracking an operation; the returned future resolves to ``key`` once audio.wav exists."""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Tracker is closed")
+            job = _Job(key, operation, self.initial_delay, time.monotonic(), self.timeout)
+            self._jobs.append(job)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._poll_loop, name='tts-tracker', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return job.future
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._jobs)
+
+    def close(self, wait: bool = True):
+        """Stop accepting jobs; with ``wait`` block until the outstanding ones are resolved."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if wait and self._thread is not None:
+            self._thread.join()
+
+    def _poll_loop(self):
+        while True:
+            with self._cond:
+                while not self._jobs and not self._closed:
+                    self._cond.wait()
+                if not self._jobs:
+                    return
+                now = time.monotonic()
+                next_poll = min(job.next_poll for job in self._jobs)
+                if next_poll > now:
+                    self._cond.wait(next_poll - now)
+                    continue
+                due = [job for job in self._jobs if job.next_poll <= now]
+            finished = [job for job in due if self._check(job)]
+            with self._cond:
+                self._jobs = [job for job in self._jobs if job not in finished]
+
+    def _check(self, job) -> bool:
+        # returns True once the job's future has been resolved one way or another
+        now = time.monotonic()
+        try:
+            if job.operation.done():
+                error = job.operation.exception()
+                if error:
+                    self.logger.error(f"Synthesis failed for {job.key}: {error}")
+                    job.future.set_exception(error)
+                    return True
+                if self.bucket.blob(f'{job.key}/audio.wav').exists():
+                    self.logger.info(f"Synthesized audio file: {job.key}/audio.wav")
+                    job.future.set_result(job.key)
+                    return True
+        except Exception as e:
+            self.logger.warning(f"Could not poll synthesis of {job.key}: {e}")
+        if now >= job.deadline:
+            job.future.set_exception(TimeoutError(f"Synthesis of {job.key} did not finish in {self.timeout}s"))
+            return True
+        job.delay = min(job.delay * self.backoff, self.max_delay)
+        job.next_poll = now + job.delay
+        return False